@@ -0,0 +1,171 @@
+from benchmarking.SyntheticPlant import createSyntheticSimulation, syntheticReferenceNames, MODEL_TYPES
+from benchmarking.report import latencySummary, writeResults
+from time import perf_counter, sleep
+import subprocess
+import argparse
+import asyncio
+import random
+import httpx
+import sys
+import os
+
+"""
+Load and latency benchmark for service/fastapi/Service.py and the
+SimulatorServer behind it.
+
+The service is started locally with uvicorn against a synthetic simulation
+built from tiny random-weight models. N concurrent async clients then issue a
+weighted mix of requests for a fixed duration and the throughput and latency
+percentiles of each kind of request are written as JSON.
+
+Run from the root folder:
+    python -m benchmarking.ServiceBenchmark --objects 9 --clients 16 --duration 30 --mix get=4,set=2,object_get=2,object_set=1
+"""
+
+OPERATIONS = ["get", "set", "object_get", "object_set"]
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        [name, weight] = item.split('=')
+        assert name in OPERATIONS, f"Unknown operation '{name}' in mix. Expected one of {OPERATIONS}"
+        weights[name] = float(weight)
+    return weights
+
+"""
+Builds the url of a random request of the given operation type.
+"""
+class RequestFactory:
+    def __init__(self, ref_names: dict[str, tuple[list[str], list[str]]], refs_per_get: int, seed: int):
+        self.ref_names = ref_names
+        self.objects = list(ref_names.keys())
+        self.all_readable = [f"{obj}.{ref}" for obj, (readable, _) in ref_names.items() for ref in readable]
+        self.refs_per_get = refs_per_get
+        self.rand = random.Random(seed)
+
+    def url(self, operation: str) -> str:
+        obj = self.rand.choice(self.objects)
+        readable, writeable = self.ref_names[obj]
+        match (operation):
+            case "get":
+                names = self.rand.sample(self.all_readable, min(self.refs_per_get, len(self.all_readable)))
+                return f"/get/{','.join(names)}"
+            case "set":
+                ref = self.rand.choice(writeable)
+                return f"/set/{obj}.{ref}={self.rand.randint(0, 1)}"
+            case "object_get":
+                return f"/{obj}/get/"
+            case "object_set":
+                ref = self.rand.choice(writeable)
+                return f"/{obj}/set/?{ref}={self.rand.randint(0, 1)}"
+
+async def client(base_url: str, factory: RequestFactory, weights: dict[str, float], deadline: float, samples: dict[str, list[float]], errors: dict[str, int]):
+    operations = list(weights.keys())
+    op_weights = [weights[op] for op in operations]
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as http:
+        while perf_counter() < deadline:
+            operation = factory.rand.choices(operations, op_weights)[0]
+            url = factory.url(operation)
+            start = perf_counter()
+            try:
+                response = await http.get(url)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            end = perf_counter()
+            if ok:
+                samples[operation].append(end - start)
+            else:
+                errors[operation] += 1
+
+async def run_clients(base_url: str, ref_names, weights: dict[str, float], clients: int, duration: float, refs_per_get: int, seed: int):
+    samples = {op: [] for op in weights.keys()}
+    errors = {op: 0 for op in weights.keys()}
+    start = perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        client(base_url, RequestFactory(ref_names, refs_per_get, seed + i), weights, deadline, samples, errors) for i in range(clients)
+    ])
+    elapsed = perf_counter() - start
+    return samples, errors, elapsed
+
+def wait_until_ready(base_url: str, server: subprocess.Popen, timeout: float):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if server.poll() is not None:
+            raise Exception(f"Service exited during startup with code {server.returncode}")
+        try:
+            # the lifespan handler has added the object endpoints once the service responds
+            if httpx.get(f"{base_url}/openapi.json").status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        sleep(0.25)
+    raise Exception(f"Service did not start within {timeout} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the FastAPI simulation service.")
+    parser.add_argument("--objects", type=int, default=9, help="Number of mixers in the synthetic simulation.")
+    parser.add_argument("--model", choices=MODEL_TYPES, default="ForecastRNN")
+    parser.add_argument("--datapoint-length", type=int, default=8)
+    parser.add_argument("--hidden-size", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent async clients.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to drive load for.")
+    parser.add_argument("--warmup", type=float, default=2, help="Seconds of load before measuring.")
+    parser.add_argument("--mix", default="get=4,set=2,object_get=2,object_set=1", help="Comma separated operation=weight list.")
+    parser.add_argument("--refs-per-get", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--output", default=None, help="Path of the JSON results file.")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    sim_def = createSyntheticSimulation(args.objects, args.model, args.datapoint_length, args.hidden_size)
+    sim_id = sim_def.exportableDescriptor()
+    ref_names = syntheticReferenceNames(sim_def)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    env = dict(os.environ)
+    env["SIM_ID"] = sim_id
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "service.fastapi.Service:app", "--port", str(args.port), "--log-level", "warning"], env=env)
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+        if args.warmup > 0:
+            asyncio.run(run_clients(base_url, ref_names, weights, args.clients, args.warmup, args.refs_per_get, args.seed))
+        samples, errors, elapsed = asyncio.run(run_clients(base_url, ref_names, weights, args.clients, args.duration, args.refs_per_get, args.seed))
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {"elapsed_s": elapsed, "operations": {}}
+    total = 0
+    for operation, latencies in samples.items():
+        results["operations"][operation] = latencySummary(latencies)
+        results["operations"][operation]["errors"] = errors[operation]
+        results["operations"][operation]["throughput_rps"] = len(latencies) / elapsed
+        total += len(latencies)
+    results["overall"] = latencySummary([latency for latencies in samples.values() for latency in latencies])
+    results["overall"]["errors"] = sum(errors.values())
+    results["overall"]["throughput_rps"] = total / elapsed
+
+    config = {
+        "sim_id": sim_id,
+        "objects": args.objects,
+        "model": args.model,
+        "datapoint_length": args.datapoint_length,
+        "hidden_size": args.hidden_size,
+        "clients": args.clients,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "mix": weights,
+        "refs_per_get": args.refs_per_get,
+        "seed": args.seed,
+    }
+    path = writeResults("service", config, results, args.output)
+    print(f"Throughput {results['overall']['throughput_rps']:.1f} req/s, "\
+          f"p50 {results['overall'].get('p50_ms', 0):.1f} ms, "\
+          f"p99 {results['overall'].get('p99_ms', 0):.1f} ms. Results written to {path}")
+
+if __name__ == "__main__":
+    main()
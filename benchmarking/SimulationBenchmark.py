@@ -0,0 +1,154 @@
+from benchmarking.SyntheticPlant import createSyntheticSimulation, MODEL_TYPES
+from benchmarking.report import latencySummary, writeResults
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import multiprocessing
+import itertools
+import tracemalloc
+import argparse
+import resource
+import sys
+
+"""
+Step benchmark for the simulation engine.
+
+Builds synthetic plants of Mixer/DownstreamMixer objects backed by small
+generated ForecastRNN or NeuralCDE models and measures, for every combination
+of object count, window length and hidden size:
+    * ModeledObject.step latency (the level and temperature models of one mixer)
+    * Simulator.step latency, split into the object step and updateReferences phases
+    * Python allocations per Simulator.step (tracemalloc, measured in a separate pass
+      because tracing slows the step down)
+    * peak memory of the process. Each configuration runs in a fresh process so
+      the peak RSS belongs to that plant alone.
+
+Run from the root folder:
+    python -m benchmarking.SimulationBenchmark --objects 1,10,100,1000 --window-lengths 8,32 --hidden-sizes 8,64
+"""
+
+def int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(',')]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux and bytes on MacOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+def measure(model_type: str, objects: int, datapoint_length: int, hidden_size: int, steps: int, warmup: int, threads: int) -> dict:
+    import torch
+    if threads > 0:
+        torch.set_num_threads(threads)
+
+    sim_def = createSyntheticSimulation(objects, model_type, datapoint_length, hidden_size)
+    rss_before_build = peak_rss_mb()
+    build_start = perf_counter()
+    sim = sim_def.createSimulation()
+    build_time = perf_counter() - build_start
+    rss_after_build = peak_rss_mb()
+
+    for _ in range(warmup):
+        sim.step()
+
+    object_step = []
+    update_references = []
+    sim_step = []
+    for _ in range(steps):
+        start = perf_counter()
+        for object in sim.objects.values():
+            object.step()
+        mid = perf_counter()
+        for object in sim.objects.values():
+            object.updateReferences()
+        end = perf_counter()
+        object_step.append(mid - start)
+        update_references.append(end - mid)
+
+        start = perf_counter()
+        sim.step()
+        sim_step.append(perf_counter() - start)
+
+    # ModeledObject.step in isolation, on the models of the first mixer
+    first = next(iter(sim.objects.values()))
+    level_step = []
+    temp_step = []
+    for _ in range(steps):
+        start = perf_counter()
+        first._level_model.step()
+        mid = perf_counter()
+        first._temp_model.step()
+        temp_step.append(perf_counter() - mid)
+        level_step.append(mid - start)
+
+    # allocations made by python code during a step. Tensor storage is allocated
+    # by torch outside of tracemalloc's view, it shows up in the peak RSS instead.
+    tracemalloc.start()
+    allocated = []
+    for _ in range(steps):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        sim.step()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - current)
+    tracemalloc.stop()
+
+    return {
+        "model": model_type,
+        "objects": objects,
+        "datapoint_length": datapoint_length,
+        "hidden_size": hidden_size,
+        "build_s": build_time,
+        "modeled_object_step": {"level": latencySummary(level_step), "temperature": latencySummary(temp_step)},
+        "object_step": latencySummary(object_step),
+        "update_references": latencySummary(update_references),
+        "simulator_step": latencySummary(sim_step),
+        "step_python_alloc_peak_kb": {
+            "mean": sum(allocated) / len(allocated) / 1024,
+            "max": max(allocated) / 1024,
+        },
+        "memory_mb": {
+            "peak_rss_before_build": rss_before_build,
+            "peak_rss_after_build": rss_after_build,
+            "peak_rss": peak_rss_mb(),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmark for the simulation step.")
+    parser.add_argument("--models", default=",".join(MODEL_TYPES), help="Comma separated model types.")
+    parser.add_argument("--objects", type=int_list, default=[1, 10, 100, 1000])
+    parser.add_argument("--window-lengths", type=int_list, default=[8])
+    parser.add_argument("--hidden-sizes", type=int_list, default=[8])
+    parser.add_argument("--steps", type=int, default=20, help="Measured steps per configuration.")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch thread count, 0 for the torch default.")
+    parser.add_argument("--output", default=None, help="Path of the JSON results file.")
+    args = parser.parse_args()
+
+    models = args.models.split(',')
+    for model in models:
+        assert model in MODEL_TYPES, f"Unknown model type {model}. Expected one of {MODEL_TYPES}"
+
+    results = []
+    configs = list(itertools.product(models, args.objects, args.window_lengths, args.hidden_sizes))
+    for i, (model, objects, datapoint_length, hidden_size) in enumerate(configs):
+        # a fresh process per configuration keeps memory measurements independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(measure, model, objects, datapoint_length, hidden_size, args.steps, args.warmup, args.threads).result()
+        results.append(result)
+        print(f"[{i+1}/{len(configs)}] {model} objects={objects} window={datapoint_length} hidden={hidden_size}: "\
+              f"step p50 {result['simulator_step']['p50_ms']:.2f} ms, peak rss {result['memory_mb']['peak_rss']:.0f} MB")
+
+    config = {
+        "models": models,
+        "objects": args.objects,
+        "window_lengths": args.window_lengths,
+        "hidden_sizes": args.hidden_sizes,
+        "steps": args.steps,
+        "warmup": args.warmup,
+        "threads": args.threads,
+    }
+    path = writeResults("simulation", config, results, args.output)
+    print(f"Results written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+from modeling.data_eng.DataSource.AvevaHistorianDataSource import AvevaHistorianDataSource
+from modeling.data_eng.DataSet.PyTorchDataSet import PyTorchDataSet
+from modeling.ForecastRNN import ForecastRNNDefinition
+from modeling.NeuralCDE import NeuralCDEDefinition
+from modeling.TimeSeriesNNRunner import TimeSeriersNNRunner
+from simulating.definition.SimulationDefiniton import SimulationDefn
+from simulating.industrial_object_lib.SimpleModeledMixer import SimpleModeledMixerDefn
+from simulating.industrial_object_lib.ChainedModeledMixer import ChainedModeledMixerDefn
+import torch
+
+"""
+Builds simulation definitions out of tiny random-weight models so that the
+simulation engine and the service can be benchmarked without a historian
+export or a training run. The model definitions, model files and simulation
+definitions are saved in the usual directories, keyed by their descriptors,
+so a plant of a given shape is only generated once.
+"""
+
+LEVEL_INPUTS = ['Synthetic_Inlet1_Position', 'Synthetic_Inlet2_Position', 'Synthetic_Outlet_Position', 'Synthetic_Level_PV']
+LEVEL_OUTPUTS = ['Synthetic_Level_PV']
+TEMP_INPUTS = LEVEL_INPUTS + ['Synthetic_Temperature_PV']
+TEMP_OUTPUTS = ['Synthetic_Temperature_PV']
+
+MODEL_TYPES = ["ForecastRNN", "NeuralCDE"]
+
+"""
+Returns the descriptor of a random-weight model with the given shape, creating
+the model definition and model file if they don't exist yet.
+"""
+def createSyntheticModel(model_type: str, input_features: list[str], output_features: list[str], datapoint_length: int, hidden_size: int, seed: int = 0) -> str:
+    source = AvevaHistorianDataSource(
+        csv_name="synthetic",
+        series=input_features + output_features,
+        min_frame_size=datapoint_length,
+    )
+    dataset = PyTorchDataSet(
+        source=source,
+        datapoint_length=datapoint_length,
+        input_features=input_features,
+        output_features=output_features,
+        overlap=1,
+    )
+    if model_type == "ForecastRNN":
+        defn = ForecastRNNDefinition(
+            dataset=dataset,
+            input_features=input_features,
+            output_features=output_features,
+            datapoint_length=datapoint_length,
+            epochs=0,
+            layers=[("LSTM", hidden_size, {})])
+    elif model_type == "NeuralCDE":
+        defn = NeuralCDEDefinition(
+            dataset=dataset,
+            input_features=input_features,
+            output_features=output_features,
+            datapoint_length=datapoint_length,
+            epochs=0,
+            hidden_channels=hidden_size,
+            hidden_layer_widths=[hidden_size],
+            dropout_layers=[0, 0])
+    else:
+        raise Exception(f"Invalid synthetic model type: {model_type}. Expected one of {MODEL_TYPES}")
+
+    id = defn.exportableDescriptor()
+    if not defn.fileAlreadyExists():
+        defn.saveToFile(toJson=True)
+
+    runner = TimeSeriersNNRunner(defn)
+    if not runner.trainedModelExists():
+        torch.manual_seed(seed)
+        runner.save(defn.generateModule())
+
+    return id
+
+"""
+Returns a saved simulation definition with num_objects mixers. Every third
+object is a DownstreamMixer fed by the outlets of the two objects before it,
+the rest are independent Mixers.
+"""
+def createSyntheticSimulation(num_objects: int, model_type: str = "ForecastRNN", datapoint_length: int = 8, hidden_size: int = 8) -> SimulationDefn:
+    level_model_id = createSyntheticModel(model_type, LEVEL_INPUTS, LEVEL_OUTPUTS, datapoint_length, hidden_size)
+    temp_model_id = createSyntheticModel(model_type, TEMP_INPUTS, TEMP_OUTPUTS, datapoint_length, hidden_size)
+
+    objects = {}
+    names = []
+    for i in range(num_objects):
+        name = f"Mixer{i}"
+        if i % 3 == 2:
+            objects[name] = ChainedModeledMixerDefn(
+                level_model_id=level_model_id,
+                temp_model_id=temp_model_id,
+                ref_map={
+                    'in1': f"{names[-2]}.Outlet.Position",
+                    'in2': f"{names[-1]}.Outlet.Position",
+                })
+        else:
+            objects[name] = SimpleModeledMixerDefn(level_model_id=level_model_id, temp_model_id=temp_model_id)
+        names.append(name)
+
+    sim_def = SimulationDefn(objects=objects)
+    if not sim_def.fileAlreadyExists():
+        sim_def.saveToFile(toJson=True)
+    return sim_def
+
+"""
+Returns the readable and writeable reference names of each object in a
+synthetic simulation, without having to instantiate it.
+"""
+def syntheticReferenceNames(sim_def: SimulationDefn) -> dict[str, tuple[list[str], list[str]]]:
+    valve_refs = ["Position", "OLS", "CLS"]
+    ret = {}
+    for name, defn in sim_def.objects.items():
+        valves = ["Outlet"] if isinstance(defn, ChainedModeledMixerDefn) else ["Inlet1", "Inlet2", "Outlet"]
+        readable = ["Level", "Temperature"] + [f"{valve}.{ref}" for valve in valves for ref in valve_refs]
+        writeable = [f"{valve}.{ref}" for valve in valves for ref in ["OLS", "CLS"]]
+        ret[name] = (readable, writeable)
+    return ret
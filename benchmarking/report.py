@@ -0,0 +1,78 @@
+from datetime import datetime
+from pathlib import Path
+import subprocess
+import platform
+import json
+
+"""
+Helpers shared by the benchmark suites to summarize measurements and write
+them as JSON, tagged with enough metadata to compare runs across commits.
+"""
+
+RESULTS_PATH = "benchmarking/results"
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if len(sorted_values) == 0:
+        return None
+    # linear interpolation between the closest ranks
+    rank = (len(sorted_values) - 1) * p / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+"""
+Summarize a list of latencies (seconds) into milliseconds.
+"""
+def latencySummary(latencies: list[float]) -> dict:
+    values = sorted(latencies)
+    summary = {"count": len(values)}
+    if len(values) == 0:
+        return summary
+    summary.update({
+        "mean_ms": 1000 * sum(values) / len(values),
+        "min_ms": 1000 * values[0],
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+        "max_ms": 1000 * values[-1],
+    })
+    return summary
+
+def runMetadata() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except Exception:
+            return None
+
+    metadata = {
+        "timestamp": datetime.now().isoformat(),
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": git("status", "--porcelain", "--untracked-files=no") not in (None, ""),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+    try:
+        import torch
+        metadata["torch"] = torch.__version__
+        metadata["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return metadata
+
+"""
+Write the results of a benchmark run. If no path is given, the file is named
+after the suite, the commit and the time of the run.
+"""
+def writeResults(suite: str, config: dict, results, path: str = None) -> str:
+    metadata = runMetadata()
+    if path is None:
+        Path(RESULTS_PATH).mkdir(parents=True, exist_ok=True)
+        commit = (metadata["commit"] or "nocommit")[:10]
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = f"{RESULTS_PATH}/{suite}-{commit}-{stamp}.json"
+
+    with open(path, "w+") as outfile:
+        json.dump({"suite": suite, "metadata": metadata, "config": config, "results": results}, outfile, indent=3)
+    return path
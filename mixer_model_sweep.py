@@ -0,0 +1,51 @@
+from modeling.data_eng.DataSource.AvevaHistorianDataSource import AvevaHistorianDataSource
+from modeling.data_eng.DataSet.PyTorchDataSet import PyTorchDataSet
+from modeling.ForecastRNN import ForecastRNNDefinition
+from modeling.HyperparameterSweep import HyperparameterSweep
+
+if __name__ == "__main__":
+    inputs = ['Mixer100_Inlet1_Position',
+                            'Mixer100_Inlet2_Position',
+                            'Mixer100_Outlet_Position',
+                            'Mixer100_Level_PV']
+    outputs = ['Mixer100_Level_PV']
+    datapoint_length = 8
+    source = AvevaHistorianDataSource(
+        csv_name="mixer simulation dataset.csv",
+        series= inputs + outputs,
+        min_frame_size=datapoint_length,
+        persist=True,
+    )
+    dataset = PyTorchDataSet(
+        source=source,
+        datapoint_length=datapoint_length,
+        input_features=inputs,
+        output_features=outputs,
+        overlap=1,
+        max_dataset_size=0,
+        cubic_interp=False,
+        persist=True,
+    )
+    sweep = HyperparameterSweep(
+        ForecastRNNDefinition,
+        base={
+            "dataset": dataset,
+            "input_features": inputs,
+            "output_features": outputs,
+            "datapoint_length": datapoint_length,
+            "epochs": 2,
+        },
+        grid={
+            "train_batch_size": [8, 32],
+            "layers": [
+                [("LSTM", 256, {})],
+                [("LSTM", 512, {"bidirectional": True})],
+                [("GRU", 256, {})],
+            ],
+            "convolution": [True, False],
+        },
+        # samples=4,
+        workers=2,
+    )
+    results = sweep.run()
+    print(results.to_string(index=False))
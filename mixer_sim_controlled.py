@@ -0,0 +1,35 @@
+from simulating.definition.SimulationDefiniton import SimulationDefn
+import matplotlib.pyplot as plt
+import sys
+
+"""
+Runs a simulation definition whose control logic is defined with in-process
+controllers (see simulating/definition/examples/mixer_recipe_example.py) as
+fast as the objects can step, and plots one mixer.
+
+python mixer_sim_controlled.py <sim_id> [mixer] [iters]
+"""
+if __name__ == "__main__":
+    sim_id = sys.argv[1]
+    mixer = sys.argv[2] if len(sys.argv) > 2 else "Mixer100"
+    iters = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    sim = SimulationDefn.load(sim_id).createSimulation()
+    level = sim.ref(f"{mixer}.Level")
+    temp = sim.ref(f"{mixer}.Temperature")
+
+    series = {"time": [], "temp": [], "level": []}
+    for iter in range(iters):
+        sim.step()
+        series['time'].append(iter)
+        series['level'].append(level.get())
+        series['temp'].append(temp.get())
+
+    for name, controller in sim.controllers.items():
+        if hasattr(controller, "batches"):
+            print(f"{name}: {controller.batches} batches completed")
+
+    plt.plot(series['time'], series['level'])
+    plt.plot(series['time'], series['temp'])
+    plt.title(f"{sim_id}: {mixer}")
+    plt.show()
@@ -1,7 +1,5 @@
-from typing import Iterator
 import torch
 from torch.nn.modules import Module
-from torch.nn.parameter import Parameter
 import torchcde
 from modeling.TimeSeriesNNDefinition import TimeSeriesNNDefinition, DataSet
 
@@ -21,7 +19,7 @@ class ForecastRNN(torch.nn.Module):
             self.conv = None
             prev_layer_channels = self.input_channels
 
-        self.rnns = []
+        self.rnns = torch.nn.ModuleList()
         for model_type, hidden_channels, kwargs in layers:
             if model_type == "LSTM":
                 self.rnns.append(torch.nn.LSTM(prev_layer_channels, hidden_channels, batch_first=True, **kwargs))
@@ -35,7 +33,24 @@ class ForecastRNN(torch.nn.Module):
             if 'bidirectional' in kwargs and kwargs['bidirectional']:
                 prev_layer_channels *= 2
 
-        self.fcs = [torch.nn.Linear(prev_layer_channels, 1) for _ in range(output_channels)]
+        # one output per row of the weights
+        self.head = torch.nn.Linear(prev_layer_channels, output_channels)
+
+    """
+    Models pickled before the layers were registered kept them in plain lists,
+    with one single output linear layer per output. Register the layers and
+    fuse the outputs into one head, so old models load and save like new ones.
+    """
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if "fcs" in self.__dict__:
+            rnns = self.__dict__.pop("rnns")
+            fcs = self.__dict__.pop("fcs")
+            self.rnns = torch.nn.ModuleList(rnns)
+            self.head = torch.nn.Linear(fcs[0].in_features, len(fcs))
+            with torch.no_grad():
+                self.head.weight.copy_(torch.cat([fc.weight for fc in fcs]))
+                self.head.bias.copy_(torch.cat([fc.bias for fc in fcs]))
 
     def forward(self, X):
         # X has shape (batch, length, hidden_channels)
@@ -50,22 +65,7 @@ class ForecastRNN(torch.nn.Module):
         # last output from the rnn is the predicted value
         out = inp[:,-1,:]
 
-        out = torch.concat([fc(out) for fc in self.fcs], 1)
-
-        return out
-    
-    def parameters(self, recurse: bool = True) -> Iterator[Parameter]:
-        params = []
-        if not self.conv is None:
-            params += self.conv.parameters()
-
-        for layer in self.rnns:
-            params += layer.parameters()
-
-        for fc in self.fcs:
-            params += fc.parameters()
-
-        return params
+        return self.head(out)
     
 class ForecastRNNDefinition(TimeSeriesNNDefinition):
     def __init__(self,
@@ -76,8 +76,15 @@ class ForecastRNNDefinition(TimeSeriesNNDefinition):
                  epochs=2, 
                  train_batch_size: int = 8, 
                  layers: list[tuple[str, int, dict]] = [("LSTM", 128, {})],
-                 convolution: bool = False):
-        super().__init__(dataset, input_features, output_features, datapoint_length, epochs, train_batch_size)
+                 convolution: bool = False,
+                 shuffle: bool = False,
+                 loader_workers: int = 0,
+                 prefetch_factor: int = 2,
+                 pin_memory: bool = False,
+                 precision: str = "float32",
+                 patience: int = 0,
+                 validation_split: float = 0.1):
+        super().__init__(dataset, input_features, output_features, datapoint_length, epochs, train_batch_size, shuffle, loader_workers, prefetch_factor, pin_memory, precision, patience, validation_split)
         self.input_channels = (len(input_features) + 1)
         self.layers = layers
         self.output_channels = len(output_features)
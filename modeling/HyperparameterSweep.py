@@ -0,0 +1,176 @@
+from modeling.TimeSeriesNNDefinition import TimeSeriesNNDefinition
+from modeling.TimeSeriesNNRunner import TimeSeriersNNRunner
+from util import parallel, precision as precisions
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import itertools
+import random
+import torch
+import time
+import json
+import os
+
+"""
+Train a grid (or a random sample of a grid) of model definitions concurrently.
+
+definition_class is a TimeSeriesNNDefinition subclass (e.g. ForecastRNNDefinition
+or NeuralCDEDefinition), base holds the constructor arguments shared by every
+candidate and grid maps argument names to the values to try. With samples set,
+that many distinct points of the grid are drawn at random instead of training
+all of them.
+
+The dataset of the definitions is built once in this process. Eager datasets
+(tensors) are copied into one shared memory block that every worker maps;
+lazy ones already are memory mapped, so they are handed to the workers as is.
+Each of the workers processes trains one candidate at a time with at most
+threads_per_worker CPU threads. Candidates whose model already exists are not
+trained again, only evaluated.
+
+Results (test miss ratio, training time and single window inference latency)
+are written to modeling/sweeps/{name}.csv as candidates finish.
+"""
+class HyperparameterSweep:
+    _path = "modeling/sweeps"
+
+    def __init__(self, definition_class: type, base: dict, grid: dict[str, list], samples: int = None, seed: int = 0, workers: int = 2, threads_per_worker: int = None, name: str = None):
+        assert issubclass(definition_class, TimeSeriesNNDefinition), "Sweeps train TimeSeriesNNDefinitions"
+        assert workers > 0, "A sweep needs at least one worker"
+        assert "dataset" in base, "All candidates of a sweep share the dataset given in base"
+        self.definition_class = definition_class
+        self.base = base
+        self.grid = grid
+        self.samples = samples
+        self.seed = seed
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker if threads_per_worker is not None else max(1, (os.cpu_count() or 1) // workers)
+        self.name = name if name is not None else f"{definition_class.__name__}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+    """
+    The argument values of every candidate, in grid order.
+    """
+    def candidates(self) -> list[dict]:
+        keys = list(self.grid.keys())
+        points = [dict(zip(keys, values)) for values in itertools.product(*[self.grid[key] for key in keys])]
+        if self.samples is not None and self.samples < len(points):
+            chosen = sorted(random.Random(self.seed).sample(range(len(points)), self.samples))
+            points = [points[i] for i in chosen]
+        return points
+
+    def run(self) -> pd.DataFrame:
+        definitions = {}
+        parameters = {}
+        for point in self.candidates():
+            defn = self.definition_class(**self.base, **point)
+            id = defn.exportableDescriptor()
+            # arguments that aren't exported can map several points to the same model
+            if not id in definitions:
+                definitions[id] = defn
+                parameters[id] = point
+        print(f"Sweep {self.name}: {len(definitions)} candidates, {self.workers} workers with {self.threads_per_worker} threads each.")
+
+        train, test = self.base["dataset"].get()
+        shm, shared = _shareDataSets(train, test)
+        rows = []
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"),
+                                     initializer=_initWorker, initargs=(self.threads_per_worker, shared)) as executor:
+                futures = {executor.submit(_runCandidate, defn): id for id, defn in definitions.items()}
+                for future in as_completed(futures):
+                    id = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"model_id": id, "status": f"failed: {e}"}
+                    result.update({key: value if isinstance(value, (int, float, str, bool)) else json.dumps(value) for key, value in parameters[id].items()})
+                    rows.append(result)
+                    print(f"Sweep {self.name}: {len(rows)}/{len(definitions)} done, {id} {result['status']}")
+                    self._write(rows)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        return self._write(rows)
+
+    def _write(self, rows: list[dict]) -> pd.DataFrame:
+        results = pd.DataFrame(rows)
+        if "test_miss_ratio" in results.columns:
+            results = results.sort_values("test_miss_ratio", na_position='last')
+        results.to_csv(f"{HyperparameterSweep._path}/{self.name}.csv", index=False)
+        return results
+
+"""
+Put the tensors behind a split of a TensorDataset into shared memory. Returns the
+block (None if nothing was shared) and what the workers need to rebuild the split.
+"""
+def _shareDataSets(train, test) -> tuple:
+    if isinstance(train, torch.utils.data.Subset) and isinstance(test, torch.utils.data.Subset) \
+            and train.dataset is test.dataset and isinstance(train.dataset, torch.utils.data.TensorDataset):
+        X, y = train.dataset.tensors
+        shm, handle = parallel.share([X.numpy(), y.numpy(), np.asarray(train.indices, dtype=np.int64), np.asarray(test.indices, dtype=np.int64)])
+        return shm, ("shared", handle)
+    return None, ("direct", (train, test))
+
+# the sweep process' datasets, set up once per worker by _initWorker
+_datasets = None
+_shm = None
+
+def _initWorker(threads: int, shared: tuple):
+    global _datasets, _shm
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    kind, content = shared
+    if kind == "shared":
+        # the block has to stay mapped for as long as the tensors are used
+        _shm, (X, y, train_indices, test_indices) = parallel.attach(content)
+        dataset = torch.utils.data.TensorDataset(torch.from_numpy(X), torch.from_numpy(y))
+        _datasets = (torch.utils.data.Subset(dataset, train_indices.tolist()), torch.utils.data.Subset(dataset, test_indices.tolist()))
+    else:
+        _datasets = content
+
+def _runCandidate(defn: TimeSeriesNNDefinition) -> dict:
+    runner = TimeSeriersNNRunner(defn)
+    runner.dataset, runner.testset = _datasets
+    train_seconds = None
+    if runner.trainedModelExists():
+        model, _ = runner.load()
+        status = "existing"
+    else:
+        start = time.perf_counter()
+        model, _ = runner.train()
+        train_seconds = time.perf_counter() - start
+        status = "trained"
+
+    pred_y, test_y = runner.predict(model, runner.testset)
+    return {
+        "model_id": defn.exportableDescriptor(),
+        "status": status,
+        "test_miss_ratio": TimeSeriersNNRunner.missRatio(pred_y, test_y),
+        "train_seconds": train_seconds,
+        "latency_ms": _inferenceLatency(model, runner.testset, runner.inference_precision),
+        "inference_precision": runner.inference_precision,
+    }
+
+"""
+Median time in milliseconds of a forward pass on a single window, which is how
+the simulator runs models.
+"""
+def _inferenceLatency(model, dataset, precision: str, count: int = 100) -> float:
+    count = min(count, len(dataset))
+    if count == 0:
+        return None
+    model.eval()
+    timings = []
+    with torch.inference_mode(), precisions.autocast(precision):
+        for i in range(count):
+            X, _ = dataset[[i]]
+            start = time.perf_counter()
+            model(X)
+            timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+if True:
+    from pathlib import Path
+    Path(HyperparameterSweep._path).mkdir(parents=True, exist_ok=True)
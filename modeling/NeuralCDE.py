@@ -3,6 +3,7 @@ from torch.nn.modules import Module
 import torchcde
 from modeling.TimeSeriesNNDefinition import TimeSeriesNNDefinition
 from modeling.data_eng.DataSet.PyTorchDataSet import PyTorchDataSet
+from util import instrumentation
 import math
 
 
@@ -79,28 +80,30 @@ class NeuralCDE(torch.nn.Module):
         self.interpolation = interpolation
 
     def forward(self, coeffs):
-        if self.interpolation == 'cubic':
-            X = torchcde.CubicSpline(coeffs)
-        elif self.interpolation == 'linear':
-            X = torchcde.LinearInterpolation(coeffs)
-        else:
-            raise ValueError("Only 'linear' and 'cubic' interpolation methods are implemented.")
-
-        adjoint_params = tuple(self.func.parameters()) + (coeffs,)
-        ######################
-        # Easy to forget gotcha: Initial hidden state should be a function of the first observation.
-        ######################
-        X0 = X.evaluate(X.interval[0])
-        z0 = self.initial(X0)
+        with instrumentation.phase("spline"):
+            if self.interpolation == 'cubic':
+                X = torchcde.CubicSpline(coeffs)
+            elif self.interpolation == 'linear':
+                X = torchcde.LinearInterpolation(coeffs)
+            else:
+                raise ValueError("Only 'linear' and 'cubic' interpolation methods are implemented.")
+
+            adjoint_params = tuple(self.func.parameters()) + (coeffs,)
+            ######################
+            # Easy to forget gotcha: Initial hidden state should be a function of the first observation.
+            ######################
+            X0 = X.evaluate(X.interval[0])
+            z0 = self.initial(X0)
 
         ######################
         # Actually solve the CDE.
         ######################
-        z_T = torchcde.cdeint(X=X,
-                              z0=z0,
-                              func=self.func,
-                              t=X.interval,
-                              adjoint_params=adjoint_params)
+        with instrumentation.phase("cdeint"):
+            z_T = torchcde.cdeint(X=X,
+                                  z0=z0,
+                                  func=self.func,
+                                  t=X.interval,
+                                  adjoint_params=adjoint_params)
 
         ######################
         # Both the initial value and the terminal value are returned from cdeint; extract just the terminal value,
@@ -120,8 +123,15 @@ class NeuralCDEDefinition(TimeSeriesNNDefinition):
                  train_batch_size: int = 8, 
                  hidden_channels: int = 128, 
                  hidden_layer_widths: list[int] = [128], 
-                 dropout_layers: list[float] = [True, True]):
-        super().__init__(dataset, input_features, output_features, datapoint_length, epochs, train_batch_size)
+                 dropout_layers: list[float] = [True, True],
+                 shuffle: bool = False,
+                 loader_workers: int = 0,
+                 prefetch_factor: int = 2,
+                 pin_memory: bool = False,
+                 precision: str = "float32",
+                 patience: int = 0,
+                 validation_split: float = 0.1):
+        super().__init__(dataset, input_features, output_features, datapoint_length, epochs, train_batch_size, shuffle, loader_workers, prefetch_factor, pin_memory, precision, patience, validation_split)
         self.input_channels = len(input_features) + 1
         self.hidden_channels = hidden_channels
         self.output_channels = len(output_features)
@@ -1,6 +1,7 @@
 from modeling.NeuralNetworkDefinition import NeuralNetworkDefinition
 from modeling.data_eng.DataSet.DataSet import DataSet
 from util.Exportable import ExportableType
+from util import precision as precisions
 
 """
 TODO: This is out of date, but still a good explanation of how things are 
@@ -45,21 +46,60 @@ data is prepared and cleaned.
         frame i:  [x'_j, x'_{j+1}, ..., x'_{j+f-1}]
       frame i+1:        [x'_k, x'_{k+1}, ..., x'_{k+f-1}]
       where j < k <= j+f.
+
+The remaining parameters configure the training input pipeline (see
+TimeSeriersNNRunner.train). shuffle reshuffles the batches every epoch, which
+changes the trained model. loader_workers, prefetch_factor and pin_memory only
+change how fast batches are produced, so they are not part of the export.
+
+precision is the numeric precision of training (see util/precision.py). A model
+trained in reduced precision is also run in it by the simulator, unless the
+accuracy comparison after training rejected it (see TimeSeriersNNRunner.comparePrecision).
+
+With patience > 0, validation_split of the training set is held out and training
+stops early once the validation loss did not improve for patience epochs. The
+model of the best epoch is kept.
 """
 class TimeSeriesNNDefinition(NeuralNetworkDefinition):
+    # defaults for definitions pickled before the input pipeline was configurable
+    shuffle = False
+    loader_workers = 0
+    prefetch_factor = 2
+    pin_memory = False
+    precision = "float32"
+    patience = 0
+    validation_split = 0.1
+
     def __init__(self, 
                  dataset: DataSet, 
                  input_features: list[str], 
                  output_features: list[str], 
                  datapoint_length: int,
                  epochs = 2, 
-                 train_batch_size:int = 8):
+                 train_batch_size:int = 8,
+                 shuffle: bool = False,
+                 loader_workers: int = 0,
+                 prefetch_factor: int = 2,
+                 pin_memory: bool = False,
+                 precision: str = "float32",
+                 patience: int = 0,
+                 validation_split: float = 0.1):
+        assert loader_workers >= 0, "The number of loader workers can't be negative"
+        assert patience == 0 or 0 < validation_split < 1, "Early stopping needs a validation split between 0 and 1"
+        precisions.check(precision)
         self.dataset = dataset
         self.input_features = input_features
         self.output_features = output_features
         self.datapoint_length = datapoint_length
         self.epochs = epochs
         self.train_batch_size = train_batch_size
+        self.shuffle = shuffle
+        self.loader_workers = loader_workers
+        self.prefetch_factor = prefetch_factor
+        self.pin_memory = pin_memory
+        self.precision = precision
+        self.patience = patience
+        self.validation_split = validation_split
     
     def getExportType(self) -> ExportableType:
         return ExportableType.Model
@@ -76,4 +116,11 @@ class TimeSeriesNNDefinition(NeuralNetworkDefinition):
             "train_batch_size": self.train_batch_size
           }
         )
+        # models trained before shuffling existed saw the batches in order
+        if self.shuffle:
+            running[-1]["shuffle"] = True
+        if self.precision != "float32":
+            running[-1]["precision"] = self.precision
+        if self.patience > 0:
+            running[-1]["early_stopping"] = [self.patience, self.validation_split]
         return running
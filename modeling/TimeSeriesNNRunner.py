@@ -1,7 +1,14 @@
 from modeling.TimeSeriesNNDefinition import TimeSeriesNNDefinition
+from util import precision as precisions
+from util import instrumentation
 from datetime import datetime
+import numpy as np
+import contextlib
+import random
+import copy
 import json
 import math
+import time
 import torch
 import torchcde
 import os
@@ -27,30 +34,218 @@ class CustomLoss(torch.nn.Module):
         
         return torch.sum((torch.abs(inputs - clamped) / torch.abs(clamped))**2)
 
+"""
+Trains, loads and evaluates the model of a TimeSeriesNNDefinition. Models are
+saved as weights next to their definition, see save(). Training
+writes a checkpoint to modeling/checkpoints/{id}.checkpoint after every epoch
+and resumes from it if one exists for the definition, e.g. after a crash. The
+checkpoint is removed once the model is saved.
+
+With instrument=True, train records the time spent in every phase of every
+step (waiting for data, copying it to the device, forward, loss, backward,
+optimizer, plus the phases the model marks, see util/instrumentation.py) and
+the memory in use to modeling/models/{id}.phases.jsonl, one JSON record per
+step. With profile_steps=(first, count), the steps first to first + count - 1
+(counted over all epochs) are traced by torch.profiler into {id}.trace.json,
+which chrome://tracing or Perfetto open, with the operator summary in {id}.profile.txt.
+"""
 class TimeSeriersNNRunner:
-    def __init__(self, defn: TimeSeriesNNDefinition):
+    _model_path = "modeling/models"
+    _checkpoint_path = "modeling/checkpoints"
+
+    def __init__(self, defn: TimeSeriesNNDefinition, instrument: bool = False, profile_steps: tuple[int, int] = None):
         self.defn = defn
+        self.instrument = instrument
+        self.profile_steps = profile_steps
         self.dataset = None
         self.testset = None
         self.time_dimension = 'DateTime'
+        self.single_loss_func = CustomLoss()
+        self.mean_loss_func = CustomLoss(0.01)
+        self.noise_loss_func = CustomLoss(0.01)
+        # precision the loaded model is run in, see comparePrecision
+        self.inference_precision = "float32"
 
-    def trainedModelExists(self):
+    """
+    The id the model is saved under. That is the definition's descriptor, unless
+    the definition was loaded from a file whose id no longer matches it (e.g.
+    datasets with overlap < 1 export their stride now) and the model was only
+    trained under that old id.
+    """
+    def modelId(self) -> str:
         id = self.defn.exportableDescriptor()
-        model_path = f"modeling/models/{id}.model"
-        return os.path.exists(model_path)
+        if self.defn.loaded_id is not None and self.defn.loaded_id != id:
+            if not TimeSeriersNNRunner._modelFilesExist(id) and TimeSeriersNNRunner._modelFilesExist(self.defn.loaded_id):
+                return self.defn.loaded_id
+        return id
 
-    def load(self):
-        id = self.defn.exportableDescriptor()
-        model_path = f"modeling/models/{id}.model"
-        if not os.path.exists(model_path):
-            raise Exception(f"Model specified by parameters {id} does not exist. Please train and save it.")
-        
-        checkpoint = torch.load(model_path)
-        model = checkpoint['model']
-        optimizer = checkpoint['optimizer']
+    @staticmethod
+    def _modelFilesExist(id: str) -> bool:
+        path = f"{TimeSeriersNNRunner._model_path}/{id}"
+        return os.path.exists(f"{path}.weights") or os.path.exists(f"{path}.model")
+
+    def modelPath(self) -> str:
+        return f"{TimeSeriersNNRunner._model_path}/{self.modelId()}"
+
+    def trainedModelExists(self):
+        return TimeSeriersNNRunner._modelFilesExist(self.modelId())
+
+    """
+    Save a trained model. The definition is saved with the model's id already,
+    so only the weights are stored: the inference weights in {id}.weights and
+    the optimizer state, only needed to continue training, in {id}.training.
+    """
+    def save(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer = None):
+        path = self.modelPath()
+        torch.save({"model": model.state_dict(), "inference_precision": self.inference_precision}, f"{path}.weights")
+        if optimizer is not None:
+            torch.save({"optimizer": optimizer.state_dict()}, f"{path}.training")
+
+    """
+    Load the trained model of the definition. The weights are memory mapped and
+    loaded without unpickling any code. The optimizer is only restored with
+    with_optimizer=True, otherwise None is returned in its place.
+
+    Model files written before the weights format (whole pickled modules) are
+    still read, and converted on first load.
+    """
+    def load(self, with_optimizer: bool = False):
+        path = self.modelPath()
+        if not os.path.exists(f"{path}.weights"):
+            if not os.path.exists(f"{path}.model"):
+                raise Exception(f"Model specified by parameters {self.modelId()} does not exist. Please train and save it.")
+            self._convertLegacyModel()
+
+        model = self.defn.generateModule()
+        checkpoint = torch.load(f"{path}.weights", mmap=True, weights_only=True)
+        # the parameters use the mapped tensors instead of copies
+        model.load_state_dict(checkpoint['model'], assign=True)
+        model.eval()
+        self.inference_precision = checkpoint['inference_precision']
+
+        optimizer = None
+        if with_optimizer:
+            # TODO: makce an enum for controlling this, leave as default for now
+            optimizer = torch.optim.Adam(model.parameters())
+            if os.path.exists(f"{path}.training"):
+                optimizer.load_state_dict(torch.load(f"{path}.training", weights_only=True)['optimizer'])
 
         return model, optimizer
+
+    def _convertLegacyModel(self):
+        # written by this class, so it is trusted
+        checkpoint = torch.load(f"{self.modelPath()}.model", weights_only=False)
+        # models saved before reduced precision existed run in float32
+        self.inference_precision = checkpoint.get('inference_precision', "float32")
+        print(f"Converting {self.modelId()} to the weights format.")
+        model, optimizer = checkpoint['model'], checkpoint['optimizer']
+        # the optimizer of a model with several outputs tracked one layer per output, which were fused since
+        if len(optimizer.param_groups[0]['params']) != len(list(model.parameters())):
+            optimizer = None
+        self.save(model, optimizer)
     
+    """
+    The DataLoader of the training set dataset. Batches are drawn by a batch sampler and
+    fetched from the dataset with one indexing call each (the datasets gather
+    whole batches, see WindowedDataSet.batch), instead of sample by sample and
+    collated afterwards. With loader_workers > 0 that many processes prepare
+    prefetch_factor batches each ahead of training.
+    """
+    def trainLoader(self, dataset: torch.utils.data.Dataset) -> torch.utils.data.DataLoader:
+        if self.defn.shuffle:
+            sampler = torch.utils.data.RandomSampler(dataset)
+        else:
+            sampler = torch.utils.data.SequentialSampler(dataset)
+        workers = self.defn.loader_workers
+        return torch.utils.data.DataLoader(
+            dataset,
+            sampler=torch.utils.data.BatchSampler(sampler, self.defn.train_batch_size, drop_last=False),
+            # the sampler already yields batches, so there is nothing to collate
+            batch_size=None,
+            num_workers=workers,
+            prefetch_factor=self.defn.prefetch_factor if workers > 0 else None,
+            persistent_workers=workers > 0,
+            pin_memory=self.defn.pin_memory,
+        )
+
+    """
+    The training loss of a batch of predictions.
+    """
+    def loss(self, pred_y: torch.Tensor, batch_y: torch.Tensor) -> torch.Tensor:
+        # TODO: need to let this function know about decomposition, but hardcoding it for now assuming one output
+        if pred_y.size(1) == 1:
+            return self.single_loss_func(pred_y, batch_y)
+        mean_loss = self.mean_loss_func(pred_y[:,0], batch_y[:,0])
+        noise_loss = self.noise_loss_func(pred_y[:,1], batch_y[:,1])
+        return mean_loss + 0.2 * noise_loss
+
+    """
+    The torch.profiler of the steps selected by profile_steps, or an empty
+    context without it. The trace is written once the last selected step ends.
+    """
+    def _profiler(self):
+        if self.profile_steps is None:
+            return contextlib.nullcontext()
+        first, count = self.profile_steps
+        path = self.modelPath()
+
+        def save(profiler):
+            profiler.export_chrome_trace(f"{path}.trace.json")
+            with open(f"{path}.profile.txt", "w+") as outfile:
+                outfile.write(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=30))
+            print(f"Saved the profile of steps {first} to {first + count - 1} to {path}.trace.json")
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        return torch.profiler.profile(
+            activities=activities,
+            # one warmup step before the traced ones, if there is a step before them
+            schedule=torch.profiler.schedule(wait=max(0, first - 1), warmup=min(1, first), active=count, repeat=1),
+            on_trace_ready=save,
+            # the CDE solve alone records hundreds of thousands of operators per step,
+            # shapes and allocations would make the trace too slow to process, the
+            # memory in use is in the phases of instrument=True
+        )
+
+    def checkpointPath(self) -> str:
+        return f"{TimeSeriersNNRunner._checkpoint_path}/{self.modelId()}.checkpoint"
+
+    """
+    Split the validation set off the training set. The split only depends on the
+    size of the training set, so a resumed run validates on the same datapoints.
+    """
+    def _validationSplit(self, dataset: torch.utils.data.Dataset) -> tuple[torch.utils.data.Dataset, torch.utils.data.Dataset]:
+        order = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(0)).tolist()
+        validation_size = int(len(dataset) * self.defn.validation_split)
+        return torch.utils.data.Subset(dataset, order[validation_size:]), torch.utils.data.Subset(dataset, order[:validation_size])
+
+    """
+    The train/test split as indices into the dataset both sets are drawn from,
+    or None if they are not subsets of one dataset.
+    """
+    def _splitIndices(self) -> dict[str, np.ndarray]:
+        if not isinstance(self.dataset, torch.utils.data.Subset) or not isinstance(self.testset, torch.utils.data.Subset) or self.dataset.dataset is not self.testset.dataset:
+            return None
+        return {"train": np.asarray(self.dataset.indices, dtype=np.int64), "test": np.asarray(self.testset.indices, dtype=np.int64)}
+
+    """
+    Write everything needed to continue training after epoch. The file is
+    replaced atomically, so a crash while writing leaves the previous one.
+    """
+    def _saveCheckpoint(self, epoch: int, model, optimizer, scaler, early_stopping: dict):
+        path = self.checkpointPath()
+        torch.save({
+            "epoch": epoch,
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scaler": scaler.state_dict(),
+            "early_stopping": early_stopping,
+            "rng": {"torch": torch.get_rng_state(), "numpy": np.random.get_state(), "python": random.getstate()},
+            "split": self._splitIndices(),
+        }, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
     def train(self):
         id = self.defn.exportableDescriptor()
 
@@ -58,101 +253,284 @@ class TimeSeriersNNRunner:
         if not self.defn.fileAlreadyExists():
             self.defn.saveToFile(toJson=True)
 
-        # instantiate model from parameters
-        model = self.defn.generateModule()
-        # TODO: makce an enum for controlling this, leave as default for now
-        optimizer = torch.optim.Adam(model.parameters())
-
         # TODO: The code below is specific to a PyTorchDataSet. Look into AutoTS/other libraries
         # to see how this might be made generic
         # preprocess it so that we can input it into our training/testing
         # X is of the shape [#time series, #data points in each, #features at each point]
-        self.dataset, self.testset = self.defn.dataset.get()
-        dataset_size = len(self.dataset)
+        # the datasets may already be set, e.g. by a sweep sharing them between runners
+        if self.dataset is None:
+            self.dataset, self.testset = self.defn.dataset.get()
+        checkpoint = None
+        if os.path.exists(self.checkpointPath()):
+            # written by this class, so it is trusted (the RNG states aren't plain tensors)
+            checkpoint = torch.load(self.checkpointPath(), weights_only=False)
+            split = checkpoint.get("split")
+            # continue on the split the interrupted run trained on, a dataset that
+            # isn't persisted may have drawn another one
+            if split is not None and self._splitIndices() is not None:
+                self.dataset = torch.utils.data.Subset(self.dataset.dataset, split["train"])
+                self.testset = torch.utils.data.Subset(self.testset.dataset, split["test"])
+        train_set, validation_set = self.dataset, None
+        if self.defn.patience > 0:
+            train_set, validation_set = self._validationSplit(self.dataset)
+
+        # instantiate model from parameters, or continue an interrupted run
+        start_epoch = 0
+        early_stopping = {"best_loss": math.inf, "best_model": None, "bad_epochs": 0}
+        scaler_state = None
+        model = self.defn.generateModule()
+        # TODO: makce an enum for controlling this, leave as default for now
+        optimizer = torch.optim.Adam(model.parameters())
+        if checkpoint is not None:
+            model.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            scaler_state = checkpoint["scaler"]
+            early_stopping = checkpoint["early_stopping"]
+            torch.set_rng_state(checkpoint["rng"]["torch"])
+            np.random.set_state(checkpoint["rng"]["numpy"])
+            random.setstate(checkpoint["rng"]["python"])
+            start_epoch = checkpoint["epoch"] + 1
+            print(f"Resuming training of {id} after epoch {checkpoint['epoch']}.")
+            # the interrupted run had already decided to stop, only the save is left
+            if self.defn.patience > 0 and early_stopping["bad_epochs"] >= self.defn.patience:
+                print(f"Stopping early, validation loss did not improve for {self.defn.patience} epochs.")
+                start_epoch = self.defn.epochs
 
         # train model on the data
-        model.train()
-
-        train_dataloader = torch.utils.data.DataLoader(self.dataset, batch_size=self.defn.train_batch_size)
-        batches = dataset_size // self.defn.train_batch_size
-        for epoch in range(self.defn.epochs):
-            batch_count = 0
-            epoch_start = datetime.now()
-            for batch in train_dataloader:
-                batch_start = datetime.now()
-                batch_coeffs, batch_y = batch
-                pred_y = model(batch_coeffs)
-                batch_y_norms = torch.tensor([[max(i.norm(), 1)] for i in batch_y[:,]]).transpose(1, -1)
-  
-                # weight = 
-                # loss = torch.nn.functional.l1_loss(pred_y / batch_y_norms, batch_y / batch_y_norms)
-                # TODO: need to let this function know about decomposition, but hardcoding it for now assuming one output
-                loss = None
-                if pred_y.size(1) == 1:
-                    loss_func = CustomLoss()
-                    loss = loss_func(pred_y, batch_y) #torch.nn.functional.mse_loss(pred_y, batch_y)
-                else:
-                    loss_func1 = CustomLoss(0.01)
-                    loss_func2 = CustomLoss(0.01)
-                    # print("means", pred_y[:,0], batch_y[:,0])
-                    mean_loss = loss_func1(pred_y[:,0], batch_y[:,0])
-                    # print("noise",pred_y[:,1], batch_y[:,1] )
-                    noise_loss = loss_func2(pred_y[:,1], batch_y[:,1])
-                    
-                    
-                    loss = mean_loss + 0.2 * noise_loss
-
-                optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
-                
-                batch_end = datetime.now()
-                print(f"Epoch {epoch}/ Batch {batch_count} of {batches}({int(100 * (batch_count / batches))}%): start: {batch_start} - end: {batch_end}    ", end='\r')
-                batch_count += 1
-            epoch_end = datetime.now()
-            print(f"Epoch: {epoch}   Training loss: {loss.item()}   start: {epoch_start}    end: {epoch_end}")
-
-        model_path = f"modeling/models/{id}.model"
-        torch.save({"model": model, "optimizer": optimizer}, model_path)
+        train_dataloader = self.trainLoader(train_set)
+        batches = len(train_dataloader)
+        # batches are copied to wherever the model lives, from pinned memory without blocking
+        device = next(iter(model.parameters())).device
+        # loss scaling is only enabled for float16
+        scaler = precisions.scaler(self.defn.precision, device.type)
+        if scaler_state is not None:
+            scaler.load_state_dict(scaler_state)
+        progress_every = max(1, batches // 100)
+        timer = instrumentation.PhaseTimer(f"{self.modelPath()}.phases.jsonl") if self.instrument else None
+        with self._profiler() as profiler, (timer.activate() if timer is not None else contextlib.nullcontext()):
+            for epoch in range(start_epoch, self.defn.epochs):
+                model.train()
+                samples = 0
+                input_wait = 0.0
+                epoch_start = datetime.now()
+                epoch_timer = time.perf_counter()
+                batch_end = epoch_timer
+                for batch_count, (batch_coeffs, batch_y) in enumerate(train_dataloader):
+                    data_time = time.perf_counter() - batch_end
+                    input_wait += data_time
+                    with instrumentation.phase("to_device"):
+                        batch_coeffs = batch_coeffs.to(device, non_blocking=True)
+                        batch_y = batch_y.to(device, non_blocking=True)
+                    with instrumentation.phase("forward"), precisions.autocast(self.defn.precision, device.type):
+                        pred_y = model(batch_coeffs)
+                    with instrumentation.phase("loss"):
+                        # the loss divides by small targets, keep it in float32
+                        loss = self.loss(pred_y.float(), batch_y)
+
+                    with instrumentation.phase("backward"):
+                        optimizer.zero_grad()
+                        scaler.scale(loss).backward()
+                    with instrumentation.phase("optimizer"):
+                        scaler.step(optimizer)
+                        scaler.update()
+
+                    samples += batch_y.size(0)
+                    if timer is not None:
+                        timer.add("data", data_time)
+                        timer.step(epoch=epoch, batch=batch_count, samples=batch_y.size(0))
+                    if profiler is not None:
+                        profiler.step()
+                    if batch_count % progress_every == 0:
+                        print(f"Epoch {epoch}/ Batch {batch_count} of {batches}({int(100 * (batch_count / batches))}%)    ", end='\r')
+                    batch_end = time.perf_counter()
+                epoch_end = datetime.now()
+                elapsed = time.perf_counter() - epoch_timer
+                print(f"Epoch: {epoch}   Training loss: {loss.item()}   start: {epoch_start}    end: {epoch_end}")
+                # a large share of time waiting for batches means training is input bound
+                print(f"Epoch: {epoch}   {samples / elapsed:.1f} samples/s   waiting for input: {100 * input_wait / elapsed:.1f}% of {elapsed:.1f}s")
+
+                stop = False
+                if validation_set is not None:
+                    with instrumentation.phase("validation"):
+                        pred_y, validation_y = self.predict(model, validation_set, self.defn.precision)
+                        validation_loss = self.loss(pred_y, validation_y).item() / max(1, len(validation_set))
+                    if timer is not None:
+                        timer.step(epoch=epoch, batch=None, samples=len(validation_set))
+                    if validation_loss < early_stopping["best_loss"]:
+                        early_stopping = {"best_loss": validation_loss, "best_model": copy.deepcopy(model.state_dict()), "bad_epochs": 0}
+                    else:
+                        early_stopping["bad_epochs"] += 1
+                    stop = early_stopping["bad_epochs"] >= self.defn.patience
+                    print(f"Epoch: {epoch}   Validation loss: {validation_loss}   best: {early_stopping['best_loss']}")
+                if timer is not None:
+                    # shares of the whole epoch, validation included
+                    elapsed = time.perf_counter() - epoch_timer
+                    print(f"Epoch: {epoch}   phases: " + "   ".join(f"{name}: {100 * seconds / elapsed:.1f}%" for name, seconds in timer.summary().items()))
+                self._saveCheckpoint(epoch, model, optimizer, scaler, early_stopping)
+                if stop:
+                    print(f"Stopping early, validation loss did not improve for {self.defn.patience} epochs.")
+                    break
+
+        if early_stopping["best_model"] is not None:
+            model.load_state_dict(early_stopping["best_model"])
+
+        self.inference_precision = "float32"
+        if self.defn.precision != "float32":
+            if self.comparePrecision(model)["acceptable"]:
+                self.inference_precision = self.defn.precision
+            else:
+                print(f"{self.defn.precision} inference is not accurate enough, the model will run in float32.")
+
+        self.save(model, optimizer)
+        # the run is complete, a new run of this definition would load the model instead
+        if os.path.exists(self.checkpointPath()):
+            os.remove(self.checkpointPath())
 
         
 
         return model, optimizer
+
+    """
+    Run model on dataset in batches of batch_size datapoints, without tracking
+    gradients, in the given precision (the runner's inference_precision by
+    default). Yields the float32 predictions and the targets of every batch.
+    """
+    def predictBatches(self, model, dataset: torch.utils.data.Dataset, precision: str = None, batch_size: int = 1024):
+        precision = self.inference_precision if precision is None else precision
+        model.eval()
+        loader = torch.utils.data.DataLoader(
+            dataset,
+            sampler=torch.utils.data.BatchSampler(torch.utils.data.SequentialSampler(dataset), batch_size, drop_last=False),
+            batch_size=None,
+        )
+        with torch.inference_mode(), precisions.autocast(precision):
+            for batch_X, batch_y in loader:
+                yield model(batch_X).float(), batch_y
+
+    """
+    All predictions of predictBatches at once.
+    """
+    def predict(self, model, dataset: torch.utils.data.Dataset, precision: str = None, batch_size: int = 1024) -> tuple[torch.Tensor, torch.Tensor]:
+        batches = list(self.predictBatches(model, dataset, precision, batch_size))
+        if len(batches) == 0:
+            return torch.empty(0), torch.empty(0)
+        return torch.cat([pred_y for pred_y, _ in batches]), torch.cat([batch_y for _, batch_y in batches])
+
+    """
+    Decide whether model can run in the reduced precision of its definition.
+    The average miss ratio (|miss| / |target|) on the test set in reduced
+    precision is compared against float32: against the float32 trained model of
+    the same definition if one was saved, otherwise against this model run in
+    float32. The reduced precision is acceptable if its miss ratio is at most
+    tolerance (relative) worse.
+    """
+    def comparePrecision(self, model, tolerance: float = 0.05) -> dict:
+        if self.testset is None:
+            _, self.testset = self.defn.dataset.get()
+
+        reference_defn = copy.copy(self.defn)
+        reference_defn.precision = "float32"
+        reference = TimeSeriersNNRunner(reference_defn)
+        if reference.trainedModelExists():
+            reference_model, _ = reference.load()
+            baseline = "float32 trained model"
+        else:
+            reference_model = model
+            baseline = "float32 inference"
+
+        reference_pred, test_y = self.predict(reference_model, self.testset, "float32")
+        reduced_pred, _ = self.predict(model, self.testset, self.defn.precision)
+        reference_ratio = TimeSeriersNNRunner.missRatio(reference_pred, test_y)
+        reduced_ratio = TimeSeriersNNRunner.missRatio(reduced_pred, test_y)
+        result = {
+            "precision": self.defn.precision,
+            "baseline": baseline,
+            "float32_miss_ratio": reference_ratio,
+            "reduced_miss_ratio": reduced_ratio,
+            "max_prediction_difference": (reduced_pred - reference_pred).abs().max().item() if len(test_y) > 0 else 0.0,
+            "acceptable": reduced_ratio <= reference_ratio * (1 + tolerance),
+        }
+        print(f"{self.defn.precision} vs {baseline}: avg miss ratio {reduced_ratio} vs {reference_ratio}, "\
+              f"max prediction difference {result['max_prediction_difference']}, acceptable: {result['acceptable']}")
+        return result
+
+    """
+    Average of |pred - target| / |target| over the datapoints, 1 where the target is 0.
+    """
+    @staticmethod
+    def missRatio(pred_y: torch.Tensor, test_y: torch.Tensor) -> float:
+        if len(test_y) == 0:
+            return 0.0
+        mags = test_y.norm(dim=1)
+        miss_mags = (pred_y - test_y).norm(dim=1)
+        ratios = torch.where(mags == 0, 1.0, miss_mags / mags)
+        return ratios.mean().item()
     
-    def test(self, model):
+    """
+    Evaluate model on the test set, batch_size datapoints at a time, in the
+    precision it runs in. Datapoints are bucketed by the magnitude of their
+    target, class c holding magnitudes in [2^c, 2^(c+1)) (rounded towards 0,
+    class -99 holds zero targets), and the statistics of every bucket are
+    accumulated per batch. The report is printed, written to
+    modeling/models/{id}.test.json and returned.
+    """
+    def test(self, model, batch_size: int = 1024) -> dict:
         if self.testset is None:
             _, self.testset = self.defn.dataset.get()
-       
-        model.eval()
-        test_X, test_y = self.testset[:]
-        print("Testing dataset size", test_X.size())
-        pred_y = model(test_X)
-
-        prediction_miss = (pred_y - test_y)
-        mags = []
-        miss_mags = []
-        for i, test in enumerate(test_y):
-            mags.append(test.norm())
-        for i, miss in enumerate(prediction_miss):
-            miss_mags.append(miss.norm())
-        classes = {}
-        for miss_mag, mag in zip(miss_mags, mags):
-            cls = -99 if mag == 0 else int(math.log(mag, 2))
-            if not cls in classes:
-                classes[cls] = {"ratio":[], "total": []}
-            classes[cls]["ratio"].append(1 if mag == 0 else miss_mag/mag)
-            classes[cls]["total"].append(miss_mag)
-
-        for cls in sorted(classes.keys()):
-            count = len(classes[cls]['ratio'])
-            total_miss = sum(classes[cls]['total'])
-            avg_miss = total_miss / count
-            avg_miss_ratio = sum(classes[cls]['ratio']) / count
-            print(f"class {cls} (2^{cls}):"\
-                f"             count: {count}"\
-                f"    total miss mag: {total_miss}"\
-                f"      avg miss mag: {avg_miss}"\
-                f"    avg miss ratio: {avg_miss_ratio}")
-        average_miss_mag = sum([1 if mags[i] == 0 else miss_mags[i]/ mags[i] for i in range(len(mags))]) / len(mags)
-        print(f"avg_miss_ratio: {average_miss_mag}")
-        print(f"miss norm:", prediction_miss.norm())
\ No newline at end of file
+        print("Testing dataset size", len(self.testset))
+
+        start = time.perf_counter()
+        # classes are log2 of float32 magnitudes (or -99), offset to index the accumulators
+        offset = 160
+        counts = torch.zeros(2 * offset, dtype=torch.float64)
+        total_miss = torch.zeros(2 * offset, dtype=torch.float64)
+        total_ratio = torch.zeros(2 * offset, dtype=torch.float64)
+        squared_miss = 0.0
+        for pred_y, test_y in self.predictBatches(model, self.testset, batch_size=batch_size):
+            miss = (pred_y - test_y).double()
+            mags = test_y.double().norm(dim=1)
+            miss_mags = miss.norm(dim=1)
+            zero = mags == 0
+            classes = torch.where(zero, -99.0, torch.log2(mags).trunc()).long() + offset
+            ratios = torch.where(zero, 1.0, miss_mags / mags)
+            counts += torch.bincount(classes, minlength=2 * offset)
+            total_miss += torch.bincount(classes, weights=miss_mags, minlength=2 * offset)
+            total_ratio += torch.bincount(classes, weights=ratios, minlength=2 * offset)
+            squared_miss += miss.square().sum().item()
+
+        report = {
+            "model_id": self.modelId(),
+            "samples": int(counts.sum().item()),
+            "precision": self.inference_precision,
+            "avg_miss_ratio": (total_ratio.sum() / counts.sum()).item() if counts.sum() > 0 else None,
+            "miss_norm": math.sqrt(squared_miss),
+            "classes": [],
+        }
+        for index in torch.nonzero(counts).flatten().tolist():
+            count = int(counts[index].item())
+            report["classes"].append({
+                "class": index - offset,
+                "count": count,
+                "total_miss_mag": total_miss[index].item(),
+                "avg_miss_mag": total_miss[index].item() / count,
+                "avg_miss_ratio": total_ratio[index].item() / count,
+            })
+        report["seconds"] = time.perf_counter() - start
+
+        for cls in report["classes"]:
+            print(f"class {cls['class']} (2^{cls['class']}):"\
+                f"             count: {cls['count']}"\
+                f"    total miss mag: {cls['total_miss_mag']}"\
+                f"      avg miss mag: {cls['avg_miss_mag']}"\
+                f"    avg miss ratio: {cls['avg_miss_ratio']}")
+        print(f"avg_miss_ratio: {report['avg_miss_ratio']}")
+        print(f"miss norm:", report["miss_norm"])
+
+        with open(f"{self.modelPath()}.test.json", "w+") as outfile:
+            json.dump(report, outfile, indent=3)
+        return report
+
+if True:
+    from pathlib import Path
+    Path(TimeSeriersNNRunner._model_path).mkdir(parents=True, exist_ok=True)
+    Path(TimeSeriersNNRunner._checkpoint_path).mkdir(parents=True, exist_ok=True)
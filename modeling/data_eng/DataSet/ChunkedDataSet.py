@@ -0,0 +1,61 @@
+from util import columnar
+import numpy as np
+import torch
+
+"""
+A torch Dataset of the datapoints of several columnar chunks (see
+PyTorchDataSet.refresh), each holding the X and y arrays of one frame. The
+chunks are memory mapped and indexed as if they were concatenated, so a dataset
+assembled from cached chunks is never copied into one array. Pickling only
+stores the directories of the chunks.
+"""
+class ChunkedDataSet(torch.utils.data.Dataset):
+    def __init__(self, directories: list[str]):
+        self.directories = directories
+        self._map()
+
+    def _map(self):
+        self.X = [columnar.read(directory, "X", mmap_mode='r') for directory in self.directories]
+        self.y = [columnar.read(directory, "y", mmap_mode='r') for directory in self.directories]
+        # index of the first datapoint of every chunk, and the total at the end
+        self.offsets = np.concatenate([[0], np.cumsum([len(y) for y in self.y], dtype=np.int64)])
+
+    def __getstate__(self):
+        return {"directories": self.directories}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    """
+    Gather the datapoints at the given indices, with one gather per chunk they
+    fall into. Returns X and y with the datapoints stacked along the first axis.
+    """
+    def batch(self, indices) -> tuple[torch.Tensor, torch.Tensor]:
+        indices = np.asarray(indices, dtype=np.int64)
+        chunks = np.searchsorted(self.offsets, indices, side='right') - 1
+        X = np.empty((len(indices),) + self.X[0].shape[1:], dtype=np.float32)
+        y = np.empty((len(indices),) + self.y[0].shape[1:], dtype=np.float32)
+        for chunk in np.unique(chunks):
+            selected = chunks == chunk
+            rows = indices[selected] - self.offsets[chunk]
+            X[selected] = self.X[chunk][rows]
+            y[selected] = self.y[chunk][rows]
+        return torch.from_numpy(X), torch.from_numpy(y)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            X, y = self.batch([index])
+            return X[0], y[0]
+        if isinstance(index, slice):
+            index = np.arange(len(self))[index]
+        # lists and slices return whole batches, like TensorDataset
+        return self.batch(index)
+
+    # used by DataLoader to fetch a batch of samples in one call
+    def __getitems__(self, indices: list[int]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        X, y = self.batch(indices)
+        return list(zip(X, y))
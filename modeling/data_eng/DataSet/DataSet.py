@@ -25,6 +25,22 @@ class DataSet(Exportable):
     def formatData(self, frames: list[pd.DataFrame]):
         raise Exception("Unimplemented")
     
+    """
+    Read the formatted data persisted by saveCache, or None if there is none.
+    Override together with saveCache to use a different format than a pickle.
+    """
+    def loadCache(self, id: str):
+        path = f"{DataSet._path}/{id}.ds"
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as openfile:
+            return pickle.load(openfile)
+
+    def saveCache(self, id: str, formatted_data):
+        path = f"{DataSet._path}/{id}.ds"
+        with open(path, "wb+") as outfile:
+            pickle.dump(formatted_data, outfile)
+
     def get(self):
         id = self.exportableDescriptor()
         # save config to file if not already there.
@@ -32,20 +48,28 @@ class DataSet(Exportable):
             self.saveToFile(toJson=True)
 
         if self.persist:
-            path = f"{DataSet._path}/{id}.ds"
-            if os.path.exists(path):
-                with open(path, "rb") as openfile:
-                    formatted_data = pickle.load(openfile)
+            formatted_data = self.loadCache(id)
+            if formatted_data is not None:
                 return formatted_data
             
         frames = self.source.loadDataFrames()
         formatted_data = self.formatData(frames)
 
         if self.persist:
-            path = f"{DataSet._path}/{id}.ds"
-            with open(path, "wb+") as outfile:
-                pickle.dump(formatted_data, outfile)
+            self.saveCache(id, formatted_data)
+
+        return formatted_data
 
+    """
+    Rebuild the persisted data after new data was appended to the source.
+    Subclasses can override this to only format the new part of the data.
+    """
+    def refresh(self):
+        assert self.persist, "Refreshing needs persist=True"
+        if not self.fileAlreadyExists():
+            self.saveToFile(toJson=True)
+        formatted_data = self.formatData(self.source.refresh())
+        self.saveCache(self.exportableDescriptor(), formatted_data)
         return formatted_data
     
     def export_keys(self) -> list[dict]:
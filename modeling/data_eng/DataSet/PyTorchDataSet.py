@@ -1,7 +1,15 @@
 from modeling.data_eng.DataSource.DataSource import DataSource
 from modeling.data_eng.DataSet.DataSet import DataSet
+from modeling.data_eng.DataSet.WindowedDataSet import WindowedDataSet
+from modeling.data_eng.DataSet.ChunkedDataSet import ChunkedDataSet
+from modeling.data_eng.DataSet.WindowStore import WindowStore, window_draws
+from util import columnar, parallel
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
 import pandas as pd
+import shutil
 import torch
+import os
 import torchcde
 
 """
@@ -9,7 +17,11 @@ This class takes a DataSource and transforms it into a form usable for training
 neural network models.
 """
 class PyTorchDataSet(DataSet):
-    def __init__(self, source: DataSource, datapoint_length: int, input_features: list[str], output_features: list[str], overlap: float = 0.25, max_dataset_size: int = 0, cubic_interp: bool = False, persist: bool = False):
+    # defaults for datasets pickled before these settings existed
+    lazy = False
+    workers = 1
+
+    def __init__(self, source: DataSource, datapoint_length: int, input_features: list[str], output_features: list[str], overlap: float = 0.25, max_dataset_size: int = 0, cubic_interp: bool = False, persist: bool = False, lazy: bool = False, workers: int = 1):
         super().__init__(source, persist=persist)
         self.datapoint_length = datapoint_length
         self.input_features = input_features
@@ -17,55 +29,233 @@ class PyTorchDataSet(DataSet):
         self.overlap = overlap
         self.max_dataset_size = max_dataset_size
         self.cubic_interp = cubic_interp
+        self.lazy = lazy
+        self.workers = workers
     
     """
-    Format the data so that it can be fed into a training algorithm. 
-    Override this method to apply a transformation. This method determines
-    the return type of the get() method.
+    Number of rows between the starts of consecutive datapoints. Consecutive
+    datapoints share overlap * datapoint_length rows.
+    """
+    def stride(self) -> int:
+        return max(1, self.datapoint_length - int(self.overlap * self.datapoint_length))
+
+    """
+    Format the data so that it can be fed into a training algorithm. Every frame
+    is converted to one contiguous array and cut into windows of datapoint_length
+    rows, stride rows apart. With lazy=True the windows are sliced on demand
+    from the source's shared WindowStore instead, and the dataset is only a
+    projection onto its features (see WindowedDataSet). With workers > 1
+    frames are windowed (and interpolated) by a pool of that many processes.
     """
     def formatData(self, frames: list[pd.DataFrame]):
+        if self.lazy:
+            store = self.windowStore()
+            store.update(frames)
+            return self._split(store.dataset(self.input_features, self.output_features, self.cubic_interp), store.draws())
+        frames = [frame.dropna() for frame in frames]
+        if self.workers > 1:
+            return self._split(self._parallelTensorDataSet(frames), self._draws(frames))
+        return self._split(self._tensorDataSet(frames), self._draws(frames))
+
+    def _parallelTensorDataSet(self, frames: list[pd.DataFrame]) -> torch.utils.data.TensorDataset:
+        print(f"Converting dataframes to timeseries datapoints with {self.workers} workers.")
+        frame_arrays = []
+        for frame in frames:
+            if frame.index.size > self.datapoint_length:
+                frame_arrays.append((frame[self.input_features].to_numpy(dtype=np.float32), frame[self.output_features].to_numpy(dtype=np.float32)))
+        results = parallel.map_frames(_windowFrame, frame_arrays, self.workers, (self.datapoint_length, self.stride(), self.cubic_interp))
+        X = torch.from_numpy(np.concatenate([X for X, _ in results]))
+        y = torch.from_numpy(np.concatenate([y for _, y in results]))
+        return torch.utils.data.TensorDataset(X, y)
+
+    def _tensorDataSet(self, frames: list[pd.DataFrame]) -> torch.utils.data.TensorDataset:
         import util.progress as progress
-        
-        X = []
-        y = []
+
+        length = self.datapoint_length
+        stride = self.stride()
+
+        windows = []
+        labels = []
         print("Converting dataframes to timeseries datapoints.")
         for i in range(len(frames)):
-            frames[i].dropna(inplace=True)
+            frame = frames[i]
+            inputs = frame[self.input_features].to_numpy(dtype=np.float32)
+            outputs = frame[self.output_features].to_numpy(dtype=np.float32)
 
-            copy_size = int(self.overlap * self.datapoint_length)
-            copy_size = max(copy_size, self.datapoint_length - 1)
             # label every sequence of X coordinates with the y coordinate one step in the future. 
             # Throw out the last x value because it has no label.
-            for j in range(self.datapoint_length-1, frames[i].index.size-1):
-                y_df = frames[i].at_time(frames[i].index[j+1])[self.output_features]
-                x_df = frames[i][frames[i].index[j-self.datapoint_length + 1]:frames[i].index[j]][self.input_features]
-                X.append(torch.concat((torch.tensor([[i / float(self.datapoint_length)] for i in range(self.datapoint_length)]), torch.tensor(x_df.values)), 1).float())
-                y.append(torch.tensor(y_df.values).transpose(0, 1).squeeze(-1).float())
-
-                if self.overlap > 0:
-                    j -= (copy_size - 1)
+            if inputs.shape[0] > length:
+                # (windows, features, length) view of the frame, nothing is copied yet
+                windows.append(sliding_window_view(inputs[:-1], length, axis=0)[::stride])
+                labels.append(outputs[length::stride])
 
             progress.bar(i, len(frames) - 1)
 
-
-        X = torch.stack(X)
-        y = torch.stack(y)
+        # copy every window once, into a single array with the normalized time channel first
+        X = np.empty((sum(w.shape[0] for w in windows), length, 1 + len(self.input_features)), dtype=np.float32)
+        X[:, :, 0] = np.arange(length, dtype=np.float32) / float(length)
+        offset = 0
+        for w in windows:
+            X[offset:offset + w.shape[0], :, 1:] = w.transpose(0, 2, 1)
+            offset += w.shape[0]
+        X = torch.from_numpy(X)
+        y = torch.from_numpy(np.concatenate(labels))
         if self.cubic_interp:
             X = torchcde.hermite_cubic_coefficients_with_backward_differences(X)
+        return torch.utils.data.TensorDataset(X, y)
+
+    """
+    The windows of the source shared by lazy datasets with the same datapoint length and stride.
+    """
+    def windowStore(self) -> WindowStore:
+        return WindowStore(self.source.exportableDescriptor(), self.datapoint_length, self.stride())
 
-        throw_away = 0
-        if self.max_dataset_size > 0:
-            throw_away = (X.size(0) - self.max_dataset_size)/ X.size(0)
+    """
+    The window_draws of the datapoints formatData cuts from frames (without
+    missing values), in the same order.
+    """
+    def _draws(self, frames: list[pd.DataFrame]) -> np.ndarray:
+        draws = [
+            window_draws(pd.Timestamp(frame.index[0]).value, np.arange(0, frame.index.size - self.datapoint_length, self.stride(), dtype=np.int64))
+            for frame in frames if frame.index.size > self.datapoint_length
+        ]
+        return np.concatenate(draws) if len(draws) > 0 else np.empty((0, 2))
 
-        if throw_away == 0:
-            split = [0.8, 0.2]
-            print("Ratio (train/test)", split)
-            [train, test] =  torch.utils.data.random_split(torch.utils.data.TensorDataset(X, y), split)
+    """
+    Split the datapoints into train and test by their window_draws: the first
+    draw puts a datapoint into the test set if it is at least 0.8, and with
+    max_dataset_size only datapoints whose second draw is below
+    max_dataset_size / #datapoints are kept. get() and refresh() draw the same
+    numbers for a datapoint, so they always split the data the same way.
+    """
+    def _split(self, dataset: torch.utils.data.Dataset, draws: np.ndarray):
+        keep = 1.0 if self.max_dataset_size <= 0 else min(1.0, self.max_dataset_size / max(1, len(draws)))
+        kept = draws[:, 1] < keep
+        train = np.flatnonzero(kept & (draws[:, 0] < 0.8))
+        test = np.flatnonzero(kept & (draws[:, 0] >= 0.8))
+        print(f"{len(draws)} datapoints (train/test): {len(train)}/{len(test)}")
+        return torch.utils.data.Subset(dataset, train), torch.utils.data.Subset(dataset, test)
+
+    """
+    Incrementally update the persisted dataset after new data was appended to
+    the source. The source only processes the new time range (see
+    DataSource.refresh), and the datapoints of every frame are cached under the
+    frame's content hash in modeling/datasets/{id}/chunks (lazy datasets update
+    the shared WindowStore instead), so only new or extended frames are
+    windowed. The refreshed dataset indexes the cached chunks in place (see
+    ChunkedDataSet), so only its split is written. Every datapoint has fixed
+    random draws seeded by the start time of its frame and its row in the frame
+    (see window_draws), which assign it to train or test, so existing
+    datapoints keep their side of the split as the dataset grows. With
+    max_dataset_size, the share of datapoints kept shrinks as data is appended,
+    so existing datapoints can drop out of the dataset, but a datapoint never
+    moves between train and test.
+    """
+    def refresh(self):
+        assert self.persist and self.source.persist, "Incremental refresh needs persist=True on the dataset and its source"
+        id = self.exportableDescriptor()
+        if not self.fileAlreadyExists():
+            self.saveToFile(toJson=True)
+
+        self.source.refresh()
+        hashes = self.source.frameHashes()
+        if self.lazy:
+            store = self.windowStore()
+            store.update(self.source.loadDataFrames())
+            dataset = store.dataset(self.input_features, self.output_features, self.cubic_interp)
+            draws = store.draws()
+        else:
+            chunks = [self._frameChunk(id, i, frame_hash) for i, frame_hash in enumerate(hashes)]
+            chunks = [chunk for chunk in chunks if chunk is not None]
+            dataset = ChunkedDataSet(chunks)
+            draws = np.concatenate([columnar.read(chunk, "split_draws") for chunk in chunks]) if len(chunks) > 0 else np.empty((0, 2))
+
+        formatted_data = self._split(dataset, draws)
+        self.saveCache(id, formatted_data)
+        # drop chunks of frames replaced by the refresh
+        for frame_hash in os.listdir(f"{DataSet._path}/{id}/chunks") if os.path.exists(f"{DataSet._path}/{id}/chunks") else []:
+            if not frame_hash in hashes:
+                shutil.rmtree(f"{DataSet._path}/{id}/chunks/{frame_hash}")
+        return formatted_data
+
+    """
+    The directory of the datapoints of the i-th frame of the source, built and
+    cached on first use. Returns None for frames too short to hold a datapoint.
+    """
+    def _frameChunk(self, id: str, i: int, frame_hash: str) -> str:
+        directory = f"{DataSet._path}/{id}/chunks/{frame_hash}"
+        arrays = columnar.read_manifest(directory)["arrays"] if columnar.exists(directory) else None
+        # chunks written before the draws were seeded by position are rebuilt once
+        if arrays is None or (len(arrays) > 0 and "split_draws" not in arrays):
+            frame = self.source.loadDataFrames(frames=[i])[0].dropna()
+            inputs = frame[self.input_features].to_numpy(dtype=np.float32)
+            outputs = frame[self.output_features].to_numpy(dtype=np.float32)
+            arrays = {}
+            if inputs.shape[0] > self.datapoint_length:
+                arrays["X"], arrays["y"] = _windowFrame(inputs, outputs, self.datapoint_length, self.stride(), self.cubic_interp)
+                # seeded by position, so extending the frame keeps the split of its windows
+                arrays["split_draws"] = self._draws([frame])
+            columnar.write(directory, arrays, {"frame": frame_hash})
+        return directory if len(arrays) > 0 else None
+
+    """
+    Persist the train/test split as a columnar cache in modeling/datasets/{id}/:
+    the samples are stored once and the split as index arrays. Lazy datasets only
+    store their projection and the version of the WindowStore they index, and
+    datasets assembled by refresh() the frame chunks they index.
+    """
+    def saveCache(self, id: str, formatted_data):
+        train, test = formatted_data
+        dataset = train.dataset
+        directory = f"{DataSet._path}/{id}"
+        arrays = {"train": np.asarray(train.indices, dtype=np.int64), "test": np.asarray(test.indices, dtype=np.int64)}
+        if isinstance(dataset, WindowedDataSet):
+            store = self.windowStore()
+            manifest = {"kind": "projection", "store_version": store.version(), "cubic_interp": dataset.cubic_interp}
+        elif isinstance(dataset, ChunkedDataSet):
+            # the samples stay in the chunks, only the split is written
+            manifest = {"kind": "chunks", "chunks": [os.path.basename(chunk) for chunk in dataset.directories]}
         else:
-            split = [(1.0-throw_away) * 0.8, (1.0-throw_away) * 0.2, throw_away]
-            print("Ratio (train/test/throwout)", split)
-            [train, test, _] =  torch.utils.data.random_split(torch.utils.data.TensorDataset(X, y), split)
+            X, y = dataset.tensors
+            arrays["X"] = X.numpy()
+            arrays["y"] = y.numpy()
+            manifest = {"kind": "tensor"}
+        manifest["frames_version"] = DataSource._frames_version
+        manifest["split"] = "window_draws"
+        columnar.write(directory, arrays, manifest)
+        if manifest["kind"] == "chunks":
+            # samples of a version of the dataset built by get()
+            for name in ["X", "y"]:
+                if os.path.exists(f"{directory}/{name}.npy"):
+                    os.remove(f"{directory}/{name}.npy")
 
+    def loadCache(self, id: str):
+        directory = f"{DataSet._path}/{id}"
+        if not columnar.exists(directory):
+            # pickled caches from before the columnar format also predate the current frames
+            return None
+        manifest = columnar.read_manifest(directory)
+        if manifest.get("frames_version") != DataSource._frames_version:
+            # built from frames cut by an older version of the source
+            return None
+        if manifest.get("split") != "window_draws":
+            # split at random, refresh() would split the same data differently
+            return None
+        if manifest["kind"] == "projection":
+            store = self.windowStore()
+            if store.version() != manifest["store_version"]:
+                # the store was rebuilt from other frames since, the split no longer matches
+                return None
+            dataset = store.dataset(self.input_features, self.output_features, manifest["cubic_interp"])
+        elif manifest["kind"] == "chunks":
+            chunks = [f"{directory}/chunks/{chunk}" for chunk in manifest["chunks"]]
+            if not all(columnar.exists(chunk) for chunk in chunks):
+                return None
+            dataset = ChunkedDataSet(chunks)
+        else:
+            dataset = torch.utils.data.TensorDataset(torch.from_numpy(columnar.read(directory, "X")), torch.from_numpy(columnar.read(directory, "y")))
+        train = torch.utils.data.Subset(dataset, columnar.read(directory, "train"))
+        test = torch.utils.data.Subset(dataset, columnar.read(directory, "test"))
         return train, test
 
     
@@ -81,4 +271,23 @@ class PyTorchDataSet(DataSet):
             "cubic_interp": self.cubic_interp,
           }
         )
-        return running
\ No newline at end of file
+        # datasets built before overlap was honored used every window (stride 1)
+        if self.stride() != 1:
+            running[-1]["stride"] = self.stride()
+        if self.lazy:
+            running[-1]["lazy"] = True
+        return running
+
+"""
+Cut one frame into datapoints, see PyTorchDataSet.formatData. Runs in the
+worker processes when PyTorchDataSet.workers > 1. Interpolation coefficients
+only depend on their own window, so they can be computed frame by frame.
+"""
+def _windowFrame(inputs: np.ndarray, outputs: np.ndarray, length: int, stride: int, cubic_interp: bool) -> tuple[np.ndarray, np.ndarray]:
+    windows = sliding_window_view(inputs[:-1], length, axis=0)[::stride]
+    X = np.empty((windows.shape[0], length, 1 + inputs.shape[1]), dtype=np.float32)
+    X[:, :, 0] = np.arange(length, dtype=np.float32) / float(length)
+    X[:, :, 1:] = windows.transpose(0, 2, 1)
+    if cubic_interp:
+        X = torchcde.hermite_cubic_coefficients_with_backward_differences(torch.from_numpy(X)).numpy()
+    return X, np.ascontiguousarray(outputs[length::stride])
@@ -0,0 +1,196 @@
+from modeling.data_eng.DataSource.DataSource import hash_frame
+from modeling.data_eng.DataSet.WindowedDataSet import WindowedDataSet
+from util import columnar
+import numpy as np
+import pandas as pd
+import hashlib
+import io
+import os
+
+"""
+Windows of a DataSource shared by every lazy PyTorchDataSet built from it with
+the same datapoint length and stride. The store holds all columns of the
+source's frames once, in one memory mapped array, plus the start row of every
+window. A dataset is then only a projection onto its input and output columns
+and an index of the windows in its split, so datasets over different feature
+subsets cost one windowing pass and one copy of the data.
+
+Stores live in modeling/windowstores/{source id}-L{datapoint_length}-s{stride}
+and remember the content hashes of the frames they were built from, so only the
+frames that changed are written when the source's frames do.
+"""
+class WindowStore:
+    _path = "modeling/windowstores"
+
+    def __init__(self, source_id: str, datapoint_length: int, stride: int):
+        self.datapoint_length = datapoint_length
+        self.stride = stride
+        self.directory = f"{WindowStore._path}/{source_id}-L{datapoint_length}-s{stride}"
+
+    def exists(self) -> bool:
+        return columnar.exists(self.directory)
+
+    def manifest(self) -> dict:
+        return columnar.read_manifest(self.directory)
+
+    """
+    Identifies the content of the store, changes whenever the frames do.
+    """
+    def version(self) -> str:
+        return self.manifest()["version_hash"] if self.exists() else None
+
+    """
+    Make the store hold the windows of frames. Does nothing if it already does.
+    The rows of frames the store already holds at the same position are kept,
+    and the frames from the first changed one on are appended to the array
+    (see _append), so a refresh that extends the open frame only writes that
+    frame. The array is rewritten once the rows it holds for replaced frames
+    outnumber the live ones.
+    """
+    def update(self, frames: list[pd.DataFrame]):
+        frames = [frame.dropna() for frame in frames]
+        hashes = [hash_frame(frame) for frame in frames]
+        columns = list(frames[0].columns) if len(frames) > 0 else []
+        manifest = self.manifest() if self.exists() else None
+        # stores written before the frame offsets were recorded are rebuilt once
+        if manifest is None or "offsets" not in manifest or manifest["columns"] != columns:
+            kept = 0
+        elif manifest["frames"] == hashes:
+            return
+        else:
+            kept = 0
+            while kept < min(len(hashes), len(manifest["frames"])) and manifest["frames"][kept] == hashes[kept]:
+                kept += 1
+
+        os.makedirs(self.directory, exist_ok=True)
+        columnar.invalidate(self.directory)
+        offsets = None
+        if kept > 0:
+            offsets = self._append(frames[kept:], columns, sum(frame.index.size for frame in frames))
+        if offsets is None:
+            offsets = self._write(frames, columns)
+        else:
+            offsets = manifest["offsets"][:kept] + offsets
+
+        starts = []
+        windows = []
+        for frame, offset in zip(frames, offsets):
+            # the last row of a frame has no label, so the last window starts length + 1 rows from the end
+            frame_starts = np.arange(0, max(0, frame.index.size - self.datapoint_length), self.stride, dtype=np.int64)
+            starts.append(offset + frame_starts)
+            windows.append(len(frame_starts))
+
+        columnar.write(self.directory, {"starts": np.concatenate(starts) if len(starts) > 0 else np.empty(0, dtype=np.int64)}, {
+            "columns": columns,
+            "frames": hashes,
+            "frame_starts": [pd.Timestamp(frame.index[0]).value if frame.index.size > 0 else 0 for frame in frames],
+            "windows": windows,
+            "offsets": offsets,
+            "version_hash": hashlib.sha1("".join(hashes).encode()).hexdigest(),
+        })
+
+    """
+    Write the rows of frames into a new array. Returns the row every frame
+    starts at.
+    """
+    def _write(self, frames: list[pd.DataFrame], columns: list[str]) -> list[int]:
+        # written next to the current array and swapped in, datasets may still have it mapped
+        data = np.lib.format.open_memmap(f"{self.directory}/data.npy.tmp", mode='w+', dtype=np.float32, shape=(sum(frame.index.size for frame in frames), len(columns)))
+        offsets = []
+        offset = 0
+        print("Writing timeseries to the window store.")
+        for frame in frames:
+            data[offset:offset + frame.index.size] = frame[columns].to_numpy(dtype=np.float32)
+            offsets.append(offset)
+            offset += frame.index.size
+        data.flush()
+        del data
+        os.replace(f"{self.directory}/data.npy.tmp", f"{self.directory}/data.npy")
+        return offsets
+
+    """
+    Append the rows of frames to the end of the array, behind the rows of
+    every earlier version of the store, and grow the shape in its header.
+    Existing rows are never written, so datasets that still map an earlier
+    version keep reading its rows. live is the number of rows of the new
+    version of the store. Returns the row every frame starts at, or None if the array
+    should be rewritten instead.
+    """
+    def _append(self, frames: list[pd.DataFrame], columns: list[str], live: int) -> list[int]:
+        path = f"{self.directory}/data.npy"
+        with open(path, "r+b") as datafile:
+            version = np.lib.format.read_magic(datafile)
+            if version != (1, 0):
+                return None
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(datafile)
+            header_size = datafile.tell()
+            rows = shape[0] + sum(frame.index.size for frame in frames)
+            if rows - live > live:
+                # mostly rows of replaced frames
+                return None
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran_order, "shape": (rows, len(columns))})
+            if len(header.getvalue()) != header_size:
+                # the header has no room for the new shape
+                return None
+
+            offsets = []
+            offset = shape[0]
+            print("Appending timeseries to the window store.")
+            datafile.seek(header_size + offset * len(columns) * dtype.itemsize)
+            for frame in frames:
+                datafile.write(np.ascontiguousarray(frame[columns].to_numpy(dtype=np.float32)).tobytes())
+                offsets.append(offset)
+                offset += frame.index.size
+            # the new rows are complete before the header counts them
+            datafile.flush()
+            datafile.seek(0)
+            datafile.write(header.getvalue())
+        return offsets
+
+    """
+    The windows of the store projected onto the given features.
+    """
+    def dataset(self, input_features: list[str], output_features: list[str], cubic_interp: bool = False) -> WindowedDataSet:
+        columns = self.manifest()["columns"]
+        return WindowedDataSet(
+            f"{self.directory}/data.npy", columnar.read(self.directory, "starts", mmap_mode='r'), self.datapoint_length,
+            len(input_features), cubic_interp,
+            input_columns=[columns.index(feature) for feature in input_features],
+            output_columns=[columns.index(feature) for feature in output_features],
+        )
+
+    """
+    The window_draws of every window of the store.
+    """
+    def draws(self) -> np.ndarray:
+        manifest = self.manifest()
+        draws = [window_draws(start, np.arange(count, dtype=np.int64) * self.stride) for start, count in zip(manifest["frame_starts"], manifest["windows"])]
+        return np.concatenate(draws) if len(draws) > 0 else np.empty((0, 2))
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    # uint64 arrays wrap around silently, which the mixing relies on
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def _uniform(x: np.ndarray) -> np.ndarray:
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+"""
+Two fixed random numbers in [0, 1) for each window of a frame, as an array of
+shape (windows, 2). They only depend on the time the frame starts (in ns) and
+the row the window starts at within the frame, which stay the same when the
+open frame is extended and renormalized by a refresh. The first number picks
+the window's side of the train/test split, the second whether it is kept when
+max_dataset_size thins the dataset out, see PyTorchDataSet.refresh.
+"""
+def window_draws(frame_start: int, offsets: np.ndarray) -> np.ndarray:
+    keys = _splitmix64(np.array([frame_start], dtype=np.int64).view(np.uint64))[0] ^ offsets.astype(np.uint64)
+    side = _splitmix64(keys)
+    return np.stack([_uniform(side), _uniform(_splitmix64(side))], axis=1)
+
+if True:
+    from pathlib import Path
+    Path(WindowStore._path).mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,80 @@
+import numpy as np
+import torch
+import torchcde
+
+"""
+A torch Dataset of time series windows sliced on demand from a memory mapped
+array, instead of materializing every (overlapping) window in memory.
+
+The array holds the rows of every frame back to back, input features first then
+output features. starts holds the row offset of every valid window: the window
+is rows [start, start + datapoint_length) of the input features with the
+normalized time channel prepended, and its label is the output features of row
+start + datapoint_length. Pickling only stores the path of the array and the
+offsets, so datasets built from it persist and load almost instantly.
+
+input_columns and output_columns project a wider array (see WindowStore) onto
+the dataset's features.
+"""
+class WindowedDataSet(torch.utils.data.Dataset):
+    # defaults for datasets pickled before projections existed
+    input_columns = None
+    output_columns = None
+
+    def __init__(self, path: str, starts: np.ndarray, datapoint_length: int, num_inputs: int, cubic_interp: bool = False, input_columns: list[int] = None, output_columns: list[int] = None):
+        self.path = path
+        self.starts = starts
+        self.datapoint_length = datapoint_length
+        self.num_inputs = num_inputs
+        self.cubic_interp = cubic_interp
+        self.input_columns = input_columns
+        self.output_columns = output_columns
+        self.data = np.load(path, mmap_mode='r')
+        self.time_channel = np.arange(datapoint_length, dtype=np.float32) / float(datapoint_length)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['data']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data = np.load(self.path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.starts)
+
+    """
+    Slice the windows starting at the given offsets with one gather from the
+    memory mapped array. Returns X of shape [#windows, datapoint_length, 1 + #inputs]
+    (or its cubic coefficients) and y of shape [#windows, #outputs].
+    """
+    def batch(self, indices) -> tuple[torch.Tensor, torch.Tensor]:
+        starts = self.starts[indices]
+        rows = starts[:, None] + np.arange(self.datapoint_length)
+        X = np.empty((len(starts), self.datapoint_length, 1 + self.num_inputs), dtype=np.float32)
+        X[:, :, 0] = self.time_channel
+        if self.input_columns is None:
+            X[:, :, 1:] = self.data[rows, :self.num_inputs]
+            y = np.ascontiguousarray(self.data[starts + self.datapoint_length, self.num_inputs:], dtype=np.float32)
+        else:
+            # gather only the projected columns, not whole rows of the (wider) store
+            X[:, :, 1:] = self.data[rows[..., None], self.input_columns]
+            y = np.ascontiguousarray(self.data[(starts + self.datapoint_length)[:, None], self.output_columns], dtype=np.float32)
+
+        X = torch.from_numpy(X)
+        if self.cubic_interp:
+            X = torchcde.hermite_cubic_coefficients_with_backward_differences(X)
+        return X, torch.from_numpy(y)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            X, y = self.batch([index])
+            return X[0], y[0]
+        # lists and slices return whole batches, like TensorDataset
+        return self.batch(index)
+
+    # used by DataLoader to fetch a batch of samples in one call
+    def __getitems__(self, indices: list[int]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        X, y = self.batch(indices)
+        return list(zip(X, y))
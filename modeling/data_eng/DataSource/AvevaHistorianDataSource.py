@@ -1,37 +1,115 @@
 from modeling.data_eng.DataSource.DataSource import DataSource
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import glob
 
 """
 This class reads a csv exported from Aveva Historian and does some transformations to make a dataset.
+csv_name may be a glob pattern matching several exports (e.g. monthly dumps), which
+are read by read_threads threads and concatenated in time order.
+
+Files are streamed in chunks of chunk_rows rows. Only the series columns are
+parsed, and rows are filtered chunk by chunk, so memory is bounded by the
+filtered data rather than the size of the exports. pyarrow's csv reader is used
+when it is installed.
 """
 class AvevaHistorianDataSource(DataSource):
-    def __init__(self, csv_name: str, series: list[str], min_frame_size: int, timestamp_series: str = "DateTime", gap_ms: int = 3000, freq_ms: int = 1000, persist: bool = False):
-        super().__init__(timestamp_series, min_frame_size, gap_ms=gap_ms, freq_ms=freq_ms, persist=persist)
+    # TODO: customize filtering and data cleaning
+    FILTER_COLUMN = 'Mixer100_Temperature_PV'
+    # defaults for definitions pickled before these settings existed
+    chunk_rows = 1_000_000
+    read_threads = 4
+
+    def __init__(self, csv_name: str, series: list[str], min_frame_size: int, timestamp_series: str = "DateTime", gap_ms: int = 3000, freq_ms: int = 1000, persist: bool = False, chunk_rows: int = 1_000_000, read_threads: int = 4, workers: int = 1):
+        super().__init__(timestamp_series, min_frame_size, gap_ms=gap_ms, freq_ms=freq_ms, persist=persist, workers=workers)
         self.csv_name = csv_name
         self.series = series
         self.series.append(timestamp_series)
-    
+        self.chunk_rows = chunk_rows
+        self.read_threads = read_threads
+
+    def files(self) -> list[str]:
+        files = sorted(glob.glob(self.csv_name)) if glob.has_magic(self.csv_name) else [self.csv_name]
+        assert len(files) > 0, f"No files match '{self.csv_name}'"
+        return files
+
+    def _columns(self) -> list[str]:
+        # series may repeat a column (e.g. one used as both input and output)
+        return list(dict.fromkeys(self.series + [AvevaHistorianDataSource.FILTER_COLUMN]))
+
     """
-    Read in a csv and filter out some rows.
+    Filter the rows of one chunk and keep the series columns.
     """
-    def loadData(self):
-        df = pd.read_csv(self.csv_name, low_memory=False)
-        print(f"Initial dataset size: {df.size} rows")
-
-        # TODO: customize filtering and data cleaning
+    def _filterChunk(self, df: pd.DataFrame, since: pd.Timestamp = None) -> pd.DataFrame:
         # TODO: Throw out all columns that are constant
-        df = df[df['Mixer100_Temperature_PV'] >= 120]
+        df = df[df[AvevaHistorianDataSource.FILTER_COLUMN] >= 120]
+        if since is not None:
+            df = df[df[self.time_col] >= since]
+        df = df[list(dict.fromkeys(self.series))]
+        # filter out null values at the beginning and end
+        return df.dropna()
 
-        # drop unnecessary columns
-        df.drop([column for column in df.columns if not column in self.series], axis='columns', inplace=True)
+    def _readFilePyArrow(self, path: str, since: pd.Timestamp = None) -> tuple[int, list[pd.DataFrame]]:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
 
-        # filter out null values at the beginning and end
-        df.dropna(inplace=True)
-        print(f"Filtering done. {df.size} rows remaining.")
+        columns = self._columns()
+        column_types = {column: pa.float64() for column in columns if column != self.time_col}
+        column_types[self.time_col] = pa.timestamp('ns')
+        reader = pacsv.open_csv(
+            path,
+            # roughly chunk_rows rows of a few dozen bytes per block
+            read_options=pacsv.ReadOptions(block_size=max(1 << 20, 64 * self.chunk_rows)),
+            convert_options=pacsv.ConvertOptions(include_columns=columns, column_types=column_types),
+        )
+        rows_read = 0
+        chunks = []
+        for batch in reader:
+            rows_read += batch.num_rows
+            chunks.append(self._filterChunk(batch.to_pandas(), since))
+        return rows_read, chunks
+
+    def _readFilePandas(self, path: str, since: pd.Timestamp = None) -> tuple[int, list[pd.DataFrame]]:
+        columns = self._columns()
+        reader = pd.read_csv(
+            path,
+            usecols=columns,
+            dtype={column: 'float64' for column in columns if column != self.time_col},
+            parse_dates=[self.time_col],
+            chunksize=self.chunk_rows,
+        )
+        rows_read = 0
+        chunks = []
+        with reader:
+            for chunk in reader:
+                rows_read += len(chunk)
+                chunks.append(self._filterChunk(chunk, since))
+        return rows_read, chunks
+
+    def _readFile(self, path: str, since: pd.Timestamp = None) -> tuple[int, list[pd.DataFrame]]:
+        try:
+            import pyarrow.csv
+        except ImportError:
+            return self._readFilePandas(path, since)
+        return self._readFilePyArrow(path, since)
 
-        df['DateTime'] = pd.to_datetime(df["DateTime"])
+    """
+    Read in the csv file(s) and filter out some rows. With since, rows before
+    that time are dropped while reading.
+    """
+    def loadData(self, since: pd.Timestamp = None):
+        files = self.files()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.read_threads, len(files)))) as executor:
+            results = list(executor.map(lambda path: self._readFile(path, since), files))
+
+        rows_read = sum(rows for rows, _ in results)
+        print(f"Initial dataset size: {rows_read} rows in {len(files)} file(s)")
+        df = pd.concat([chunk for _, chunks in results for chunk in chunks], ignore_index=True)
+        if len(files) > 1:
+            df = df.sort_values(self.time_col, kind='stable', ignore_index=True)
+        print(f"Filtering done. {len(df)} rows remaining.")
         return df
-    
+
     def export_keys(self) -> list[dict]:
         running = super().export_keys()
         running.append(
@@ -40,4 +118,4 @@ class AvevaHistorianDataSource(DataSource):
             "series": self.series,
           }
         )
-        return running
\ No newline at end of file
+        return running
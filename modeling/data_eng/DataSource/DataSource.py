@@ -1,6 +1,10 @@
 from util.Exportable import Exportable, ExportableType
+from util import columnar, parallel
+import numpy as np
 import pandas as pd
-import pickle
+import hashlib
+import shutil
+import json
 import os
 
 
@@ -10,10 +14,19 @@ It produces a set of dataframes, each dataframe having the following qualities:
     * The given self.time_col column is the DateTime index for frame.
     * Originally, there were no gaps longer than self.gap_ms milliseconds.
     * The frame is resampled to have self.freq_ms milliseconds between each datapoint.
+
+With workers > 1 the frames are resampled and normalized by a pool of that many
+processes. The result does not depend on it, so it is not part of the export.
 """
 class DataSource(Exportable):
     _path = 'modeling/datasources'
-    def __init__(self, time_col: str, min_frame_size: int, gap_ms: int = 3000, freq_ms: int = 1000, persist: bool = False):
+    # version of the way frames are cut from the data, bumped whenever the same
+    # configuration starts producing different frames. Caches of other versions are rebuilt.
+    _frames_version = 2
+    # default for sources pickled before parallel processing existed
+    workers = 1
+
+    def __init__(self, time_col: str, min_frame_size: int, gap_ms: int = 3000, freq_ms: int = 1000, persist: bool = False, workers: int = 1):
         assert gap_ms > 0, "The maximum gap between records must be positive"
         assert min_frame_size > 0, "The minimum frame size has to be > 0"
         self.time_col = time_col
@@ -21,6 +34,7 @@ class DataSource(Exportable):
         self.gap_ms = gap_ms
         self.freq_ms = freq_ms
         self.persist = persist
+        self.workers = workers
 
     
     def getExportType(self) -> ExportableType:
@@ -30,16 +44,23 @@ class DataSource(Exportable):
     This method should be overloaded to return a Pandas dataframe.
     NOTE: Do not actually set the column to be the index in the returned
     dataframe. That is done in the DataSource subclass.
+
+    If since is given, only rows at or after that time are needed. Subclasses
+    that can skip older rows cheaply should, it makes refresh() faster.
     """
-    def loadData(self) -> pd.DataFrame:
+    def loadData(self, since: pd.Timestamp = None) -> pd.DataFrame:
         raise Exception("Unimplemented")
     
     """
     Split the single dataframe returned by subclass of DataSource into 
     multiple dataframes so that there are no large gaps and each dataframe
-    is resampled to the desired frequency.
+    is resampled to the desired frequency. Frames with min_frame_size rows or
+    fewer are thrown away.
+
+    columns and frames optionally select the columns and the indices of the
+    frames to return. With persist=True only the selected parts of the cache are read.
     """
-    def loadDataFrames(self) -> list[pd.DataFrame]:
+    def loadDataFrames(self, columns: list[str] = None, frames: list[int] = None) -> list[pd.DataFrame]:
         id = self.exportableDescriptor()
         # save config to file if not already there.
         if not self.fileAlreadyExists():
@@ -47,58 +68,163 @@ class DataSource(Exportable):
 
         # if persistence is turned on, attempt to read file from disk
         if self.persist:
-            path = f"{DataSource._path}/{id}.source"
-            if os.path.exists(path):
-                with open(path, "rb") as openfile:
-                    dfs = pickle.load(openfile)
-                return dfs
+            directory = f"{DataSource._path}/{id}"
+            if self._cacheExists(directory):
+                return self._readCache(directory, columns, frames)
+            if columnar.exists(directory) or os.path.exists(f"{DataSource._path}/{id}.source"):
+                print(f"The cached frames of {id} were cut by an older version, rebuilding them.")
 
-        import util.progress as progress
         df = self.loadData()
-        df = df.assign(**{"time_diff": df[self.time_col].diff()})
-        df.fillna({"time_diff": pd.Timedelta(0, 'sec')}, inplace=True)
-
+        dfs, segment_starts = self._splitFrames(df)
         
-        time_slices = df[self.time_col][df["time_diff"] > pd.Timedelta(self.gap_ms, 'millisecond')]
-        df.drop('time_diff', axis='columns', inplace=True)
-        print(f"{time_slices.size} gaps detected. Splitting dataframes.")
+        if self.persist:
+            self._writeCache(f"{DataSource._path}/{id}", [], dfs, segment_starts, df)
+            # pickled frames of the format before the columnar cache
+            if os.path.exists(f"{DataSource._path}/{id}.source"):
+                os.remove(f"{DataSource._path}/{id}.source")
+
+        return DataSource._select(dfs, columns, frames)
+
+    """
+    Bring the persisted frames up to date with data appended to the source since
+    they were built. Only the rows from the start of the last segment on are
+    loaded and processed again: the last segment may continue in the new data,
+    all earlier ones are closed by a gap. Frames are stored under a hash of
+    their content, so unchanged frames are neither processed nor written again.
+    Returns the up to date frames.
+    """
+    def refresh(self) -> list[pd.DataFrame]:
+        assert self.persist, "Incremental refresh needs persist=True"
+        directory = f"{DataSource._path}/{self.exportableDescriptor()}"
+        if not self._cacheExists(directory):
+            return self.loadDataFrames()
+
+        manifest = columnar.read_manifest(directory)
+        open_start = pd.Timestamp(manifest["open_segment_start"])
+        df = self.loadData(since=open_start)
+        df = df[df[self.time_col] >= open_start]
+        if df.index.size == 0 or df[self.time_col].iloc[-1] <= pd.Timestamp(manifest["last_time"]):
+            print("No new data.")
+            return self._readCache(directory)
+
+        print(f"Processing data since {open_start}.")
+        dfs, segment_starts = self._splitFrames(df)
+        # frames of the reprocessed range replace the frame of the open segment
+        closed = [frame for frame in manifest["frames"] if pd.Timestamp(frame["segment_start"]) < open_start]
+        self._writeCache(directory, closed, dfs, segment_starts, df)
+        return self._readCache(directory)
+
+    """
+    Content hashes of the persisted frames, in order.
+    """
+    def frameHashes(self) -> list[str]:
+        return [frame["hash"] for frame in columnar.read_manifest(f"{DataSource._path}/{self.exportableDescriptor()}")["frames"]]
+
+    """
+    Split df at gaps, drop short segments, resample and normalize the rest.
+    Returns the frames and the (raw) start time of the segment of every frame.
+    """
+    def _splitFrames(self, df: pd.DataFrame) -> tuple[list[pd.DataFrame], list[pd.Timestamp]]:
+        # every gap starts a new segment, label all rows with their segment in one pass
+        gaps = df[self.time_col].diff() > pd.Timedelta(self.gap_ms, 'millisecond')
+        segments = gaps.cumsum()
+        print(f"{int(gaps.sum())} gaps detected. Splitting dataframes.")
+
+        sizes = segments.value_counts()
+        kept = sizes.index[sizes > self.min_frame_size]
+        keep = segments.isin(kept)
+        rows_kept = int(sizes[kept].sum())
+        print(f"Finished splitting data frames. {len(kept)} with {rows_kept} total rows. {sizes.size - len(kept)} dataframes - {int(sizes.sum()) - rows_kept} rows thrown away.")
+        segment_starts = df[self.time_col][keep.values & (segments.diff() != 0).values].tolist()
 
-        begin_idx = df.first_valid_index()
         dfs = []
-        rows_kept = 0
-        thrown_away = 0
-        rows_thrown_away = 0
-        for i in range(time_slices.size):
-            time = time_slices.iat[i]
-            next_idx = df[df[self.time_col] == time].idxmin()[self.time_col]
-            size = df[begin_idx:next_idx].size
-
-            if size > self.min_frame_size:
-                # print(f"Keeping records between {df[begin_idx][self.time_col]} - {df[next_idx][self.time_col]}")
-                dfs.append(df[begin_idx:next_idx])
-                rows_kept += dfs[-1].size
-            else:
-                # print(f"Tossing records between {df[begin_idx][self.time_col]} - {df[next_idx][self.time_col]}")
-                thrown_away += 1
-                rows_thrown_away += size
-            progress.bar(i+1, time_slices.size)
-            begin_idx = df[df[self.time_col] > time].idxmin()[self.time_col]
-
-        print(f"Finished splitting data frames. {len(dfs)} with {rows_kept} total rows. {thrown_away} dataframes - {rows_thrown_away} rows thrown away.")
-
-        print("Resampling for uniform time_steps")
-        for i in range(len(dfs)):
-            # now resample so that our time freq is always 1 second
-            dfs[i].set_index(self.time_col, inplace=True)
-            dfs[i] = dfs[i].resample(f"{self.freq_ms}ms").nearest()
-            dfs[i] = (dfs[i] - dfs[i].min()) / (dfs[i].max() - dfs[i].min())
-            progress.bar(i, len(dfs) - 1)
-        
-        if self.persist:
-            path = f"{DataSource._path}/{id}.source"
-            with open(path, "wb+") as outfile:
-                pickle.dump(dfs, outfile)
+        if len(kept) > 0 and self.workers > 1:
+            print(f"Resampling for uniform time_steps with {self.workers} workers")
+            df = df[keep.values]
+            # segments are contiguous, in ascending order
+            offsets = np.cumsum([0] + sizes[kept].sort_index().tolist())
+            timestamps = df[self.time_col].to_numpy()
+            columns = [column for column in df.columns if column != self.time_col]
+            values = df[columns].to_numpy(dtype=np.float64)
+            frame_arrays = [(timestamps[begin:end], values[begin:end]) for begin, end in zip(offsets[:-1], offsets[1:])]
+            for frame_timestamps, frame_values in parallel.map_frames(_resampleFrame, frame_arrays, self.workers, (self.freq_ms,)):
+                dfs.append(pd.DataFrame(frame_values, index=pd.DatetimeIndex(frame_timestamps, name=self.time_col), columns=columns))
+        elif len(kept) > 0:
+            print("Resampling for uniform time_steps")
+            df = df[keep.values].set_index(self.time_col)
+            resampled = df.groupby(segments[keep].values).resample(f"{self.freq_ms}ms").nearest()
+            by_segment = resampled.groupby(level=0)
+            minimum = by_segment.transform('min')
+            resampled = (resampled - minimum) / (by_segment.transform('max') - minimum)
+            dfs = [frame.droplevel(0) for _, frame in resampled.groupby(level=0, sort=True)]
+        return dfs, segment_starts
+
+    @staticmethod
+    def _select(dfs: list[pd.DataFrame], columns: list[str] = None, frames: list[int] = None) -> list[pd.DataFrame]:
+        if frames is not None:
+            dfs = [dfs[i] for i in frames]
+        if columns is not None:
+            dfs = [df[columns] for df in dfs]
+        return dfs
+
+    def _cacheExists(self, directory: str) -> bool:
+        # caches of frames cut differently, or written before frames were stored separately, are rebuilt
+        return columnar.exists(directory) and columnar.read_manifest(directory).get("frames_version") == DataSource._frames_version
+
+    """
+    Store every frame in its own columnar cache under frames/{content hash}, one
+    array per column plus one for the timestamps. The manifest lists the frames
+    in order, after the already stored closed frames, and remembers where the
+    last segment of the raw data df started for the next refresh().
+    """
+    def _writeCache(self, directory: str, closed: list[dict], dfs: list[pd.DataFrame], segment_starts: list[pd.Timestamp], df: pd.DataFrame):
+        if len(dfs) > 0:
+            columns = list(dfs[0].columns)
+        elif len(closed) > 0:
+            columns = columnar.read_manifest(directory)["columns"]
+        else:
+            columns = []
+        frames = list(closed)
+        for frame, segment_start in zip(dfs, segment_starts):
+            arrays = {"index": frame.index.to_numpy()}
+            for i, column in enumerate(columns):
+                arrays[f"column{i}"] = frame[column].to_numpy(dtype=np.float64)
+            frame_hash = hash_frame(frame)
+            if not columnar.exists(f"{directory}/frames/{frame_hash}"):
+                columnar.write(f"{directory}/frames/{frame_hash}", arrays, {})
+            frames.append({"hash": frame_hash, "rows": frame.index.size, "segment_start": str(segment_start)})
 
+        gaps = (df[self.time_col].diff() > pd.Timedelta(self.gap_ms, 'millisecond')).to_numpy()
+        last_segment = np.flatnonzero(gaps)
+        open_start = df[self.time_col].iloc[last_segment[-1] if len(last_segment) > 0 else 0]
+        columnar.write(directory, {}, {
+            "frames_version": DataSource._frames_version,
+            "index_name": self.time_col,
+            "columns": columns,
+            "frames": frames,
+            "open_segment_start": str(open_start),
+            "last_time": str(df[self.time_col].iloc[-1]),
+        })
+        # drop frames replaced by a refresh
+        hashes = {frame["hash"] for frame in frames}
+        for frame_hash in os.listdir(f"{directory}/frames") if os.path.exists(f"{directory}/frames") else []:
+            if not frame_hash in hashes:
+                shutil.rmtree(f"{directory}/frames/{frame_hash}")
+
+    def _readCache(self, directory: str, columns: list[str] = None, frames: list[int] = None) -> list[pd.DataFrame]:
+        manifest = columnar.read_manifest(directory)
+        if columns is None:
+            columns = manifest["columns"]
+        if frames is None:
+            frames = range(len(manifest["frames"]))
+
+        dfs = []
+        for i in frames:
+            frame_directory = f"{directory}/frames/{manifest['frames'][i]['hash']}"
+            dfs.append(pd.DataFrame(
+                {column: columnar.read(frame_directory, f"column{manifest['columns'].index(column)}") for column in columns},
+                index=pd.DatetimeIndex(columnar.read(frame_directory, "index"), name=manifest["index_name"]),
+            ))
         return dfs
     
     def export_keys(self) -> list[dict]:
@@ -114,6 +240,25 @@ class DataSource(Exportable):
         return running
     
 
+"""
+Content hash of a resampled frame: its columns, timestamps and values.
+"""
+def hash_frame(frame: pd.DataFrame) -> str:
+    content = hashlib.sha1(json.dumps(list(frame.columns)).encode())
+    content.update(np.ascontiguousarray(frame.index.to_numpy()).tobytes())
+    for column in frame.columns:
+        content.update(np.ascontiguousarray(frame[column].to_numpy(dtype=np.float64)).tobytes())
+    return content.hexdigest()
+
+"""
+Resample one frame to freq_ms and min-max normalize it. Runs in the worker
+processes of DataSource.loadDataFrames.
+"""
+def _resampleFrame(timestamps: np.ndarray, values: np.ndarray, freq_ms: int) -> tuple[np.ndarray, np.ndarray]:
+    df = pd.DataFrame(values, index=pd.DatetimeIndex(timestamps)).resample(f"{freq_ms}ms").nearest()
+    df = (df - df.min()) / (df.max() - df.min())
+    return df.index.to_numpy(), df.to_numpy()
+
 if True:
     from pathlib import Path
     Path(DataSource._path).mkdir(parents=True, exist_ok=True)
\ No newline at end of file
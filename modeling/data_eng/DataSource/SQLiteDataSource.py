@@ -0,0 +1,137 @@
+from modeling.data_eng.DataSource.DataSource import DataSource
+from contextlib import closing
+import pandas as pd
+import argparse
+import sqlite3
+import glob
+
+"""
+A DataSource backed by a local SQLite store of historian samples, standing in
+for the historian's SQL interface. Samples are stored in a narrow tag/value
+schema clustered by (tag, time), so reading a few tags over a time range only
+touches those rows:
+
+    tags(id, name)
+    samples(tag_id, ts, value)    ts in nanoseconds since the epoch
+
+loadData pushes the tags, the [start, end] time range and the filters down into
+one indexed query. filters is a list of (tag, operator, value) conditions a
+timestamp has to satisfy to be kept, e.g. [("Mixer100_Temperature_PV", ">=", 120)].
+
+Use load_historian_csv (or `python -m modeling.data_eng.DataSource.SQLiteDataSource load`)
+to fill a store from historian CSV exports.
+"""
+class SQLiteDataSource(DataSource):
+    OPERATORS = ["<", "<=", "=", "!=", ">=", ">"]
+
+    def __init__(self, db_path: str, tags: list[str], min_frame_size: int, start: str = None, end: str = None, filters: list[tuple[str, str, float]] = None, timestamp_series: str = "DateTime", gap_ms: int = 3000, freq_ms: int = 1000, persist: bool = False, workers: int = 1):
+        super().__init__(timestamp_series, min_frame_size, gap_ms=gap_ms, freq_ms=freq_ms, persist=persist, workers=workers)
+        filters = [] if filters is None else filters
+        for tag, operator, value in filters:
+            assert operator in SQLiteDataSource.OPERATORS, f"Unsupported filter operator '{operator}'"
+        self.db_path = db_path
+        self.tags = tags
+        self.start = start
+        self.end = end
+        self.filters = [list(condition) for condition in filters]
+
+    """
+    Build the query for the samples of the given tags. Every filter joins the
+    samples of its tag at the same timestamp, which is a primary key lookup.
+    """
+    def _query(self, since: pd.Timestamp = None) -> tuple[str, list]:
+        params = list(self.tags)
+        joins = []
+        for i, (tag, operator, value) in enumerate(self.filters):
+            joins.append(f"JOIN samples f{i} ON f{i}.ts = s.ts AND f{i}.tag_id = (SELECT id FROM tags WHERE name = ?) AND f{i}.value {operator} ?")
+        params = [param for tag, _, value in self.filters for param in (tag, value)] + params
+        where = [f"t.name IN ({', '.join('?' for _ in self.tags)})"]
+
+        start = None if self.start is None else pd.Timestamp(self.start)
+        if since is not None and (start is None or since > start):
+            start = since
+        if start is not None:
+            where.append("s.ts >= ?")
+            params.append(start.value)
+        if self.end is not None:
+            where.append("s.ts <= ?")
+            params.append(pd.Timestamp(self.end).value)
+
+        query = f"SELECT t.name AS tag, s.ts AS ts, s.value AS value FROM samples s JOIN tags t ON t.id = s.tag_id {' '.join(joins)} WHERE {' AND '.join(where)}"
+        return query, params
+
+    def loadData(self, since: pd.Timestamp = None) -> pd.DataFrame:
+        query, params = self._query(since)
+        # the connection's own context manager only ends the transaction, it doesn't close it
+        with closing(sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)) as conn:
+            samples = pd.read_sql_query(query, conn, params=params)
+        print(f"Read {len(samples)} samples of {len(self.tags)} tags")
+
+        df = samples.pivot(index='ts', columns='tag', values='value').reindex(columns=self.tags)
+        # every tag needs a value at a kept timestamp
+        df = df.dropna()
+        df.index = pd.to_datetime(df.index, unit='ns')
+        df = df.rename_axis(self.time_col).reset_index().rename_axis(None, axis='columns')
+        print(f"Filtering done. {len(df)} rows remaining.")
+        return df
+
+    def export_keys(self) -> list[dict]:
+        running = super().export_keys()
+        running.append(
+          {
+            "db_path": self.db_path,
+            "tags": self.tags,
+            "start": self.start,
+            "end": self.end,
+            "filters": self.filters,
+          }
+        )
+        return running
+
+def create_schema(conn: sqlite3.Connection):
+    conn.execute("CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS samples (tag_id INTEGER NOT NULL, ts INTEGER NOT NULL, value REAL, PRIMARY KEY (tag_id, ts)) WITHOUT ROWID")
+
+"""
+Load historian CSV exports (a file name or a glob) into the SQLite store at
+db_path, creating it if needed. Every numeric column becomes a tag. Samples
+already in the store for the same tag and time are replaced.
+"""
+def load_historian_csv(db_path: str, csv_name: str, timestamp_series: str = "DateTime", chunk_rows: int = 1_000_000):
+    files = sorted(glob.glob(csv_name)) if glob.has_magic(csv_name) else [csv_name]
+    assert len(files) > 0, f"No files match '{csv_name}'"
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        # a failed load is simply rerun, no need to sync every page
+        conn.execute("PRAGMA synchronous=OFF")
+        create_schema(conn)
+        tag_ids = {name: id for id, name in conn.execute("SELECT id, name FROM tags")}
+        loaded = 0
+        for path in files:
+            for chunk in pd.read_csv(path, parse_dates=[timestamp_series], chunksize=chunk_rows, low_memory=False):
+                timestamps = chunk[timestamp_series].astype('datetime64[ns]').astype('int64')
+                for column in chunk.columns:
+                    if column == timestamp_series:
+                        continue
+                    values = pd.to_numeric(chunk[column], errors='coerce')
+                    if values.isna().all():
+                        continue
+                    if not column in tag_ids:
+                        tag_ids[column] = conn.execute("INSERT INTO tags (name) VALUES (?)", (column,)).lastrowid
+                    valid = values.notna()
+                    rows = zip([tag_ids[column]] * int(valid.sum()), timestamps[valid].tolist(), values[valid].tolist())
+                    conn.executemany("INSERT OR REPLACE INTO samples (tag_id, ts, value) VALUES (?, ?, ?)", rows)
+                    loaded += int(valid.sum())
+                # one transaction per chunk
+                conn.commit()
+            print(f"Loaded {path}: {loaded} samples so far")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the SQLite historian store.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    load = subparsers.add_parser("load", help="Load historian CSV exports into the store.")
+    load.add_argument("db_path")
+    load.add_argument("csv_name", help="CSV file name or glob")
+    load.add_argument("--timestamp-series", default="DateTime")
+    args = parser.parse_args()
+    load_historian_csv(args.db_path, args.csv_name, args.timestamp_series)
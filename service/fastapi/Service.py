@@ -79,6 +79,10 @@ async def add_endpoints(app: FastAPI):
 
 class Settings(BaseSettings):
     SIM_ID: str
+    # number of processes to partition the simulation across
+    SIM_WORKERS: int = 1
+    # comma separated host:port list of distributed workers, overrides SIM_WORKERS
+    SIM_WORKER_HOSTS: str = ""
 settings = Settings()
 
 @asynccontextmanager
@@ -86,7 +90,8 @@ async def lifespan(app: FastAPI):
     from simulating.SimServer import SimulatorServer
     global simServer
     global settings
-    simServer = SimulatorServer(settings.SIM_ID)
+    worker_hosts = [host.strip() for host in settings.SIM_WORKER_HOSTS.split(',') if host.strip()]
+    simServer = SimulatorServer(settings.SIM_ID, settings.SIM_WORKERS, worker_hosts)
     await add_endpoints(app)
     yield
     simServer.stop()
@@ -101,12 +106,13 @@ async def exception_handler(request: Request, exc: Exception):
     )
 
 @app.get("/get/{query}")
-async def get(query: Annotated[str, "Comma separated list of absolute reference names to return."]):
+async def get(query: Annotated[str, "Comma separated list of absolute reference names to return."],
+              since_step: Annotated[int | None, Query(description="Only return references modified after this step, along with the current step.")] = None):
     if query.strip() == "":
         return {}
     
     names = query.split(',')
-    return await simServer.getReferences(names)
+    return await simServer.getReferences(names, since_step)
 
 @app.get("/set/{query}")
 async def set(query: Annotated[str, "'&' separated list of assignments in form absolute_ref_name=value."]):
@@ -0,0 +1,20 @@
+from simulating.SimObject import Reference
+
+class Controller:
+    def __init__(self):
+        raise Exception("Abstract base should not be initialized")
+
+    """
+    Runs inside the simulation process at the start of each tick, before any
+    object steps. Controllers read and write the references they resolved
+    directly, so sequence/recipe logic costs no round trips to the server.
+    Writes are seen by the objects in the same tick.
+    """
+    def step(self):
+        raise Exception("Unimplemented")
+
+    """
+    Override this method to connect named references defined in the controller's definition.
+    """
+    def resolveReferences(self, refs: dict[str, Reference]):
+        pass
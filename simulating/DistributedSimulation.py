@@ -0,0 +1,351 @@
+from simulating.definition.SimulationDefiniton import SimulationDefn
+from simulating.Partitioning import partition_simulation
+from simulating.PartitionedSimulation import PartitionCommand, PartitionedSimulator, SimulationPartition, boundary_plan
+from simulating.Simulation import SimulationError, ErrorType
+from multiprocessing import Process
+from enum import IntEnum
+from time import monotonic
+import traceback
+import argparse
+import socket
+import struct
+import json
+
+"""
+Distributed simulation across hosts. Worker hosts run distributed_worker, which
+listens for a coordinator on a TCP port. The coordinator (DistributedSimulator,
+running in the SimulatorServer process) partitions the simulation, assigns one
+partition to each worker, drives a lock-step tick barrier and exchanges the
+boundary references between partitions. The service only talks to the
+coordinator.
+
+Every worker host needs the simulation definition and the model files the
+simulation uses in its working directory.
+
+Protocol: every message is a 5 byte header (message type, payload length)
+followed by the payload. The per-tick messages carry packed doubles in the
+order of the partition's sorted boundary reference lists. Setup and client
+requests, which are rare, carry JSON.
+"""
+
+HEADER = struct.Struct("!BI")
+TICK = struct.Struct("!I")
+
+class Message(IntEnum):
+    ASSIGN = 1          # coordinator -> worker: JSON partition assignment
+    READY = 2           # worker -> coordinator: JSON reference names and export ranges
+    IMPORT_RANGES = 3   # coordinator -> worker: JSON ranges of the imported references
+    STEP = 4            # coordinator -> worker: tick + packed import values
+    STEPPED = 5         # worker -> coordinator: step + packed export values
+    REQUEST = 6         # coordinator -> worker: command byte + JSON arguments
+    RESPONSE = 7        # worker -> coordinator: JSON result
+    HEARTBEAT = 8
+    HEARTBEAT_ACK = 9
+    STOP = 10
+    ERROR = 11          # worker -> coordinator: utf8 error description
+
+class WorkerFailure(Exception):
+    pass
+
+def send_message(sock: socket.socket, message: Message, payload: bytes = b""):
+    sock.sendall(HEADER.pack(message, len(payload)) + payload)
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError("Connection closed by peer")
+        data += chunk
+    return bytes(data)
+
+def recv_message(sock: socket.socket) -> tuple[Message, bytes]:
+    message, size = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return Message(message), _recv_exact(sock, size)
+
+def pack_values(tick: int, values: list[float]) -> bytes:
+    return TICK.pack(tick) + struct.pack(f"!{len(values)}d", *values)
+
+def unpack_values(payload: bytes) -> tuple[int, list[float]]:
+    (tick,) = TICK.unpack_from(payload)
+    count = (len(payload) - TICK.size) // 8
+    return tick, list(struct.unpack_from(f"!{count}d", payload, TICK.size))
+
+def encode_result(result) -> bytes:
+    if isinstance(result, SimulationError):
+        result = {"__error__": [result.error_type.value, result.msg]}
+    return json.dumps(result).encode()
+
+def decode_result(payload: bytes):
+    result = json.loads(payload)
+    if isinstance(result, dict) and "__error__" in result:
+        error_type, msg = result["__error__"]
+        return SimulationError(ErrorType(error_type), msg)
+    return result
+
+"""
+Serve a single coordinator on an accepted connection. Returns when the
+coordinator stops the simulation. Raises if the coordinator goes quiet for
+longer than idle_timeout or the connection drops.
+
+While the coordinator waits for the other partitions (for them to load during
+setup, or to finish a tick or request at the barrier) it cannot heartbeat, so
+the coordinator's own setup and step timeouts, sent with the assignment, are
+added to idle_timeout for those waits.
+"""
+def serve_coordinator(conn: socket.socket, idle_timeout: float):
+    conn.settimeout(idle_timeout)
+    message, payload = recv_message(conn)
+    assert message == Message.ASSIGN, f"Expected a partition assignment, got {message}"
+    assignment = json.loads(payload)
+    setup_timeout = assignment.get("setup_timeout", 0.0)
+    step_timeout = assignment.get("step_timeout", 0.0)
+    try:
+        part = SimulationPartition(SimulationDefn.load(assignment["sim_id"]), assignment["objects"], assignment["controllers"], assignment["imports"], assignment["exports"])
+    except Exception:
+        send_message(conn, Message.ERROR, traceback.format_exc().encode())
+        return
+    send_message(conn, Message.READY, json.dumps({"refs": list(part.sim.references.keys()), "export_ranges": part.exportRanges()}).encode())
+    # the other partitions may still be loading
+    conn.settimeout(setup_timeout + idle_timeout)
+
+    while True:
+        message, payload = recv_message(conn)
+        conn.settimeout(idle_timeout)
+        try:
+            match (message):
+                case Message.IMPORT_RANGES:
+                    part.setImportRanges(json.loads(payload))
+                case Message.STEP:
+                    _, import_values = unpack_values(payload)
+                    export_values = part.step(import_values)
+                    send_message(conn, Message.STEPPED, pack_values(part.sim.current_step, export_values))
+                    # the other partitions may still be stepping
+                    conn.settimeout(step_timeout + idle_timeout)
+                case Message.REQUEST:
+                    command = PartitionCommand(payload[0])
+                    result = part.handle(command, json.loads(payload[1:]))
+                    response = {"result": json.loads(encode_result(result))}
+                    if command in (PartitionCommand.SET, PartitionCommand.MULTISET):
+                        # the coordinator forwards writes to boundary references on the next tick
+                        response["exports"] = part.exportValues()
+                    send_message(conn, Message.RESPONSE, json.dumps(response).encode())
+                    conn.settimeout(step_timeout + idle_timeout)
+                case Message.HEARTBEAT:
+                    send_message(conn, Message.HEARTBEAT_ACK)
+                case Message.STOP:
+                    return
+                case _:
+                    raise Exception(f"Unexpected message {message}")
+        except Exception:
+            send_message(conn, Message.ERROR, traceback.format_exc().encode())
+
+"""
+Worker mode: listen for coordinators and run the partition each one assigns.
+If the coordinator goes quiet for longer than idle_timeout (it sends heartbeats
+while the simulation is idle), the partition is dropped and the worker waits for
+a new coordinator. With once=True the worker exits after one coordinator.
+"""
+def distributed_worker(host: str, port: int, idle_timeout: float = 10.0, once: bool = False):
+    with socket.create_server((host, port)) as server:
+        while True:
+            conn, address = server.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                serve_coordinator(conn, idle_timeout)
+            except (ConnectionError, socket.timeout) as e:
+                print(f"Lost coordinator {address}: {e}")
+            finally:
+                conn.close()
+            if once:
+                return
+
+"""
+Start n workers on localhost, for testing distributed simulations on one machine.
+Returns the processes and the addresses to pass to DistributedSimulator.
+"""
+def spawn_local_workers(n: int, base_port: int = 7700, idle_timeout: float = 10.0) -> tuple[list[Process], list[str]]:
+    processes = []
+    addresses = []
+    for i in range(n):
+        process = Process(target=distributed_worker, args=("127.0.0.1", base_port + i, idle_timeout, True))
+        process.start()
+        processes.append(process)
+        addresses.append(f"127.0.0.1:{base_port + i}")
+    return processes, addresses
+
+"""
+Coordinator of a simulation distributed over worker hosts. Behaves like a
+Simulator towards the server. Boundary references travel with the tick
+messages: the coordinator keeps the latest exported value of each one and
+sends every worker the values it imports with the next STEP.
+
+A worker that misses a response deadline or drops its connection raises
+WorkerFailure. Call heartbeat() while the simulation is idle so workers don't
+give up on the coordinator.
+"""
+class DistributedSimulator(PartitionedSimulator):
+    def __init__(self, sim_id: str, worker_addresses: list[str], heartbeat_interval: float = 2.0, heartbeat_timeout: float = 5.0,
+                 step_timeout: float = 60.0, setup_timeout: float = 600.0, connect_timeout: float = 10.0):
+        defn = SimulationDefn.load(sim_id)
+        self.object_order = list(defn.objects.keys())
+        self.partitions = partition_simulation(defn, len(worker_addresses))
+        self.imports, self.exports = boundary_plan(defn, self.partitions)
+        self.addresses = worker_addresses[:len(self.partitions)]
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.step_timeout = step_timeout
+        self.current_step = 0
+        self.simulation_started = False
+        self.socks = []
+        self.last_contact = []
+
+        try:
+            for i, address in enumerate(self.addresses):
+                host, port = address.rsplit(':', 1)
+                try:
+                    sock = socket.create_connection((host, int(port)), timeout=connect_timeout)
+                except OSError as e:
+                    raise WorkerFailure(f"Could not connect to worker {address}: {e}")
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.socks.append(sock)
+                self.last_contact.append(monotonic())
+                send_message(sock, Message.ASSIGN, json.dumps({
+                    "sim_id": sim_id,
+                    "objects": self.partitions[i]["objects"],
+                    "controllers": self.partitions[i]["controllers"],
+                    "imports": self.imports[i],
+                    "exports": self.exports[i],
+                    "setup_timeout": setup_timeout,
+                    "step_timeout": step_timeout,
+                }).encode())
+
+            self.owners = {}
+            self.values = {}
+            ranges = {}
+            # the partitions load in parallel, so setup_timeout bounds the whole setup
+            deadline = monotonic() + setup_timeout
+            for i in range(len(self.socks)):
+                ready = json.loads(self._expect(i, Message.READY, self._remaining(deadline)))
+                for name in ready["refs"]:
+                    self.owners[name] = i
+                ranges.update(zip(self.exports[i], ready["export_ranges"]))
+            for name, (value, _, _) in ranges.items():
+                self.values[name] = value
+            for i, sock in enumerate(self.socks):
+                send_message(sock, Message.IMPORT_RANGES, json.dumps([ranges[name] for name in self.imports[i]]).encode())
+        except Exception:
+            self._close()
+            raise
+
+    def _close(self):
+        for sock in self.socks:
+            sock.close()
+        self.socks = []
+
+    """
+    Receive the next message from a worker, failing if it is not of the expected type.
+    """
+    def _expect(self, partition: int, expected: Message, timeout: float) -> bytes:
+        sock = self.socks[partition]
+        try:
+            sock.settimeout(timeout)
+            message, payload = recv_message(sock)
+        except (ConnectionError, socket.timeout, OSError) as e:
+            raise WorkerFailure(f"Worker {self.addresses[partition]} failed: {e}")
+        self.last_contact[partition] = monotonic()
+        if message == Message.ERROR:
+            raise WorkerFailure(f"Worker {self.addresses[partition]} failed:\n{payload.decode()}")
+        if message != expected:
+            raise WorkerFailure(f"Worker {self.addresses[partition]} sent {message}, expected {expected}")
+        return payload
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        # a small positive timeout still reads a message that has already arrived
+        return max(deadline - monotonic(), 0.001)
+
+    def _send(self, partition: int, message: Message, payload: bytes = b""):
+        try:
+            send_message(self.socks[partition], message, payload)
+        except OSError as e:
+            raise WorkerFailure(f"Worker {self.addresses[partition]} failed: {e}")
+
+    def _request(self, partition: int, command: PartitionCommand, args):
+        self._send(partition, Message.REQUEST, bytes([command.value]) + json.dumps(args).encode())
+        response = json.loads(self._expect(partition, Message.RESPONSE, self.step_timeout))
+        if "exports" in response:
+            self.values.update(zip(self.exports[partition], response["exports"]))
+        result = decode_result(json.dumps(response["result"]).encode())
+        if command == PartitionCommand.MULTISET:
+            result = [tuple(failure) for failure in result]
+        return result
+
+    def _broadcast(self, command: PartitionCommand, args) -> list:
+        payload = bytes([command.value]) + json.dumps(args).encode()
+        for i in range(len(self.socks)):
+            self._send(i, Message.REQUEST, payload)
+        deadline = monotonic() + self.step_timeout
+        return [decode_result(json.dumps(json.loads(self._expect(i, Message.RESPONSE, self._remaining(deadline)))["result"]).encode()) for i in range(len(self.socks))]
+
+    def step(self):
+        self.simulation_started = True
+        tick = self.current_step + 1
+        for i in range(len(self.socks)):
+            self._send(i, Message.STEP, pack_values(tick, [self.values[name] for name in self.imports[i]]))
+        # barrier: every partition has to finish the tick before the next one starts
+        deadline = monotonic() + self.step_timeout
+        for i in range(len(self.socks)):
+            step, export_values = unpack_values(self._expect(i, Message.STEPPED, self._remaining(deadline)))
+            if step != tick:
+                raise WorkerFailure(f"Worker {self.addresses[i]} is at step {step}, expected {tick}")
+            self.values.update(zip(self.exports[i], export_values))
+        self.current_step = tick
+
+    def heartbeat(self):
+        now = monotonic()
+        for i in range(len(self.socks)):
+            if now - self.last_contact[i] >= self.heartbeat_interval:
+                self._send(i, Message.HEARTBEAT)
+                self._expect(i, Message.HEARTBEAT_ACK, self.heartbeat_timeout)
+
+    def stop(self):
+        for i in range(len(self.socks)):
+            try:
+                send_message(self.socks[i], Message.STOP)
+            except OSError:
+                pass
+        self._close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed simulation worker.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    worker = subparsers.add_parser("worker", help="Run a worker that serves partitions to a coordinator.")
+    worker.add_argument("--host", default="0.0.0.0")
+    worker.add_argument("--port", type=int, default=7700)
+    worker.add_argument("--idle-timeout", type=float, default=10.0)
+    local = subparsers.add_parser("local", help="Run a simulation on workers spawned on localhost.")
+    local.add_argument("sim_id")
+    local.add_argument("--workers", type=int, default=2)
+    local.add_argument("--base-port", type=int, default=7700)
+    local.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.mode == "worker":
+        distributed_worker(args.host, args.port, args.idle_timeout)
+    else:
+        processes, addresses = spawn_local_workers(args.workers, args.base_port)
+        sim = None
+        try:
+            sim = DistributedSimulator(args.sim_id, addresses, connect_timeout=30.0)
+            for step in range(args.steps):
+                start = monotonic()
+                sim.step()
+                print(f"step {sim.current_step} took {monotonic() - start:.4f} seconds")
+        finally:
+            if sim is not None:
+                sim.stop()
+            for process in processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+"""
+Memoizes model outputs by the ModeledObject input window that produced them.
+Windows are keyed by their normalized input values quantized to multiples of
+tolerance, so windows that differ by less than the tolerance share an entry
+and steady states reuse the last output instead of running the network.
+The least recently used entry is evicted once the cache holds max_size entries.
+"""
+class InferenceCache:
+    def __init__(self, max_size: int = 1024, tolerance: float = 1e-3):
+        assert max_size > 0, "The cache must be able to hold at least one entry"
+        assert tolerance > 0, "The quantization tolerance must be positive"
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Quantize a window of rows [t, input0, input1, ...]. The time column is the
+    same for every window, so it is left out of the key.
+    """
+    def key(self, window: list[list[float]]) -> tuple:
+        return tuple(round(value / self.tolerance) for row in window for value in row[1:])
+
+    def get(self, key: tuple):
+        output = self.entries.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key: tuple, output):
+        self.entries[key] = output
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
@@ -1,14 +1,26 @@
 from simulating.SimObject import SimObject, Reference
+from simulating.InferenceCache import InferenceCache
+from util import precision as precisions
 import torch
 import torchcde
 import numpy as np
 
 class ModeledObject(SimObject):
-    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, input_references: list[Reference]):
+    # default for objects pickled before reduced precision inference existed
+    precision = "float32"
+
+    """
+    If a cache is given, model outputs are memoized by the (quantized) input window.
+    precision is the precision inference runs in, see util/precision.py.
+    """
+    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, input_references: list[Reference], cache: InferenceCache = None, precision: str = "float32"):
+        precisions.check(precision)
         self.model = model
+        self.precision = precision
         self.datapoint_length = datapoint_length
         self.cubic = cubic
         self.input_references = input_references
+        self.cache = cache
 
         self.state_data = {"t": [i / float(datapoint_length) for i in range(datapoint_length)]}
         self.initial_state_set = False
@@ -29,7 +41,14 @@ class ModeledObject(SimObject):
 
     def step(self):
         assert self.initial_state_set
+        self._shiftWindow()
+        self.output = self._infer()
 
+    """
+    Drop the oldest frame of the input window and append the current values of
+    the input references.
+    """
+    def _shiftWindow(self):
         # drop oldest frame
         self.state_data = self.state_data[1:]
 
@@ -41,11 +60,23 @@ class ModeledObject(SimObject):
         # insert newest frame
         self.state_data.append([float(self.datapoint_length - 1) / (self.datapoint_length)] + [ref.get_normalized() for ref in self.input_references])
 
-        X = torch.from_numpy(np.array([self.state_data]))
-        X = torch.tensor(X.clone().detach().requires_grad_(True), dtype=torch.float)
-        if self.cubic:
-            X = torchcde.hermite_cubic_coefficients_with_backward_differences(X)
-        pred_y = self.model(X).squeeze(-1)
+    """
+    Run the model on the current input window.
+    """
+    def _infer(self):
+        if self.cache is not None:
+            key = self.cache.key(self.state_data)
+            output = self.cache.get(key)
+            if output is not None:
+                return output
 
-        self.output = pred_y
+        X = torch.from_numpy(np.array([self.state_data], dtype=np.float32))
+        # no autograd bookkeeping, the outputs are only read
+        with torch.inference_mode(), precisions.autocast(self.precision):
+            if self.cubic:
+                X = torchcde.hermite_cubic_coefficients_with_backward_differences(X)
+            pred_y = self.model(X).squeeze(-1).float()
 
+        if self.cache is not None:
+            self.cache.put(key, pred_y)
+        return pred_y
@@ -0,0 +1,303 @@
+from multiprocessing import shared_memory
+from simulating.definition.SimulationDefiniton import SimulationDefn
+from simulating.Partitioning import partition_simulation, reference_owner
+from simulating.Simulation import SimulationError, ErrorType
+from simulating.SimObject import Reference
+from enum import Enum
+import multiprocessing
+
+class PartitionCommand(Enum):
+    STOP = 0
+    STEP = 1
+    GET_API = 2
+    GET = 3
+    SET = 4
+    MULTIGET = 5
+    MULTISET = 6
+
+"""
+Returns, for each partition, the boundary references it imports (read by its
+objects through ref_map, owned by another partition) and exports (owned by it,
+read by another partition). Each list is sorted so both sides agree on the order.
+"""
+def boundary_plan(defn: SimulationDefn, partitions: list[dict[str, list[str]]]) -> tuple[list[list[str]], list[list[str]]]:
+    partition_of = {name: i for i, partition in enumerate(partitions) for name in partition["objects"]}
+    imports = [set() for _ in partitions]
+    exports = [set() for _ in partitions]
+    for name, obj_defn in defn.objects.items():
+        if not name in partition_of:
+            continue
+        for ref_name in obj_defn.ref_map.values():
+            owner = reference_owner(ref_name, defn.objects.keys())
+            if owner is None or partition_of[owner] == partition_of[name]:
+                continue
+            imports[partition_of[name]].add(ref_name)
+            exports[partition_of[owner]].add(ref_name)
+    return [sorted(refs) for refs in imports], [sorted(refs) for refs in exports]
+
+"""
+The part of a simulation owned by one worker. Boundary references read from
+other partitions are proxies, updated with the owners' values at the start of
+every tick. Exported references are read after the tick and sent to the
+partitions that import them.
+"""
+class SimulationPartition:
+    def __init__(self, defn: SimulationDefn, objects: list[str], controllers: list[str], imports: list[str], exports: list[str]):
+        # the owner sends the real range of each proxy once the simulation is set up
+        self.proxies = {name: Reference(0, 0, 1) for name in imports}
+        self.sim = defn.createSimulation(objects, controllers, self.proxies)
+        self.imports = [self.proxies[name] for name in imports]
+        for name in exports:
+            assert name in self.sim.references, f"Exported boundary reference '{name}' does not exist."
+        self.exports = [self.sim.references[name] for name in exports]
+
+    def exportRanges(self) -> list[tuple[float, float, float]]:
+        return [(float(ref.get()), ref.min, ref.max) for ref in self.exports]
+
+    def setImportRanges(self, ranges: list[tuple[float, float, float]]):
+        for proxy, (value, minimum, maximum) in zip(self.imports, ranges):
+            proxy._value = value
+            proxy.min = minimum
+            proxy.max = maximum
+
+    def exportValues(self) -> list[float]:
+        return [float(ref.get()) for ref in self.exports]
+
+    def step(self, import_values: list[float]) -> list[float]:
+        for proxy, value in zip(self.imports, import_values):
+            proxy.update(value)
+        self.sim.step()
+        return self.exportValues()
+
+    """
+    Handle a client request routed to this partition.
+    """
+    def handle(self, command: PartitionCommand, args):
+        match (command):
+            case PartitionCommand.GET_API:
+                return self.sim.getAPI()
+            case PartitionCommand.GET:
+                return self.sim.getReferenceValue(args)
+            case PartitionCommand.SET:
+                ref_name, value = args
+                return self.sim.setReferenceValue(ref_name, value)
+            case PartitionCommand.MULTIGET:
+                names, since_step = args
+                return self.sim.getReferences(names, since_step)
+            case PartitionCommand.MULTISET:
+                failures = []
+                for key, value in args.items():
+                    ret = self.sim.setReferenceValue(key, value)
+                    if isinstance(ret, SimulationError):
+                        failures.append((key, str(ret.error_type)))
+                return failures
+        raise Exception(f"Unsupported partition command {command}")
+
+"""
+Worker process of a PartitionedSimulator. Boundary values are exchanged through
+a shared memory array of doubles with two halves: at tick t every worker reads
+its imports from half (t-1) % 2 and writes its exports to half t % 2, so no
+worker overwrites values another one is still reading.
+"""
+def partition_worker(sim_id: str, partition: dict[str, list[str]], imports: list[str], exports: list[str], import_slots: list[int], export_slots: list[int], shm_name: str, conn):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    values = shm.buf.cast('d')
+    slots = len(values) // 2
+
+    def write_exports(half: int, export_values: list[float]):
+        for slot, value in zip(export_slots, export_values):
+            values[half * slots + slot] = value
+
+    try:
+        try:
+            part = SimulationPartition(SimulationDefn.load(sim_id), partition["objects"], partition["controllers"], imports, exports)
+        except Exception as e:
+            conn.send(e)
+            return
+        conn.send((list(part.sim.references.keys()), part.exportRanges()))
+        part.setImportRanges(conn.recv())
+        write_exports(0, part.exportValues())
+        write_exports(1, part.exportValues())
+        conn.send(True)
+
+        while True:
+            command, args = conn.recv()
+            try:
+                match (command):
+                    case PartitionCommand.STOP:
+                        conn.send(True)
+                        return
+                    case PartitionCommand.STEP:
+                        tick = part.sim.current_step + 1
+                        export_values = part.step([values[((tick - 1) % 2) * slots + slot] for slot in import_slots])
+                        write_exports(tick % 2, export_values)
+                        conn.send(part.sim.current_step)
+                    case _:
+                        ret = part.handle(command, args)
+                        if command in (PartitionCommand.SET, PartitionCommand.MULTISET):
+                            # writes between ticks are seen by importers on the next tick
+                            write_exports(part.sim.current_step % 2, part.exportValues())
+                        conn.send(ret)
+            except Exception as e:
+                conn.send(e)
+    finally:
+        values.release()
+        shm.close()
+
+"""
+Runs a simulation definition split across several worker processes. Each worker
+owns a partition of the objects (see simulating/Partitioning.py) and steps it in
+parallel with the others. Only the references crossing partitions are exchanged
+at the tick barrier. Client requests are routed to the partition owning the
+reference, so this class can be used wherever a Simulator is served.
+"""
+class PartitionedSimulator:
+    def __init__(self, sim_id: str, num_workers: int):
+        defn = SimulationDefn.load(sim_id)
+        self.object_order = list(defn.objects.keys())
+        self.partitions = partition_simulation(defn, num_workers)
+        self.imports, self.exports = boundary_plan(defn, self.partitions)
+        self.current_step = 0
+        self.simulation_started = False
+
+        boundary = sorted({name for exports in self.exports for name in exports})
+        slot_of = {name: i for i, name in enumerate(boundary)}
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * 2 * max(1, len(boundary)))
+
+        ctx = multiprocessing.get_context("spawn")
+        self.conns = []
+        self.processes = []
+        for i, partition in enumerate(self.partitions):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=partition_worker, args=(
+                sim_id, partition, self.imports[i], self.exports[i],
+                [slot_of[name] for name in self.imports[i]], [slot_of[name] for name in self.exports[i]],
+                self.shm.name, child_conn))
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+        try:
+            self._setup()
+        except Exception:
+            for process in self.processes:
+                process.terminate()
+                process.join()
+            self.shm.close()
+            self.shm.unlink()
+            raise
+
+    def _setup(self):
+        self.owners = {}
+        ranges = {}
+        for i, conn in enumerate(self.conns):
+            ret = conn.recv()
+            if isinstance(ret, Exception):
+                raise ret
+            ref_names, export_ranges = ret
+            for name in ref_names:
+                self.owners[name] = i
+            ranges.update(zip(self.exports[i], export_ranges))
+        for i, conn in enumerate(self.conns):
+            conn.send([ranges[name] for name in self.imports[i]])
+        for conn in self.conns:
+            self._response(conn)
+
+    def _response(self, conn):
+        ret = conn.recv()
+        if isinstance(ret, Exception):
+            raise ret
+        return ret
+
+    def _request(self, partition: int, command: PartitionCommand, args):
+        self.conns[partition].send((command, args))
+        return self._response(self.conns[partition])
+
+    """
+    Send the same command to every partition, then wait for all of them.
+    """
+    def _broadcast(self, command: PartitionCommand, args) -> list:
+        for conn in self.conns:
+            conn.send((command, args))
+        return [self._response(conn) for conn in self.conns]
+
+    """
+    Group reference names by the partition that owns them. Unknown names are
+    returned separately.
+    """
+    def _route(self, names) -> tuple[dict[int, list[str]], list[str]]:
+        routed = {}
+        unknown = []
+        for name in names:
+            if name in self.owners:
+                routed.setdefault(self.owners[name], []).append(name)
+            else:
+                unknown.append(name)
+        return routed, unknown
+
+    def step(self):
+        self.simulation_started = True
+        self._broadcast(PartitionCommand.STEP, None)
+        self.current_step += 1
+
+    def getReferenceKeys(self):
+        return self.owners.keys()
+
+    def setReferenceValue(self, ref_name, value) -> bool | SimulationError:
+        if not ref_name in self.owners:
+            return SimulationError(ErrorType.INVALID_REFERENCE, f"'{ref_name}' does not exist.")
+        return self._request(self.owners[ref_name], PartitionCommand.SET, (ref_name, value))
+
+    def getReferenceValue(self, ref_name) -> float | SimulationError:
+        if not ref_name in self.owners:
+            return SimulationError(ErrorType.INVALID_REFERENCE, f"'{ref_name}' does not exist.")
+        return self._request(self.owners[ref_name], PartitionCommand.GET, ref_name)
+
+    def setReferences(self, mapping) -> bool | SimulationError:
+        routed, unknown = self._route(mapping.keys())
+        return_errors = [(key, str(ErrorType.INVALID_REFERENCE)) for key in unknown]
+        for partition, names in routed.items():
+            return_errors += self._request(partition, PartitionCommand.MULTISET, {name: mapping[name] for name in names})
+        if len(return_errors) > 0:
+            return SimulationError(ErrorType.MULTI_SET_FAILURE, f"The following references failed to be written: {return_errors}")
+        return True
+
+    def getReferences(self, names, since_step: int = None) -> dict | SimulationError:
+        routed, unknown = self._route(names)
+        if len(unknown) > 0:
+            return SimulationError(ErrorType.INVALID_REFERENCE, f"The following requested references do not exist: {', '.join(unknown)}")
+        values = {}
+        for partition, partition_names in routed.items():
+            ret = self._request(partition, PartitionCommand.MULTIGET, (partition_names, since_step))
+            values.update(ret if since_step is None else ret["references"])
+        # keep the order the names were requested in
+        ret = {name: values[name] for name in names if name in values}
+        if since_step is not None:
+            return {"step": self.current_step, "references": ret}
+        return ret
+
+    def ref(self, ref_name):
+        raise Exception("References of a partitioned simulation live in the worker processes.")
+
+    def getAPI(self):
+        api = {}
+        for partition_api in self._broadcast(PartitionCommand.GET_API, None):
+            api.update(partition_api)
+        return {name: api[name] for name in self.object_order if name in api}
+
+    def heartbeat(self):
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                raise Exception(f"Partition worker {i} exited with code {process.exitcode}")
+
+    def stop(self):
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send((PartitionCommand.STOP, None))
+                    conn.recv()
+                except (EOFError, OSError):
+                    pass
+            process.join()
+        self.shm.close()
+        self.shm.unlink()
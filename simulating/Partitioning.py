@@ -0,0 +1,158 @@
+from simulating.definition.SimulationDefiniton import SimulationDefn
+import math
+
+"""
+Splits the objects of a simulation definition into partitions that can step in
+separate processes or hosts. References crossing partitions have to be exchanged
+at every tick, so partitions are chosen to cut as few ref_map links as possible
+while keeping the number of objects per partition balanced.
+"""
+
+"""
+Returns the name of the object exporting the absolute reference name, or None.
+Object names may contain periods, so the longest matching prefix wins.
+"""
+def reference_owner(ref_name: str, object_names) -> str:
+    owner = None
+    for name in object_names:
+        if ref_name.startswith(name + '.') and (owner is None or len(name) > len(owner)):
+            owner = name
+    return owner
+
+"""
+Returns the weighted, undirected object graph of the definition. There is an edge
+between two objects for every ref_map link between them.
+"""
+def reference_graph(defn: SimulationDefn) -> dict[str, dict[str, int]]:
+    graph = {name: {} for name in defn.objects.keys()}
+    for name, obj_defn in defn.objects.items():
+        for ref_name in obj_defn.ref_map.values():
+            owner = reference_owner(ref_name, defn.objects.keys())
+            if owner is None or owner == name:
+                continue
+            graph[name][owner] = graph[name].get(owner, 0) + 1
+            graph[owner][name] = graph[owner].get(name, 0) + 1
+    return graph
+
+"""
+Controllers write the references they hold directly, so every object a controller
+touches has to live in the same partition. Returns the groups of objects that
+must stay together (singletons for objects without controllers), and the group
+index each controller belongs to.
+"""
+def _controller_groups(defn: SimulationDefn) -> tuple[list[list[str]], dict[str, int]]:
+    parent = {name: name for name in defn.objects.keys()}
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    controller_roots = {}
+    for ctrl_name, ctrl_defn in defn.controllers.items():
+        owners = [reference_owner(ref_name, defn.objects.keys()) for ref_name in ctrl_defn.ref_map.values()]
+        owners = [owner for owner in owners if owner is not None]
+        assert len(owners) > 0, f"Controller '{ctrl_name}' does not reference any object."
+        for owner in owners[1:]:
+            parent[find(owner)] = find(owners[0])
+        controller_roots[ctrl_name] = owners[0]
+
+    group_index = {}
+    groups = []
+    for name in defn.objects.keys():
+        root = find(name)
+        if not root in group_index:
+            group_index[root] = len(groups)
+            groups.append([])
+        groups[group_index[root]].append(name)
+
+    return groups, {ctrl_name: group_index[find(owner)] for ctrl_name, owner in controller_roots.items()}
+
+def cut_edges(graph: dict[str, dict[str, int]], assignment: dict[str, int]) -> int:
+    return sum(weight for name, edges in graph.items() for other, weight in edges.items() if assignment[name] != assignment[other]) // 2
+
+"""
+Assign the objects and controllers of the definition to at most num_partitions
+partitions. Connected groups of objects are kept together when they fit, larger
+groups are split in breadth first order so that neighbours tend to stay
+together, then a refinement pass moves objects to the partition holding most of
+their neighbours while the partitions stay balanced.
+
+Returns a list of {"objects": [...], "controllers": [...]}, one per non-empty partition.
+"""
+def partition_simulation(defn: SimulationDefn, num_partitions: int, imbalance: float = 0.1) -> list[dict[str, list[str]]]:
+    assert num_partitions > 0, "There has to be at least one partition"
+    if len(defn.objects) == 0:
+        # nothing to split, controllers without objects all run together
+        return [{"objects": [], "controllers": list(defn.controllers.keys())}] if len(defn.controllers) > 0 else []
+    graph = reference_graph(defn)
+    groups, controller_groups = _controller_groups(defn)
+    num_partitions = min(num_partitions, len(groups))
+    capacity = max(max(len(group) for group in groups), math.ceil(len(defn.objects) / num_partitions * (1 + imbalance)))
+
+    # graph between the groups that have to stay together
+    group_of = {name: i for i, group in enumerate(groups) for name in group}
+    group_graph = [{} for _ in groups]
+    for name, edges in graph.items():
+        for other, weight in edges.items():
+            if group_of[name] != group_of[other]:
+                group_graph[group_of[name]][group_of[other]] = group_graph[group_of[name]].get(group_of[other], 0) + weight
+
+    # connected components of groups, in breadth first order
+    components = []
+    seen = set()
+    for start in range(len(groups)):
+        if start in seen:
+            continue
+        seen.add(start)
+        order = [start]
+        for g in order:
+            for other in sorted(group_graph[g].keys()):
+                if not other in seen:
+                    seen.add(other)
+                    order.append(other)
+        components.append(order)
+
+    # largest components first, each into the least loaded partition that fits it
+    loads = [0] * num_partitions
+    group_partition = {}
+    for component in sorted(components, key=lambda c: -sum(len(groups[g]) for g in c)):
+        size = sum(len(groups[g]) for g in component)
+        target = min(range(num_partitions), key=lambda p: loads[p])
+        if loads[target] + size <= capacity:
+            for g in component:
+                group_partition[g] = target
+            loads[target] += size
+            continue
+        # too big for any partition: fill partitions in breadth first order
+        for g in component:
+            fits = [p for p in range(num_partitions) if loads[p] + len(groups[g]) <= capacity]
+            if len(fits) == 0:
+                fits = range(num_partitions)
+            # prefer the partition holding most of the group's neighbours
+            target = max(fits, key=lambda p: (sum(w for other, w in group_graph[g].items() if group_partition.get(other) == p), -loads[p]))
+            group_partition[g] = target
+            loads[target] += len(groups[g])
+
+    # refinement: move groups towards their neighbours while it reduces the cut
+    improved = True
+    while improved:
+        improved = False
+        for g in range(len(groups)):
+            current = group_partition[g]
+            gains = {}
+            for other, weight in group_graph[g].items():
+                gains[group_partition[other]] = gains.get(group_partition[other], 0) + weight
+            best = max(gains.keys(), key=lambda p: gains[p], default=current)
+            if best != current and gains[best] > gains.get(current, 0) and loads[best] + len(groups[g]) <= capacity:
+                group_partition[g] = best
+                loads[current] -= len(groups[g])
+                loads[best] += len(groups[g])
+                improved = True
+
+    partitions = [{"objects": [], "controllers": []} for _ in range(num_partitions)]
+    for name in defn.objects.keys():
+        partitions[group_partition[group_of[name]]]["objects"].append(name)
+    for ctrl_name, g in controller_groups.items():
+        partitions[group_partition[g]]["controllers"].append(ctrl_name)
+    return [partition for partition in partitions if len(partition["objects"]) > 0]
@@ -4,6 +4,10 @@ class Reference:
         self.min = minimum
         self.max = maximum
         self.read_only = read_only
+        # simulation step at which the value last changed. The simulator
+        # stamps references flagged as modified, see Simulator._stampModified.
+        self.last_modified = 0
+        self.modified = False
 
     def get(self):
         return self._value
@@ -12,13 +16,47 @@ class Reference:
         return  (self.get() - self.min) / (self.max - self.min)
     
     def update(self, value):
+        if value != self._value:
+            self.modified = True
         self._value = value
 
     def set(self, value):
         assert not self.read_only, "Attempting to write to read only reference."
+        if value != self._value:
+            self.modified = True
         self._value = value
 
+"""
+Tracks whether a set of references has held still. The references are stable
+while each stays within tolerance (a fraction of its min/max range) of the
+value it had when the stable run started.
+"""
+class QuiescenceTracker:
+    def __init__(self, references: list[Reference], ticks: int, tolerance: float):
+        assert ticks > 0, "Quiescence needs at least one stable tick"
+        self.references = references
+        self.ticks = ticks
+        self.tolerances = [tolerance * abs(ref.max - ref.min) for ref in references]
+        self.anchor = None
+        self.stable_ticks = 0
+
+    """
+    Record the current values, returns True once they have been stable for the
+    configured number of ticks.
+    """
+    def observe(self) -> bool:
+        values = [ref.get() for ref in self.references]
+        if self.anchor is not None and all(abs(value - anchor) <= tol for value, anchor, tol in zip(values, self.anchor, self.tolerances)):
+            self.stable_ticks += 1
+        else:
+            self.anchor = values
+            self.stable_ticks = 0
+        return self.stable_ticks >= self.ticks
+
 class SimObject:
+    # set by the simulation definition when the object may be skipped while idle
+    quiescence: QuiescenceTracker = None
+
     def __init__(self):
         raise Exception("Abstract base should not be initialized")
     
@@ -47,4 +85,23 @@ class SimObject:
     Override this method to connect named references defined in the object's definition.
     """
     def resolveReferences(self, refs: dict[str, Reference]):
-        pass
\ No newline at end of file
+        pass
+
+    """
+    Called by the simulator after the object's references are updated. Once the object
+    reports it is quiescent, the simulator stops stepping it until one of its
+    dependencies changes. By default, an object is quiescent once its inputs and
+    outputs have held still for as long as its quiescence tracker requires.
+    """
+    def isQuiescent(self) -> bool:
+        if self.quiescence is None:
+            return False
+        return self.quiescence.observe()
+
+    """
+    References the object reads that can change while it is not stepping. By default
+    these are the object's own writeable references, the references resolved through
+    its definition's ref_map are added by the simulation.
+    """
+    def getDependencies(self) -> list[Reference]:
+        return [ref for _, ref in self.getReferences() if not ref.read_only]
\ No newline at end of file
@@ -1,7 +1,9 @@
 from multiprocessing import Process, Queue
 import asyncio
 from simulating.definition.SimulationDefiniton import SimulationDefn
-from simulating.Simulation import SimulationError
+from simulating.Simulation import SimulationError, ErrorType
+from simulating.PartitionedSimulation import PartitionedSimulator
+from simulating.DistributedSimulation import DistributedSimulator
 from time import sleep, time
 from enum import Enum
 
@@ -13,58 +15,91 @@ class Operation(Enum):
     MULTIGET = 4
     MULTISET = 5
     
-def simulation_runner(sim_id: str, inQueue, outQueue):
+"""
+Runs the simulation and serves requests between ticks. With workers > 1 the
+objects are partitioned across that many worker processes. With worker_hosts
+("host:port" addresses of running distributed workers) the partitions run on
+those hosts instead.
+
+If the simulation fails (e.g. a worker host goes away) every following request
+is answered with the failure until the server is stopped.
+"""
+def simulation_runner(sim_id: str, inQueue, outQueue, workers: int = 1, worker_hosts: list[str] = None):
     defn = SimulationDefn.load(sim_id)
         
-    sim = defn.createSimulation()
+    if worker_hosts:
+        sim = DistributedSimulator(sim_id, worker_hosts)
+    elif workers > 1:
+        sim = PartitionedSimulator(sim_id, workers)
+    else:
+        sim = defn.createSimulation()
 
+    failure = None
     runtime = 0
     while True:
         start = time()
         # print(start)
-        sim.step()
+        if failure is None:
+            try:
+                sim.step()
+            except Exception as e:
+                print(f"Simulation failed: {e}")
+                failure = SimulationError(ErrorType.SIMULATION_FAILED, f"The simulation failed: {e}")
         end = time()
         # print(f"step took {end-start} seconds")
         runtime = end - start
-        next_work_time = end + (1.0 - runtime)
+        next_work_time = end + (defn.tick_period - runtime)
         while (time() < next_work_time):
             if (inQueue.empty()):
+                if failure is None:
+                    try:
+                        sim.heartbeat()
+                    except Exception as e:
+                        print(f"Simulation failed: {e}")
+                        failure = SimulationError(ErrorType.SIMULATION_FAILED, f"The simulation failed: {e}")
                 sleep(0.01)
             else:
                 id, operation, args = inQueue.get()
 
-                match (operation):
-                    case Operation.STOP:
-                        while not inQueue.empty():
-                            id, operation, args = inQueue.get()
-                            outQueue.put((id, "Server shutting down."))
-                        return
-                    case Operation.GET_API:
-                        api = sim.getAPI()
-                        outQueue.put((id, api))
-                    case Operation.GET:
-                        reference = args
-                        value = sim.getReferenceValue(reference)
-                        outQueue.put((id, value))
-                    case Operation.MULTIGET:
-                        names = args
-                        value = sim.getReferences(names)
-                        outQueue.put((id, value))
-                    case Operation.SET:
-                        reference, value = args
-                        e = sim.setReferenceValue(reference, value)
-                        outQueue.put((id, e))
-                    case Operation.MULTISET:
-                        mapping = args
-                        e = sim.setReferences(mapping)
-                        outQueue.put((id, e))
-                    
+                if operation == Operation.STOP:
+                    while not inQueue.empty():
+                        id, operation, args = inQueue.get()
+                        outQueue.put((id, "Server shutting down."))
+                    sim.stop()
+                    return
+                if failure is not None:
+                    outQueue.put((id, failure))
+                    continue
+
+                try:
+                    outQueue.put((id, handle_request(sim, operation, args)))
+                except Exception as e:
+                    print(f"Simulation failed: {e}")
+                    failure = SimulationError(ErrorType.SIMULATION_FAILED, f"The simulation failed: {e}")
+                    outQueue.put((id, failure))
+
+def handle_request(sim, operation: Operation, args):
+    match (operation):
+        case Operation.GET_API:
+            return sim.getAPI()
+        case Operation.GET:
+            reference = args
+            return sim.getReferenceValue(reference)
+        case Operation.MULTIGET:
+            names, since_step = args
+            return sim.getReferences(names, since_step)
+        case Operation.SET:
+            reference, value = args
+            return sim.setReferenceValue(reference, value)
+        case Operation.MULTISET:
+            mapping = args
+            return sim.setReferences(mapping)
     
 class SimulatorServer:
-    def __init__(self, sim_id: str):
+    def __init__(self, sim_id: str, workers: int = 1, worker_hosts: list[str] = None):
         self.inQueue = Queue()
         self.outQueue = Queue()
-        self.sim_process = Process(target=simulation_runner, args = (sim_id, self.inQueue, self.outQueue))
+        self.sim_process = Process(target=simulation_runner, args = (sim_id, self.inQueue, self.outQueue, workers, worker_hosts))
         self.sim_process.start()
         self.req_id = 0
         self.next_req = 0
@@ -115,8 +150,8 @@ class SimulatorServer:
     async def setReferences(self, mapping):
         return await self._processRequest(Operation.MULTISET, mapping)
 
-    async def getReferences(self, names):
-        return await self._processRequest(Operation.MULTIGET, names)
+    async def getReferences(self, names, since_step: int = None):
+        return await self._processRequest(Operation.MULTIGET, (names, since_step))
     
     def stop(self):
         self.stopping = True
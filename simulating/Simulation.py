@@ -1,10 +1,12 @@
-from simulating.SimObject import SimObject
+from simulating.SimObject import SimObject, Reference
+from simulating.Controller import Controller
 from enum import Enum
 
 class ErrorType(Enum):
     INVALID_REFERENCE = 0
     READ_ONLY_FAILED_WRITE = 1
     MULTI_SET_FAILURE = 2
+    SIMULATION_FAILED = 3
 
 class SimulationError:
     def __init__(self, error_type: ErrorType, msg: str):
@@ -14,29 +16,117 @@ class SimulationError:
 class Simulator:
     def __init__(self):
         self.objects = {}
+        # number of ticks between steps of each object
+        self.step_periods = {}
+        # references each object reads that other objects or clients can change
+        self.dependencies = {}
+        # objects skipped while idle, mapped to the step they went quiescent at
+        self.quiescent_since = {}
+        self.controllers = {}
         self.references = {}
+        # stand-ins for references owned by other partitions of a partitioned simulation
+        self.proxies = {}
         self.simulation_started = False
+        self.current_step = 0
+        # unique reference objects, used to stamp modifications after each step
+        self._tracked_refs = []
+        self._tracked_ids = set()
 
-    def AddObject(self, object_name: str, object: SimObject):
+    def AddObject(self, object_name: str, object: SimObject, step_period: int = 1):
         assert self.simulation_started == False, "All objects must be added before the simulation starts."
         assert object_name not in self.objects, f"'{object_name}' has already been used for another object."
+        assert step_period >= 1, f"'{object_name}' step period must be at least one tick."
         self.objects[object_name] = object
+        self.step_periods[object_name] = step_period
+        self.dependencies[object_name] = object.getDependencies()
         for ref_name, ref in object.getReferences():
             fullname = object_name + '.' + ref_name
             self.references[fullname] = ref
+            if not id(ref) in self._tracked_ids:
+                self._tracked_ids.add(id(ref))
+                self._tracked_refs.append(ref)
 
         return object
 
+    """
+    Register a stand-in for a reference owned by another partition. Proxies are
+    resolvable by objects in this simulation, but are not exported to clients.
+    """
+    def AddProxyReference(self, ref_name: str, ref: Reference):
+        assert self.simulation_started == False, "All proxies must be added before the simulation starts."
+        assert ref_name not in self.proxies, f"'{ref_name}' already has a proxy."
+        self.proxies[ref_name] = ref
+        if not id(ref) in self._tracked_ids:
+            self._tracked_ids.add(id(ref))
+            self._tracked_refs.append(ref)
+
+    """
+    Add references that wake the object when they change while it is quiescent.
+    """
+    def AddDependencies(self, object_name: str, refs: list[Reference]):
+        assert object_name in self.objects, f"'{object_name}' does not exist."
+        self.dependencies[object_name] += refs
+
+    def AddController(self, controller_name: str, controller: Controller):
+        assert self.simulation_started == False, "All controllers must be added before the simulation starts."
+        assert controller_name not in self.controllers, f"'{controller_name}' has already been used for another controller."
+        self.controllers[controller_name] = controller
+        return controller
+
     def step(self):
         if not self.simulation_started:
             self.simulation_started = True
 
-        for object in self.objects.values():
+        tick = self.current_step + 1
+
+        # control logic acts on the state at the start of the tick
+        for controller in self.controllers.values():
+            controller.step()
+        # stamp controller writes so they wake the objects they affect this tick
+        self._stampModified(tick)
+        self._wakeObjects()
+
+        # objects only step on their own ticks, their references hold in between
+        due = self._dueObjects(tick)
+        for _, object in due:
             object.step()
 
-        for _, object in self.objects.items():
+        for _, object in due:
             object.updateReferences()
 
+        self.current_step = tick
+        self._stampModified(self.current_step)
+
+        for name, object in due:
+            if object.isQuiescent():
+                self.quiescent_since[name] = self.current_step
+
+    """
+    Objects step on the first tick and then every step_period ticks, unless they
+    are quiescent.
+    """
+    def _dueObjects(self, tick: int) -> list[tuple[str, SimObject]]:
+        return [(name, object) for name, object in self.objects.items()
+                if (tick - 1) % self.step_periods[name] == 0 and not name in self.quiescent_since]
+
+    """
+    Resume stepping quiescent objects whose dependencies changed after they went idle.
+    """
+    def _wakeObjects(self):
+        for name, since in list(self.quiescent_since.items()):
+            if any(ref.last_modified > since for ref in self.dependencies[name]):
+                del self.quiescent_since[name]
+
+    """
+    Record the step at which each reference flagged as modified changed, so that
+    clients can ask for only the references that changed since a given step.
+    """
+    def _stampModified(self, step: int):
+        for ref in self._tracked_refs:
+            if ref.modified:
+                ref.last_modified = step
+                ref.modified = False
+
     def getReferenceKeys(self):
         return self.references.keys()
     
@@ -45,7 +135,12 @@ class Simulator:
             return SimulationError(ErrorType.INVALID_REFERENCE, f"'{ref_name}' does not exist.")
         if self.references[ref_name].read_only:
             return SimulationError(ErrorType.READ_ONLY_FAILED_WRITE, f"'{ref_name}' is read only!")
-        self.references[ref_name].set(value)
+        ref = self.references[ref_name]
+        ref.set(value)
+        # writes between steps are first observed by clients at the next step
+        if ref.modified:
+            ref.last_modified = self.current_step + 1
+            ref.modified = False
         return True
 
     def getReferenceValue(self, ref_name) -> float | SimulationError:
@@ -63,17 +158,36 @@ class Simulator:
             return SimulationError(ErrorType.MULTI_SET_FAILURE, f"The following references failed to be written: {return_errors}")
         return True
 
-    def getReferences(self, names) -> dict[str, float] | SimulationError:
+    """
+    Returns the values of the named references. If since_step is given, only
+    the references modified after that step are returned, along with the
+    current step number to use as since_step in the next poll:
+        {"step": current_step, "references": {name: value, ...}}
+    """
+    def getReferences(self, names, since_step: int = None) -> dict | SimulationError:
         ret = {}
         dne = []
         for name in names:
-            ret[name] = self.getReferenceValue(name)
-            if isinstance(ret[name], SimulationError):
+            if not name in self.references:
                 dne.append(name)
+            elif since_step is None or self.references[name].last_modified > since_step:
+                ret[name] = self.references[name].get()
         if len(dne) > 0:
             return SimulationError(ErrorType.INVALID_REFERENCE, f"The following requested references do not exist: {', '.join(dne)}")
+        if since_step is not None:
+            return {"step": self.current_step, "references": ret}
         return ret
     
+    """
+    Release resources held by the simulation. A single process simulation holds none.
+    """
+    def stop(self):
+        pass
+
+    # called while the simulation is idle between ticks
+    def heartbeat(self):
+        pass
+
     # not exposed on the webapi, crash if used improperly.
     def ref(self, ref_name):
         assert ref_name in self.references, f"'{ref_name}' does not exist."
@@ -0,0 +1,110 @@
+from simulating.Controller import Controller
+from simulating.SimObject import Reference
+from simulating.definition.SimulationDefiniton import ControllerDefn, ExternalReference
+
+"""
+The batch recipe from mixer_sim.py, running inside the simulation:
+    * fill from inlet 1 up to first_fill_level
+    * let the mixer settle for settle_ticks
+    * fill from inlet 2 up to second_fill_level
+    * mix for mix_ticks
+    * drain through the outlet until empty, then start over
+Each fill/drain phase waits for the previous valve to finish closing before
+opening its own.
+"""
+class MixerRecipeController(Controller):
+    FILL1 = 0
+    SETTLE = 1
+    FILL2 = 2
+    MIX = 3
+    DRAIN = 4
+
+    def __init__(self, first_fill_level: float, second_fill_level: float, settle_ticks: int, mix_ticks: int):
+        self.first_fill_level = first_fill_level
+        self.second_fill_level = second_fill_level
+        self.settle_ticks = settle_ticks
+        self.mix_ticks = mix_ticks
+
+        self.phase = MixerRecipeController.FILL1
+        self.wait_ticks = 0
+        self.batches = 0
+
+    def _setValve(self, valve: str, open: bool):
+        self.refs[f"{valve}_cls"].set(open)
+        self.refs[f"{valve}_ols"].set(open)
+
+    def step(self):
+        level = self.refs['level'].get()
+        match (self.phase):
+            case MixerRecipeController.FILL1:
+                if level < self.first_fill_level and self.refs['out_position'].get() == 0:
+                    self._setValve('in1', True)
+                elif level >= self.first_fill_level:
+                    self._setValve('in1', False)
+                    self.phase = MixerRecipeController.SETTLE
+                    self.wait_ticks = self.settle_ticks
+            case MixerRecipeController.SETTLE:
+                self.wait_ticks -= 1
+                if self.wait_ticks <= 0:
+                    self.phase = MixerRecipeController.FILL2
+            case MixerRecipeController.FILL2:
+                if level < self.second_fill_level and self.refs['in1_position'].get() == 0:
+                    self._setValve('in2', True)
+                elif level >= self.second_fill_level:
+                    self._setValve('in2', False)
+                    self.phase = MixerRecipeController.MIX
+                    self.wait_ticks = self.mix_ticks
+            case MixerRecipeController.MIX:
+                self.wait_ticks -= 1
+                if self.wait_ticks <= 0:
+                    self.phase = MixerRecipeController.DRAIN
+            case MixerRecipeController.DRAIN:
+                if level > 0 and self.refs['in2_position'].get() == 0:
+                    self._setValve('out', True)
+                elif level == 0:
+                    self._setValve('out', False)
+                    self.phase = MixerRecipeController.FILL1
+                    self.batches += 1
+
+    def resolveReferences(self, refs: dict[str, Reference]):
+        self.refs = refs
+
+class MixerRecipeControllerDefn(ControllerDefn):
+    def __init__(self, mixer: str, first_fill_level: float = 600, second_fill_level: float = 980, settle_ticks: int = 2, mix_ticks: int = 14):
+        ref_map = {'level': f"{mixer}.Level"}
+        for valve, name in [('in1', 'Inlet1'), ('in2', 'Inlet2'), ('out', 'Outlet')]:
+            ref_map[f"{valve}_position"] = f"{mixer}.{name}.Position"
+            ref_map[f"{valve}_ols"] = f"{mixer}.{name}.OLS"
+            ref_map[f"{valve}_cls"] = f"{mixer}.{name}.CLS"
+        super().__init__(ref_map=ref_map)
+        self.mixer = mixer
+        self.first_fill_level = first_fill_level
+        self.second_fill_level = second_fill_level
+        self.settle_ticks = settle_ticks
+        self.mix_ticks = mix_ticks
+
+    def export_keys(self) -> list[dict]:
+        running = super().export_keys()
+        running.append(
+          {
+            "mixer": self.mixer,
+            "first_fill_level": self.first_fill_level,
+            "second_fill_level": self.second_fill_level,
+            "settle_ticks": self.settle_ticks,
+            "mix_ticks": self.mix_ticks,
+          }
+        )
+        return running
+
+    def createController(self) -> Controller:
+        return MixerRecipeController(self.first_fill_level, self.second_fill_level, self.settle_ticks, self.mix_ticks)
+
+    def getExternalReferences(self) -> list[ExternalReference]:
+        refs = [ExternalReference('level', "The mixer's level")]
+        for valve, desc in [('in1', "Inlet1"), ('in2', "Inlet2"), ('out', "Outlet")]:
+            refs += [
+                ExternalReference(f"{valve}_position", f"{desc}'s position"),
+                ExternalReference(f"{valve}_ols", f"{desc}'s open limit switch"),
+                ExternalReference(f"{valve}_cls", f"{desc}'s close limit switch"),
+            ]
+        return refs
@@ -1,5 +1,6 @@
 from util.Exportable import Exportable, ExportableType
-from simulating.SimObject import Reference, SimObject
+from simulating.SimObject import Reference, SimObject, QuiescenceTracker
+from simulating.Controller import Controller
 from simulating.Simulation import Simulator
 
 class ExternalReference:
@@ -8,6 +9,19 @@ class ExternalReference:
         self.description = desc
         self.required = required
 
+"""
+Map each external reference name in ref_map to the simulation reference it
+names.
+"""
+def resolve_reference_map(ref_map: dict[str, str], references: dict[str, Reference]) -> dict[str, Reference]:
+    resolutions = {}
+    for ext_ref_name, ref_name in ref_map.items():
+        if not ref_name in references:
+            # TODO: refactor to make it possible to check this at the time of saving the simulation
+            raise Exception(f"Reference {ref_name} does not exist (ext_ref: {ext_ref_name})")
+        resolutions[ext_ref_name] = references[ref_name]
+    return resolutions
+
 """
 Subclass this to define an object type that can be used in a simulation.
 The class should define:
@@ -16,11 +30,26 @@ The class should define:
     * method to instantiate the object.
 """
 class SimObjectDefn(Exportable):
+    # defaults for definitions pickled before multi-rate scheduling and quiescence existed
+    step_period = 1
+    quiescence_ticks = 0
+
     """
     ref_map is the mapping from external reference to the actual resolved reference.
+    step_period is the number of simulation ticks between steps of the object. Its
+    references hold their values on the ticks in between.
+    If quiescence_ticks > 0, the simulator stops stepping the object once its own
+    references and the references in ref_map have stayed within quiescence_tolerance
+    (a fraction of each reference's range) for that many steps, until one of its
+    writeable or ref_map references changes. For modeled objects, use at least the
+    model's datapoint_length so the input window has settled too.
     """
-    def __init__(self, ref_map: dict[str, str]):
+    def __init__(self, ref_map: dict[str, str], step_period: int = 1, quiescence_ticks: int = 0, quiescence_tolerance: float = 0.01):
+        assert step_period >= 1, "The step period must be at least one tick"
         self.ref_map = ref_map
+        self.step_period = step_period
+        self.quiescence_ticks = quiescence_ticks
+        self.quiescence_tolerance = quiescence_tolerance
         for ext_ref in self.getExternalReferences():
             if ext_ref.required:
                 assert ext_ref.name in ref_map.keys(), f"{ext_ref.name} expected to be set, but is not"
@@ -35,6 +64,11 @@ class SimObjectDefn(Exportable):
             "refs": self.ref_map,
           }
         )
+        # only exported when used, so single rate objects keep their ids
+        if self.step_period != 1:
+            running[-1]["step_period"] = self.step_period
+        if self.quiescence_ticks > 0:
+            running[-1]["quiescence"] = [self.quiescence_ticks, self.quiescence_tolerance]
         return running
     
     """
@@ -58,13 +92,67 @@ class SimObjectDefn(Exportable):
     references it wants to use.
     """
     def resolveReferences(self, object: SimObject, references: dict[str, Reference]):
-        resolutions = {}
-        for ext_ref_name, ref_name in self.ref_map.items():
-            if not ref_name in references:
-                # TODO: refactor to make it possible to check this at the time of saving the simulation
-                raise Exception(f"Reference {ref_name} does not exist (ext_ref: {ext_ref_name})")
-            resolutions[ext_ref_name] = references[ref_name]
-        object.resolveReferences(resolutions)
+        object.resolveReferences(resolve_reference_map(self.ref_map, references))
+
+    """
+    Called after resolveReferences. Registers the ref_map references as dependencies
+    of the object and, if enabled, sets up quiescence tracking.
+    """
+    def configureScheduling(self, sim: Simulator, object_name: str, object: SimObject, references: dict[str, Reference]):
+        external = list(resolve_reference_map(self.ref_map, references).values())
+        sim.AddDependencies(object_name, external)
+        if self.quiescence_ticks > 0:
+            refs = [ref for _, ref in object.getReferences()] + external
+            object.quiescence = QuiescenceTracker(refs, self.quiescence_ticks, self.quiescence_tolerance)
+
+"""
+Subclass this to define control logic (sequences, recipes, interlocks) that
+runs inside the simulation at the start of each tick. Like a SimObjectDefn,
+the class should define:
+    * The parameters needed to instantiate the controller
+    * The external references it reads and writes.
+    * method to instantiate the controller.
+"""
+class ControllerDefn(Exportable):
+    """
+    ref_map is the mapping from external reference to the actual resolved reference.
+    """
+    def __init__(self, ref_map: dict[str, str]):
+        self.ref_map = ref_map
+        for ext_ref in self.getExternalReferences():
+            if ext_ref.required:
+                assert ext_ref.name in ref_map.keys(), f"{ext_ref.name} expected to be set, but is not"
+
+    def getExportType(self) -> ExportableType:
+        return ExportableType.Simulation
+
+    def export_keys(self) -> list[dict]:
+        running = super().export_keys()
+        running.append(
+          {
+            "refs": self.ref_map,
+          }
+        )
+        return running
+
+    """
+    Override to return a Controller subclass to add to the simulation.
+    """
+    def createController(self) -> Controller:
+        raise Exception("Unimplemented")
+
+    """
+    Override to return a static list of name external references.
+    """
+    def getExternalReferences(self) -> list[ExternalReference]:
+        return []
+
+    """
+    Called after every object of the simulation has been created, so that the
+    controller can hold the references it reads and writes.
+    """
+    def resolveReferences(self, controller: Controller, references: dict[str, Reference]):
+        controller.resolveReferences(resolve_reference_map(self.ref_map, references))
 
 """
 This class defines a simulation to run in our server and provides a method
@@ -73,8 +161,19 @@ The working of the simulation is defined by the inner working of each object
 and which references they share between each other.
 """
 class SimulationDefn(Exportable):
-    def __init__(self, objects: dict[str, SimObjectDefn]):
+    # defaults for definitions pickled before controllers and multi-rate scheduling existed
+    controllers = {}
+    tick_period = 1.0
+
+    """
+    tick_period is the wall clock time in seconds of one simulation tick when the
+    simulation is served. Objects step every SimObjectDefn.step_period ticks.
+    """
+    def __init__(self, objects: dict[str, SimObjectDefn], controllers: dict[str, ControllerDefn] = {}, tick_period: float = 1.0):
+        assert tick_period > 0, "The tick period must be positive"
         self.objects = objects
+        self.controllers = controllers
+        self.tick_period = tick_period
 
     def getExportType(self) -> ExportableType:
         return ExportableType.Simulation
@@ -86,17 +185,43 @@ class SimulationDefn(Exportable):
             "objects": {obj_name: obj_defn.export() for obj_name, obj_defn in self.objects.items()},
           }
         )
+        # only exported when used, so simulations without controllers keep their ids
+        if len(self.controllers) > 0:
+            running[-1]["controllers"] = {name: defn.export() for name, defn in self.controllers.items()}
+        if self.tick_period != 1.0:
+            running[-1]["tick_period"] = self.tick_period
         return running
 
-    def createSimulation(self) -> Simulator:
+    """
+    Create a simulation instance. By default it contains every object and controller
+    of the definition. A partition of the simulation can be created by naming the
+    objects and controllers to include and passing proxies for the references the
+    included objects need from objects owned by other partitions.
+    """
+    def createSimulation(self, object_names: list[str] = None, controller_names: list[str] = None, proxies: dict[str, Reference] = {}) -> Simulator:
         sim = Simulator()
+        for name, ref in proxies.items():
+            sim.AddProxyReference(name, ref)
+
         links = []
         for name, defn in self.objects.items():
-            object = sim.AddObject(name, defn.createSimObject())
-            links.append((defn, object))
+            if object_names is not None and not name in object_names:
+                continue
+            object = sim.AddObject(name, defn.createSimObject(), step_period=defn.step_period)
+            links.append((name, defn, object))
+
+        references = {**sim.references, **sim.proxies}
+        for (_, defn, object) in links:
+            defn.resolveReferences(object, references)
+
+        for (name, defn, object) in links:
+            defn.configureScheduling(sim, name, object, references)
 
-        for (defn, object) in links:
-            defn.resolveReferences(object, sim.references)
+        for name, defn in self.controllers.items():
+            if controller_names is not None and not name in controller_names:
+                continue
+            controller = sim.AddController(name, defn.createController())
+            defn.resolveReferences(controller, references)
 
         return sim
     
@@ -3,11 +3,18 @@ from simulating.industrial_object_lib.Valve import Valve
 from simulating.industrial_object_lib.MixerLevelModel import MixerLevelModel
 from simulating.industrial_object_lib.MixerTemperatureModel import MixerTemperatureModel
 from simulating.SimObject import SimObject, Reference
+from simulating.InferenceCache import InferenceCache
 from simulating.definition.SimulationDefiniton import ExternalReference, SimObjectDefn
 from util.Exportable import Exportable, ExportableType
     
 class DownstreamMixer(SimObject):
-    def __init__(self, level_model_id: str, temp_model_id: str):
+    """
+    If inference_cache_size > 0, the outputs of the level model are memoized by
+    input window, quantized to inference_cache_tolerance. The temperature model
+    is not cached: it feeds its own output back as an input, with noise about
+    ten times the default tolerance, so its windows almost never repeat.
+    """
+    def __init__(self, level_model_id: str, temp_model_id: str, inference_cache_size: int = 0, inference_cache_tolerance: float = 1e-3):
         self.inlet1_position = None
         self.inlet2_position = None
         self.outlet = Valve()
@@ -19,8 +26,16 @@ class DownstreamMixer(SimObject):
         self.level_model_defn = Exportable.loadExportable(ExportableType.Model, level_model_id)
         self.temp_model_defn = Exportable.loadExportable(ExportableType.Model,temp_model_id)
 
-        self.level_model, _ = TimeSeriersNNRunner(self.level_model_defn).load()
-        self.temp_model, _ = TimeSeriersNNRunner(self.temp_model_defn).load()
+        level_runner = TimeSeriersNNRunner(self.level_model_defn)
+        temp_runner = TimeSeriersNNRunner(self.temp_model_defn)
+        self.level_model, _ = level_runner.load()
+        self.temp_model, _ = temp_runner.load()
+        self.level_precision = level_runner.inference_precision
+        self.temp_precision = temp_runner.inference_precision
+
+        self.level_cache = None
+        if inference_cache_size > 0:
+            self.level_cache = InferenceCache(inference_cache_size, inference_cache_tolerance)
         
 
     def step(self):
@@ -50,16 +65,32 @@ class DownstreamMixer(SimObject):
         # TODO: Make cubic interpolation of datapoints a base TimeSeriesNNDefn field.
         self.inlet1_position = refs['in1']
         self.inlet2_position = refs['in2']
-        self._level_model = MixerLevelModel(self.level_model, self.level_model_defn.datapoint_length, False, self.inlet1_position, self.inlet2_position, self.outlet.position_ref, level_out_ref=self.level_ref)
-        self._temp_model = MixerTemperatureModel(self.temp_model, self.temp_model_defn.datapoint_length, False, self.inlet1_position, self.inlet2_position, self.outlet.position_ref, self.level_ref, temp_out_ref=self.temperature_ref)
+        self._level_model = MixerLevelModel(self.level_model, self.level_model_defn.datapoint_length, False, self.inlet1_position, self.inlet2_position, self.outlet.position_ref, level_out_ref=self.level_ref, cache=self.level_cache, precision=self.level_precision)
+        self._temp_model = MixerTemperatureModel(self.temp_model, self.temp_model_defn.datapoint_length, False, self.inlet1_position, self.inlet2_position, self.outlet.position_ref, self.level_ref, temp_out_ref=self.temperature_ref, precision=self.temp_precision)
         self.level = self._level_model.level
         self.temp = self._temp_model.temp
+
+    """
+    Hit/miss counters of the level model's inference cache, if enabled. The
+    temperature model is never cached, see above.
+    """
+    def cacheStats(self) -> dict:
+        return {
+            "Level": None if self.level_cache is None else self.level_cache.stats(),
+        }
     
 class ChainedModeledMixerDefn(SimObjectDefn):
-    def __init__(self, level_model_id, temp_model_id, ref_map):
-        super().__init__(ref_map=ref_map)
+    # defaults for definitions pickled before inference caching existed
+    inference_cache_size = 0
+    inference_cache_tolerance = 1e-3
+
+    def __init__(self, level_model_id, temp_model_id, ref_map, step_period: int = 1, inference_cache_size: int = 0, inference_cache_tolerance: float = 1e-3,
+                 quiescence_ticks: int = 0, quiescence_tolerance: float = 0.01):
+        super().__init__(ref_map=ref_map, step_period=step_period, quiescence_ticks=quiescence_ticks, quiescence_tolerance=quiescence_tolerance)
         self.level_model_id = level_model_id
         self.temp_model_id = temp_model_id
+        self.inference_cache_size = inference_cache_size
+        self.inference_cache_tolerance = inference_cache_tolerance
 
     def export_keys(self) -> list[dict]:
         running = super().export_keys()
@@ -69,10 +100,14 @@ class ChainedModeledMixerDefn(SimObjectDefn):
             "temp_model_id": self.temp_model_id,
           }
         )
+        # only exported when used, so uncached mixers keep their ids
+        if self.inference_cache_size > 0:
+            running[-1]["inference_cache"] = [self.inference_cache_size, self.inference_cache_tolerance]
         return running
 
     def createSimObject(self) -> SimObject:
-        return DownstreamMixer(level_model_id=self.level_model_id, temp_model_id=self.temp_model_id)
+        return DownstreamMixer(level_model_id=self.level_model_id, temp_model_id=self.temp_model_id,
+                               inference_cache_size=self.inference_cache_size, inference_cache_tolerance=self.inference_cache_tolerance)
     
     def getExternalReferences(self) -> list[ExternalReference]:
         return [
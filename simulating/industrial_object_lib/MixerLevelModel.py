@@ -1,9 +1,10 @@
 from simulating.SimObject import Reference
 from simulating.ModeledObject import ModeledObject
+from simulating.InferenceCache import InferenceCache
 import torch
 
 class MixerLevelModel(ModeledObject):
-    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, inlet1_position: Reference, inlet2_position: Reference, outlet_position: Reference, level_out_ref: Reference = None):
+    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, inlet1_position: Reference, inlet2_position: Reference, outlet_position: Reference, level_out_ref: Reference = None, cache: InferenceCache = None, precision: str = "float32"):
         self.level = 0
 
         if level_out_ref is not None:
@@ -17,17 +18,19 @@ class MixerLevelModel(ModeledObject):
         self.inlet1_position = inlet1_position
         self.inlet2_position = inlet2_position
         self.outlet_position = outlet_position
-        super().__init__(model, datapoint_length, cubic, [inlet1_position, inlet2_position, outlet_position, self.level_ref])
+        super().__init__(model, datapoint_length, cubic, [inlet1_position, inlet2_position, outlet_position, self.level_ref], cache=cache, precision=precision)
         self.setInitialState([[0 for _ in range(datapoint_length)],
                               [0 for _ in range(datapoint_length)],
                               [0 for _ in range(datapoint_length)],
                               [0 for _ in range(datapoint_length)]])
         
     def step(self):
-        super().step()
+        assert self.initial_state_set
+        self._shiftWindow()
         if (self.inlet1_position.get() != 100 and self.inlet2_position.get() != 100 and self.outlet_position.get() != 100):
-            pass # level stays the same if all valves are closed
+            pass # level stays the same if all valves are closed, skip the forward pass
         else:
+            self.output = self._infer()
             self.level = min(max(0, self.output[0].item()), 1) * 1000
             if self.level < 20:
                 self.level = 0
@@ -1,10 +1,11 @@
 from simulating.SimObject import Reference
 from simulating.ModeledObject import ModeledObject
+from simulating.InferenceCache import InferenceCache
 import torch
 import random
 
 class MixerTemperatureModel(ModeledObject):
-    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, inlet1_position: Reference, inlet2_position: Reference, outlet_position: Reference, level: Reference, temp_out_ref: Reference = None):
+    def __init__(self, model: torch.nn.Module, datapoint_length: int, cubic: bool, inlet1_position: Reference, inlet2_position: Reference, outlet_position: Reference, level: Reference, temp_out_ref: Reference = None, cache: InferenceCache = None, precision: str = "float32"):
         self.temp = 121
         if temp_out_ref is not None:
             self.temperature_ref = temp_out_ref
@@ -19,7 +20,7 @@ class MixerTemperatureModel(ModeledObject):
         self.level = level
 
 
-        super().__init__(model, datapoint_length, cubic, [inlet1_position, inlet2_position, outlet_position, self.level, self.temperature_ref])
+        super().__init__(model, datapoint_length, cubic, [inlet1_position, inlet2_position, outlet_position, self.level, self.temperature_ref], cache=cache, precision=precision)
         self.setInitialState([[0 for _ in range(datapoint_length)],
                               [0 for _ in range(datapoint_length)],
                               [0 for _ in range(datapoint_length)],
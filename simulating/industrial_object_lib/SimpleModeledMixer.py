@@ -3,11 +3,18 @@ from simulating.industrial_object_lib.Valve import Valve
 from simulating.industrial_object_lib.MixerLevelModel import MixerLevelModel
 from simulating.industrial_object_lib.MixerTemperatureModel import MixerTemperatureModel
 from simulating.SimObject import SimObject, Reference
+from simulating.InferenceCache import InferenceCache
 from simulating.definition.SimulationDefiniton import SimObjectDefn
 from util.Exportable import Exportable, ExportableType
     
 class Mixer(SimObject):
-    def __init__(self, level_model_id: str, temp_model_id: str):
+    """
+    If inference_cache_size > 0, the outputs of the level model are memoized by
+    input window, quantized to inference_cache_tolerance. The temperature model
+    is not cached: it feeds its own output back as an input, with noise about
+    ten times the default tolerance, so its windows almost never repeat.
+    """
+    def __init__(self, level_model_id: str, temp_model_id: str, inference_cache_size: int = 0, inference_cache_tolerance: float = 1e-3):
         self.inlet1 = Valve()
         self.inlet2 = Valve()
         self.outlet = Valve()
@@ -15,12 +22,18 @@ class Mixer(SimObject):
         level_model_defn = Exportable.loadExportable(ExportableType.Model, level_model_id)
         temp_model_defn = Exportable.loadExportable(ExportableType.Model,temp_model_id)
 
-        level_model, _ = TimeSeriersNNRunner(level_model_defn).load()
-        temp_model, _ = TimeSeriersNNRunner(temp_model_defn).load()
+        level_runner = TimeSeriersNNRunner(level_model_defn)
+        temp_runner = TimeSeriersNNRunner(temp_model_defn)
+        level_model, _ = level_runner.load()
+        temp_model, _ = temp_runner.load()
+
+        level_cache = None
+        if inference_cache_size > 0:
+            level_cache = InferenceCache(inference_cache_size, inference_cache_tolerance)
 
         # TODO: Make cubic interpolation of datapoints a base TimeSeriesNNDefn field.
-        self._level_model = MixerLevelModel(level_model, level_model_defn.datapoint_length, False, self.inlet1.position_ref, self.inlet2.position_ref, self.outlet.position_ref)
-        self._temp_model = MixerTemperatureModel(temp_model, temp_model_defn.datapoint_length, False, self.inlet1.position_ref, self.inlet2.position_ref, self.outlet.position_ref, self._level_model.level_ref)
+        self._level_model = MixerLevelModel(level_model, level_model_defn.datapoint_length, False, self.inlet1.position_ref, self.inlet2.position_ref, self.outlet.position_ref, cache=level_cache, precision=level_runner.inference_precision)
+        self._temp_model = MixerTemperatureModel(temp_model, temp_model_defn.datapoint_length, False, self.inlet1.position_ref, self.inlet2.position_ref, self.outlet.position_ref, self._level_model.level_ref, precision=temp_runner.inference_precision)
         self.level = self._level_model.level
         self.temp = self._temp_model.temp
         
@@ -47,12 +60,28 @@ class Mixer(SimObject):
                 [(f"Inlet1.{ref_name}", ref) for ref_name, ref in self.inlet1.getReferences()] + \
                 [(f"Inlet2.{ref_name}", ref) for ref_name, ref in self.inlet2.getReferences()] + \
                 [(f"Outlet.{ref_name}", ref) for ref_name, ref in self.outlet.getReferences()]
+
+    """
+    Hit/miss counters of the level model's inference cache, if enabled. The
+    temperature model is never cached, see above.
+    """
+    def cacheStats(self) -> dict:
+        return {
+            "Level": None if self._level_model.cache is None else self._level_model.cache.stats(),
+        }
     
 class SimpleModeledMixerDefn(SimObjectDefn):
-    def __init__(self, level_model_id, temp_model_id):
-        super().__init__(ref_map={})
+    # defaults for definitions pickled before inference caching existed
+    inference_cache_size = 0
+    inference_cache_tolerance = 1e-3
+
+    def __init__(self, level_model_id, temp_model_id, step_period: int = 1, inference_cache_size: int = 0, inference_cache_tolerance: float = 1e-3,
+                 quiescence_ticks: int = 0, quiescence_tolerance: float = 0.01):
+        super().__init__(ref_map={}, step_period=step_period, quiescence_ticks=quiescence_ticks, quiescence_tolerance=quiescence_tolerance)
         self.level_model_id = level_model_id
         self.temp_model_id = temp_model_id
+        self.inference_cache_size = inference_cache_size
+        self.inference_cache_tolerance = inference_cache_tolerance
 
     def export_keys(self) -> list[dict]:
         running = super().export_keys()
@@ -62,7 +91,11 @@ class SimpleModeledMixerDefn(SimObjectDefn):
             "temp_model_id": self.temp_model_id,
           }
         )
+        # only exported when used, so uncached mixers keep their ids
+        if self.inference_cache_size > 0:
+            running[-1]["inference_cache"] = [self.inference_cache_size, self.inference_cache_tolerance]
         return running
 
     def createSimObject(self) -> SimObject:
-        return Mixer(level_model_id=self.level_model_id, temp_model_id=self.temp_model_id)
\ No newline at end of file
+        return Mixer(level_model_id=self.level_model_id, temp_model_id=self.temp_model_id,
+                     inference_cache_size=self.inference_cache_size, inference_cache_tolerance=self.inference_cache_tolerance)
\ No newline at end of file
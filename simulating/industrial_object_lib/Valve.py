@@ -1,4 +1,5 @@
 from simulating.SimObject import SimObject, Reference
+from simulating.definition.SimulationDefiniton import SimObjectDefn
 
 class Valve(SimObject):
     def __init__(self):
@@ -24,4 +25,15 @@ class Valve(SimObject):
        self.position_ref.update(self.position)
 
     def getReferences(self) -> list[tuple[str, Reference]]:
-        return [("Position", self.position_ref), ("OLS", self.ols_ref), ("CLS", self.cls_ref)]
\ No newline at end of file
+        return [("Position", self.position_ref), ("OLS", self.ols_ref), ("CLS", self.cls_ref)]
+
+"""
+A standalone valve. Valves are cheap to step, so they can run at a shorter
+step period than the modeled objects they feed.
+"""
+class ValveDefn(SimObjectDefn):
+    def __init__(self, step_period: int = 1, quiescence_ticks: int = 0, quiescence_tolerance: float = 0.01):
+        super().__init__(ref_map={}, step_period=step_period, quiescence_ticks=quiescence_ticks, quiescence_tolerance=quiescence_tolerance)
+
+    def createSimObject(self) -> SimObject:
+        return Valve()
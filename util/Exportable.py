@@ -57,7 +57,8 @@ Ex) ModelDefinition(Exportable) -> Model
 This class gives each exportable a unique identifier in their subclass directory.
 """
 class Exportable:
-
+    # the id the object was saved under, set by loadExportable
+    loaded_id = None
 
     def __init__(self):
         raise Exception("Abstract base class")
@@ -138,7 +139,8 @@ class Exportable:
     
     """
     Load the exportable class identified by the id from the class specific
-    subdirectory.
+    subdirectory. The id is kept as loaded_id, since the descriptor of an old
+    file can differ from its id once new parameters are exported.
     """
     def loadExportable(type: ExportableType, id: str):
         prefix = relative_path_prefix(type)
@@ -149,5 +151,6 @@ class Exportable:
         obj = None
         with open(path, "rb") as openfile:
             obj = pickle.load(openfile)
+        obj.loaded_id = id
 
         return obj
@@ -0,0 +1,47 @@
+import numpy as np
+import json
+import os
+
+"""
+A columnar on-disk cache: a directory of raw .npy arrays plus a manifest.json
+describing them. Arrays are memory mapped when read, so loading is nearly
+instant and only the arrays (and the pages of them) that are used are read.
+The manifest is written last, so a directory without one is an interrupted
+write and is treated as missing.
+"""
+
+VERSION = 1
+
+def exists(directory: str) -> bool:
+    return os.path.exists(f"{directory}/manifest.json")
+
+"""
+Mark a cache as incomplete before writing arrays into it by other means than write().
+"""
+def invalidate(directory: str):
+    if exists(directory):
+        os.remove(f"{directory}/manifest.json")
+
+def write(directory: str, arrays: dict[str, np.ndarray], manifest: dict):
+    os.makedirs(directory, exist_ok=True)
+    invalidate(directory)
+    for name, array in arrays.items():
+        # replaced rather than overwritten, readers may have the old array memory mapped
+        with open(f"{directory}/{name}.npy.tmp", "wb") as outfile:
+            np.save(outfile, np.ascontiguousarray(array))
+        os.replace(f"{directory}/{name}.npy.tmp", f"{directory}/{name}.npy")
+    with open(f"{directory}/manifest.json", "w+") as outfile:
+        json.dump({"version": VERSION, "arrays": list(arrays.keys()), **manifest}, outfile, indent=3)
+
+def read_manifest(directory: str) -> dict:
+    with open(f"{directory}/manifest.json", "r") as infile:
+        manifest = json.load(infile)
+    assert manifest["version"] == VERSION, f"Unsupported cache version {manifest['version']} in {directory}"
+    return manifest
+
+"""
+Memory map one array of the cache. The default copy-on-write mode gives
+writable arrays (which torch.from_numpy requires) without touching the file.
+"""
+def read(directory: str, name: str, mmap_mode: str = 'c') -> np.ndarray:
+    return np.load(f"{directory}/{name}.npy", mmap_mode=mmap_mode)
@@ -0,0 +1,120 @@
+from contextlib import contextmanager, nullcontext
+import torch
+import time
+import json
+import sys
+import os
+
+"""
+Per-phase timing of training steps. Code marks its phases with
+
+    with instrumentation.phase("forward"):
+        ...
+
+While torch.profiler is recording, phases show up as labelled ranges in its
+traces. While a PhaseTimer is active (see PhaseTimer.activate) their
+wall-clock durations are added to the timer's current step. Otherwise phase()
+does nothing, so models can mark their internal phases (e.g. spline
+construction and the CDE solve of NeuralCDE) without knowing whether anyone is
+measuring, and without slowing down inference in the simulator. Phases can be nested, a nested phase's
+time is part of the time of its parent.
+"""
+
+# the PhaseTimer collecting the current step, if any
+_active = None
+
+@contextmanager
+def phase(name: str):
+    timer = _active
+    profiling = torch.autograd._profiler_enabled()
+    if timer is None and not profiling:
+        yield
+        return
+    with torch.profiler.record_function(name) if profiling else nullcontext():
+        if timer is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer.add(name, time.perf_counter() - start)
+
+"""
+Memory in use by this process in MB: the current and the peak resident set
+size, and the memory allocated by torch on the GPU if there is one. The
+current size is read from /proc on Linux, elsewhere it needs psutil. The peak
+needs the resource module, which Windows does not have.
+"""
+def memory() -> dict:
+    usage = {}
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as statm:
+            # sizes in pages, the second one is the resident set
+            usage["rss_mb"] = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    else:
+        try:
+            import psutil
+            usage["rss_mb"] = psutil.Process().memory_info().rss / 2**20
+        except ImportError:
+            pass
+    try:
+        import resource
+        # ru_maxrss is in bytes on macOS, in KB elsewhere
+        usage["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        pass
+    if torch.cuda.is_available():
+        usage["cuda_allocated_mb"] = torch.cuda.memory_allocated() / 2**20
+        usage["cuda_max_allocated_mb"] = torch.cuda.max_memory_allocated() / 2**20
+    return usage
+
+"""
+Collects the phase timings of every step and writes one JSON record per step
+to path (JSON lines). Durations are in seconds.
+"""
+class PhaseTimer:
+    def __init__(self, path: str):
+        self.path = path
+        self.current = {}
+        self.totals = {}
+        self.steps = 0
+        self.outfile = None
+
+    def add(self, name: str, seconds: float):
+        self.current[name] = self.current.get(name, 0.0) + seconds
+
+    """
+    Make this the timer phase() reports to, for the duration of the context.
+    """
+    @contextmanager
+    def activate(self):
+        global _active
+        # line buffered, so the steps so far are kept if training is interrupted
+        self.outfile = open(self.path, "w+", buffering=1)
+        previous = _active
+        _active = self
+        try:
+            yield self
+        finally:
+            _active = previous
+            self.outfile.close()
+
+    """
+    Close the current step: write its phases together with extra fields
+    (epoch, batch, ...) and the memory in use, and start the next one.
+    """
+    def step(self, **fields):
+        for name, seconds in self.current.items():
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.outfile.write(json.dumps({**fields, **self.current, **memory()}) + "\n")
+        self.current = {}
+        self.steps += 1
+
+    """
+    Total seconds per phase since the last call, and reset them.
+    """
+    def summary(self) -> dict:
+        totals = self.totals
+        self.totals = {}
+        return totals
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, get_context
+from collections import deque
+import numpy as np
+
+"""
+Process pool execution of per-frame pipeline stages. Frames are numpy arrays, so
+instead of pickling them through the pool's pipes they are copied into shared
+memory blocks, one per chunk of frames, and the workers' outputs come back the
+same way. Results are returned in the order of the input frames.
+"""
+
+"""
+Copy arrays into a new shared memory block. Returns the block and a picklable
+handle describing where each array lives in it.
+"""
+def share(arrays: list[np.ndarray]) -> tuple[shared_memory.SharedMemory, dict]:
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append((offset, array.shape, array.dtype.str))
+        # keep every array 8 byte aligned
+        offset += (array.nbytes + 7) & ~7
+    shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+    for array, (start, shape, dtype) in zip(arrays, layout):
+        np.ndarray(shape, dtype, buffer=shm.buf, offset=start)[...] = array
+    return shm, {"name": shm.name, "layout": layout}
+
+"""
+Map the arrays described by a handle. The views have to be dropped before the
+block is closed.
+"""
+def attach(handle: dict) -> tuple[shared_memory.SharedMemory, list[np.ndarray]]:
+    shm = shared_memory.SharedMemory(name=handle["name"])
+    return shm, [np.ndarray(shape, dtype, buffer=shm.buf, offset=start) for start, shape, dtype in handle["layout"]]
+
+"""
+Copy the arrays out of a block created by another process and free it.
+"""
+def collect(handle: dict) -> list[np.ndarray]:
+    shm, views = attach(handle)
+    arrays = [view.copy() for view in views]
+    del views
+    shm.close()
+    shm.unlink()
+    return arrays
+
+def _run_chunk(function, handle: dict, arity: int, args: tuple) -> tuple[dict, list[int]]:
+    shm, arrays = attach(handle)
+    results = [tuple(function(*arrays[i:i + arity], *args)) for i in range(0, len(arrays), arity)]
+    # outputs may be views of the inputs, so they are copied out before the input block is closed
+    out_shm, out_handle = share([array for result in results for array in result])
+    out_shm.close()
+    arities = [len(result) for result in results]
+    del results, arrays
+    shm.close()
+    return out_handle, arities
+
+def _chunks(frames: list[tuple], count: int) -> list[list[tuple]]:
+    # contiguous chunks of roughly equal size in bytes
+    target = max(1, sum(array.nbytes for frame in frames for array in frame) // count)
+    chunks = [[]]
+    size = 0
+    for frame in frames:
+        if size >= target:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(frame)
+        size += sum(array.nbytes for array in frame)
+    return chunks
+
+"""
+Apply function(*frame, *args) to every frame (a tuple of arrays) and return the
+results (tuples of arrays) in order. The function has to be importable by the
+worker processes, i.e. defined at module level. With workers <= 1 everything
+runs in this process.
+"""
+def map_frames(function, frames: list[tuple[np.ndarray, ...]], workers: int, args: tuple = ()) -> list[tuple[np.ndarray, ...]]:
+    if workers <= 1 or len(frames) <= 1:
+        return [tuple(function(*frame, *args)) for frame in frames]
+
+    chunks = _chunks(frames, workers * 4)
+    results = []
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        try:
+            for chunk in chunks + [None]:
+                # bound the number of input blocks alive at once
+                while len(in_flight) > 0 and (chunk is None or len(in_flight) >= 2 * workers):
+                    shm, future = in_flight.popleft()
+                    out_handle, arities = future.result()
+                    shm.close()
+                    shm.unlink()
+                    arrays = collect(out_handle)
+                    offset = 0
+                    for arity in arities:
+                        results.append(tuple(arrays[offset:offset + arity]))
+                        offset += arity
+                if chunk is None:
+                    break
+                shm, handle = share([array for frame in chunk for array in frame])
+                in_flight.append((shm, executor.submit(_run_chunk, function, handle, len(chunk[0]), args)))
+        finally:
+            for shm, _ in in_flight:
+                shm.close()
+                shm.unlink()
+    return results
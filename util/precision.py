@@ -0,0 +1,38 @@
+import torch
+
+"""
+Numeric precisions models can train and infer in. Weights always stay float32,
+reduced precisions only run the autocast-eligible ops (matmuls, convolutions,
+linear layers, RNN cells) in the lower precision.
+
+bfloat16 has the exponent range of float32, so gradients don't underflow and
+training needs no loss scaling. float16 does, see scaler.
+"""
+
+PRECISIONS = {
+    "float32": None,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+def check(precision: str):
+    assert precision in PRECISIONS, f"Unsupported precision '{precision}', use one of {list(PRECISIONS.keys())}"
+
+"""
+Context manager running the enclosed forward passes in the given precision.
+Does nothing for float32.
+"""
+def autocast(precision: str, device_type: str = "cpu"):
+    check(precision)
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return torch.autocast(device_type, enabled=False)
+    return torch.autocast(device_type, dtype=dtype)
+
+"""
+Loss scaler for training in the given precision, only enabled where it is
+needed (float16). A disabled scaler passes the loss and the step through.
+"""
+def scaler(precision: str, device_type: str = "cpu") -> torch.amp.GradScaler:
+    check(precision)
+    return torch.amp.GradScaler(device_type, enabled=precision == "float16")